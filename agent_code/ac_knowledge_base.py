@@ -25,8 +25,8 @@ def remove_kb_node():
     pass
 
 
-def remove_kb_edge():
-    pass
+def remove_kb_edge(edge_label: String, start_node_id: Number, end_node_id: Number):
+    return kb.delete_edge(edge_label, start_node_id, end_node_id)
 
 
 def get_kb_node():
@@ -42,14 +42,20 @@ def find_concept(concept_id: String):
 
 
 def create_kb_concept(concept_id: String):
-    node_id = create_kb_node("Concept")
-    set_kb_node_field(node_id, 'name', concept_id)
-    return node_id
+    node = kb.new_concept(concept_id, 0, 0)
+    return node.id
 
 
 def upsert_kb_concept(concept_id: String):
-    concept = find_concept(concept_id)
-    if concept:
-        return concept.id
-    
-    return create_kb_concept(concept_id)
\ No newline at end of file
+    node = kb.upsert_concept(concept_id, 0, 0)
+    return node.id
+
+
+def upsert_kb_subconcept(concept_id: String, parent_concept_id: String):
+    # both concepts and the edge are written in one transaction
+    uow = kb.unit_of_work()
+    child = uow.upsert_concept(concept_id, 0, 0)
+    parent = uow.upsert_concept(parent_concept_id, 0, 0)
+    uow.upsert_edge("parent", child.id, parent.id, {})
+    uow.commit()
+    return uow.resolve(child.id)
\ No newline at end of file
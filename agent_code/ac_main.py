@@ -19,16 +19,9 @@ def react_on_user_message(sentence: IsQuestionStatement):
 
     
 def react_on_user_message(sentence: IsAStatement):
-    node_id1 = upsert_kb_concept(
+    upsert_kb_subconcept(
         concept_id=sentence.fields.left.concept_name,
-    )
-    node_id2 = upsert_kb_concept(
-        concept_id=sentence.fields.right.concept_name,
-    )
-    upsert_kb_edge(
-        edge_label="parent",
-        start_node_id=node_id1,
-        end_node_id=node_id2,
+        parent_concept_id=sentence.fields.right.concept_name,
     )
 
 
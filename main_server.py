@@ -1,6 +1,7 @@
 import asyncio
 from functools import partial
 import json
+import re
 
 import hmap
 import websockets
@@ -15,20 +16,20 @@ from hmap import (
 from environments import CircuitWorld
 from prototyping.lrd_traversal import traverse_lrd
 from src.agent_core import AgentCore
-from src.knowledge_base.module import KBEdgeType, KnowledgeBase
+from src.knowledge_base.async_kb import AsyncKnowledgeBase
+from src.knowledge_base.module import KnowledgeBase
 from src.knowledge_base.reverse_specialisation import reverse_specialise
 from src.world_model.instance import Instance
 
 
 def get_word_concepts(word, kb: KnowledgeBase):
-    word_node = kb.get_word(word)
-    if word_node is None:
-        return []
-    concepts = kb.out(word_node.id, KBEdgeType.ASSOCIATED)
-    return [
-        concept.data["name"]
-        for concept in concepts
-    ]
+    """ From the dictionary of all words that the KB keeps in memory """
+    return list(kb.word_concepts().get(word, ()))
+
+
+async def prefetch_word_concepts(msg: str, kb: AsyncKnowledgeBase) -> dict[str, list[str]]:
+    """ Looks up all words of the message in one query """
+    return await kb.get_word_concepts_many(re.findall(r'\w+', msg))
 
 
 pattern_map = PatternMap.from_list([
@@ -136,6 +137,7 @@ def setup(world_type, client_event_queue):
     agent = AgentCore()
     agent.action_manager.interpreter.global_vars["api"] = world.api
     HIERARCHY = agent.knowledge_base.hierarchy
+    agent.knowledge_base.word_concepts()
     
     btn = world.api.create("Switch")
     led = world.api.create("LED")
@@ -200,37 +202,73 @@ def _match_to_instance(match: Match, tree) -> Instance:
     })
 
 
-async def process_message(msg: str, agent: AgentCore):
-    is_ok, tree = hmap.parse_sentence(
-        msg, 
+async def parse_message(msg: str, kb: KnowledgeBase, async_kb: AsyncKnowledgeBase):
+    if kb.word_concepts_loaded():
+        return hmap.parse_sentence(
+            msg, 
+            pattern_map,
+            HIERARCHY,
+            partial(get_word_concepts, kb=kb),
+        )
+
+    # the message is resolved with one query while the dictionary loads
+    await async_kb.step()
+    word_concepts = await prefetch_word_concepts(msg, async_kb)
+    loop = asyncio.get_running_loop()
+
+    def lookup_word_concepts(word):
+        # the parser may split words differently, it runs in a worker
+        # thread so those are looked up with the async KB on the loop
+        try:
+            return word_concepts[word]
+        except KeyError:
+            return asyncio.run_coroutine_threadsafe(
+                async_kb.get_word_concepts_many([word]), loop,
+            ).result()[word]
+
+    return await loop.run_in_executor(None, partial(
+        hmap.parse_sentence,
+        msg,
         pattern_map,
         HIERARCHY,
-        partial(
-            get_word_concepts,
-            kb=agent.knowledge_base,
-        )
-    )
-    matches = tree.get_matches()
-    
-    if not is_ok or len(matches) != 1:
-        print("can't parse")
-        from pprint import pprint
-        pprint(matches)
-        return
-    
-    instance = _match_to_instance(matches[0], tree)
-    print(instance)
-    
-    agent.input_processor.send_event(Instance("UserSaidEvent", {
-        "sentence": instance,
-    }))
+        lookup_word_concepts,
+    ))
+
+
+async def process_message(msg: str, agent: AgentCore, async_kb: AsyncKnowledgeBase):
+    kb = agent.knowledge_base
+    loading = None
+    if not kb.word_concepts_loaded():
+        # a write dropped the dictionary, it's loaded again in the background
+        loading = asyncio.get_running_loop().run_in_executor(None, kb.word_concepts)
+
+    try:
+        is_ok, tree = await parse_message(msg, kb, async_kb)
+        matches = tree.get_matches()
+        
+        if not is_ok or len(matches) != 1:
+            print("can't parse")
+            from pprint import pprint
+            pprint(matches)
+            return
+        
+        instance = _match_to_instance(matches[0], tree)
+        print(instance)
+        
+        agent.input_processor.send_event(Instance("UserSaidEvent", {
+            "sentence": instance,
+        }))
+    finally:
+        if loading is not None:
+            await loading
 
 
 def process_env_click(component_id, world, agent):
     world.api.press(component_id)
 
 
-async def run_agent(client_event_queue: asyncio.Queue, server_event_queue: asyncio.Queue):
+async def run_agent(client_event_queue: asyncio.Queue, server_event_queue: asyncio.Queue,
+                    async_kb: AsyncKnowledgeBase):
     world, agent = setup(CircuitWorld, client_event_queue)
     agent.action_manager.interpreter.global_vars["_print"] = print
     agent.action_manager.interpreter.global_vars["traverse_lrd"] = traverse_lrd
@@ -239,7 +277,7 @@ async def run_agent(client_event_queue: asyncio.Queue, server_event_queue: async
         queue=server_event_queue,
     )
     
-    # await process_message("turn on the led", agent)
+    # await process_message("turn on the led", agent, async_kb)
     
     idx = 0
     while True:
@@ -267,7 +305,7 @@ async def run_agent(client_event_queue: asyncio.Queue, server_event_queue: async
         try:
             evt = client_event_queue.get_nowait()
             if evt['type'] == 'message':
-                await process_message(evt['data'], agent)
+                await process_message(evt['data'], agent, async_kb)
             elif evt['type'] == 'env_click':
                 await process_env_click(evt['data'], world, agent)
         except asyncio.QueueEmpty:
@@ -314,9 +352,9 @@ async def main():
         client_event_queue=client_event_queue,
         server_event_queue=server_event_queue,
     )
-    async with websockets.serve(callback, "localhost", 8382):
+    async with AsyncKnowledgeBase() as async_kb, websockets.serve(callback, "localhost", 8382):
         await asyncio.gather(
-            run_agent(client_event_queue, server_event_queue),
+            run_agent(client_event_queue, server_event_queue, async_kb),
             send_server_events(clients_list, server_event_queue),
         )
 
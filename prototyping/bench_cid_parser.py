@@ -0,0 +1,82 @@
+"""
+Compares the cid scanner in src.knowledge_base.concept with the old
+regex tokenizer on nested cids.
+
+    python -m prototyping.bench_cid_parser [depth] [width]
+
+The old parser is copied here as it was, both of them create the same
+interned Concepts, so the difference is only in the tokenizing/parsing.
+"""
+import re
+import sys
+import timeit
+
+from src.knowledge_base.concept import Concept, iter_cids, parse_cid
+
+
+cid_pattern = re.compile(r'\w+|[!"#$%&\'()*+,\-./:;<=>?@[\]^_`{|}~]')
+
+
+def regex_from_tokens(tokens: list[str]) -> Concept:
+    name = tokens.pop()
+
+    fields = {}
+
+    if not tokens or tokens[-1] != '{':
+        return Concept(name)
+
+    tokens.pop()  # {
+    while tokens:
+        field_name = tokens.pop()
+        if field_name == '}':
+            break
+        tokens.pop()  # '='
+        field_value = regex_from_tokens(tokens)
+        fields[field_name] = field_value
+        if tokens and tokens[-1] == ',':
+            tokens.pop()
+
+    return Concept(name, fields)
+
+
+def regex_parse_cid(cid: str) -> Concept:
+    return regex_from_tokens(re.findall(cid_pattern, cid.strip())[::-1])
+
+
+def nested_cid(depth: int, width: int, prefix: str = "C") -> str:
+    if depth == 0:
+        return f"{prefix}Leaf"
+    fields = ",".join(
+        f"field{i}={nested_cid(depth - 1, width, f'{prefix}{i}')}"
+        for i in range(width)
+    )
+    return f"{prefix}Node{{{fields}}}"
+
+
+def bench(name: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name:<28} {seconds / number * 1e6:10.2f} us")
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    annotation = "ActOnReferencedEntityStatement{reference=DefiniteEntityReference}"
+    cid = nested_cid(depth, width)
+    buffer = "\n".join([cid] * 100)
+
+    assert regex_parse_cid(cid) is parse_cid(cid)
+    assert regex_parse_cid(annotation) is parse_cid(annotation)
+
+    print(f"nested cid: depth={depth}, width={width}, {len(cid)} characters")
+    bench("regex, annotation", lambda: regex_parse_cid(annotation), 20000)
+    bench("scanner, annotation", lambda: parse_cid(annotation), 20000)
+    bench("regex, nested", lambda: regex_parse_cid(cid), 200)
+    bench("scanner, nested", lambda: parse_cid(cid), 200)
+    bench("regex, 100 nested", lambda: [regex_parse_cid(line) for line in buffer.split("\n")], 5)
+    bench("iter_cids, 100 nested", lambda: list(iter_cids(buffer)), 5)
+
+
+if __name__ == "__main__":
+    main()
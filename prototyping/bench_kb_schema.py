@@ -0,0 +1,75 @@
+"""
+Lookup cost of find_concept and get_word with and without the uniqueness
+constraints that KnowledgeBase.ensure_schema() creates.
+
+    python -m prototyping.bench_kb_schema [count]
+
+Adds `count` :Concept and :Word nodes named "__bench_<i>", drops the
+constraints on Concept.name and Word.value, times uncached lookups, then
+runs ensure_schema() and times them again. The bench nodes are deleted
+at the end. Run it against a scratch database: the constraints are
+created again, but other agents see the KB without them in the meantime.
+"""
+import random
+import sys
+import timeit
+
+from neomodel import db
+
+from src.knowledge_base import cypher
+from src.knowledge_base.module import KnowledgeBase
+
+
+PREFIX = "__bench_"
+FIND_CONCEPT_QUERY = cypher.find_nodes_query("Concept", ("name", ))
+
+CONSTRAINT_NAMES_QUERY = (
+    "SHOW CONSTRAINTS YIELD name, labelsOrTypes, properties "
+    "WHERE labelsOrTypes IN [['Concept'], ['Word']] "
+    "AND properties IN [['name'], ['value']] RETURN name"
+)
+DELETE_BENCH_NODES_QUERY = (
+    "MATCH (a) WHERE (a:Concept AND a.name STARTS WITH $prefix) "
+    "OR (a:Word AND a.value STARTS WITH $prefix) DETACH DELETE a"
+)
+
+
+def bench(name: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print(f"{name:<28} {seconds / number * 1e6:10.2f} us")
+
+
+def lookups(names: list[str]):
+    for name in names:
+        db.cypher_query(FIND_CONCEPT_QUERY, {"filters": {"name": name}})
+        db.cypher_query(cypher.GET_WORD_QUERY, {"value": name})
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+    names = [f"{PREFIX}{i}" for i in range(count)]
+    kb.bulk_upsert(
+        nodes=[("Concept", {"name": name}) for name in names] +
+              [("Word", {"value": name}) for name in names],
+    )
+    sample = random.sample(names, 100)
+
+    try:
+        results, _ = db.cypher_query(CONSTRAINT_NAMES_QUERY)
+        for name, in results:
+            db.cypher_query(f"DROP CONSTRAINT {cypher.check_identifier(name)}")
+        print(f"{count} concepts and words, missing constraints: {kb.check_schema()}")
+        bench("100 find_concept + get_word", lambda: lookups(sample), 1)
+
+        kb.ensure_schema()
+        print(f"after ensure_schema, missing constraints: {kb.check_schema()}")
+        bench("100 find_concept + get_word", lambda: lookups(sample), 1)
+    finally:
+        db.cypher_query(DELETE_BENCH_NODES_QUERY, {"prefix": PREFIX})
+        kb.ensure_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" Loads words and their concepts from the parser caches into the KB
+
+Word nodes are connected to their concepts with `associated` edges
+and every `Name_Parent` concept gets a `parent` edge to `Parent`,
+same as the hierarchy the parser builds in main.py.
+"""
+import json
+
+from src.knowledge_base import KnowledgeBase
+from src.knowledge_base.module import report_progress
+
+
+cache_paths = [
+    './prototyping/grass_parser_v2/word_concept_cache.json',
+    './prototyping/grass_parser_v2/word_concept_cache2.json',
+]
+words_path = './prototyping/10000_words.txt'
+
+
+def main():
+    nodes = []
+    edges = []
+
+    with open(words_path, 'r') as f:
+        for word in f.read().split('\n'):
+            word = word.strip()
+            if word:
+                nodes.append(("Word", {"value": word}))
+
+    for cache_path in cache_paths:
+        with open(cache_path, 'r') as f:
+            known_tokens = json.load(f)['tokens']
+
+        for token, concepts in known_tokens.items():
+            word = token.strip()
+            nodes.append(("Word", {"value": word}))
+
+            for concept in concepts:
+                nodes.append(("Concept", {"name": concept, "_meta": '{"x": 0, "y": 0}'}))
+                edges.append(("associated", ("Word", word), concept))
+
+                try:
+                    parent = concept.split("_")[1]
+                except IndexError:
+                    continue
+
+                nodes.append(("Concept", {"name": parent, "_meta": '{"x": 0, "y": 0}'}))
+                edges.append(("parent", concept, parent))
+
+    kb = KnowledgeBase(None)
+    kb.bulk_upsert(nodes, edges, progress=report_progress)
+
+
+if __name__ == "__main__":
+    main()
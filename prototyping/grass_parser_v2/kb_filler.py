@@ -1,6 +1,7 @@
 import json
 import openai
 from src.knowledge_base import KnowledgeBase
+from src.knowledge_base.module import report_progress
 
 
 cache_path = "./prototyping/grass_parser_v2/kb_filler_cache.json"
@@ -34,9 +35,22 @@ themes = [
     ("color description (e.g. bright)", "ColorDescription", 10),
 ]
 
+
+def concept_data(name, x, y):
+    return {
+        "name": name,
+        "_meta": json.dumps({
+            "x": x,
+            "y": y,
+        }),
+    }
+
+
 kb = KnowledgeBase(None)
 
 y = 5000
+nodes = []
+edges = []
 
 
 for theme, parent_name, count in themes:
@@ -81,11 +95,14 @@ for theme, parent_name, count in themes:
             json.dump(cache, f)
 
     mean_x = x + 200 * (len(concept_names) - 1) / 2 + 200
-    parent = kb.upsert_concept(parent_name, mean_x, y - 400)
+    nodes.append(("Concept", concept_data(parent_name, mean_x, y - 400)))
 
     for concept_name in concept_names:
         x += 200
-        concept = kb.upsert_concept(f"{concept_name}_{parent_name}", x, y)
-        kb.upsert_edge("parent", concept.id, parent.id, {})
+        nodes.append(("Concept", concept_data(f"{concept_name}_{parent_name}", x, y)))
+        edges.append(("parent", f"{concept_name}_{parent_name}", parent_name))
 
     y += 1000
+
+
+kb.bulk_upsert(nodes, edges, progress=report_progress)
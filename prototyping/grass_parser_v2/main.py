@@ -289,8 +289,9 @@ class Tree:
             pass
 
         new_idx = idx
+        match_parents = hierarchy.get_parents_many(match.concept for match in matches)
         for match, node in zip(matches, pattern_nodes):
-            if node not in hierarchy.get_parents(match.concept):
+            if node not in match_parents[match.concept]:
                 print('not equal!!')
                 if new_idx == idx:
                     if self.tree_locations:
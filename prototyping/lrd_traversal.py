@@ -1,5 +1,5 @@
 import abc
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import enum
 from typing import Self
 
@@ -21,8 +21,11 @@ load_dotenv()
 kb = KnowledgeBase(None)
 
 
+@dataclass
 class LRDNode(abc.ABC):
-    pass
+    # what the node reads its neighbours from, the ConceptBundle of the
+    # concept it was reached from, which reads what it doesn't hold from the kb
+    graph: object = field(repr=False, compare=False)
 
 
 @dataclass
@@ -31,25 +34,25 @@ class Concept(LRDNode):
     node_id: str
 
     @classmethod
-    def from_name(cls, name: str):
-        concept_node = kb.find_concept(name)
-        return cls(name, concept_node.id)
+    def from_name(cls, kb, name: str):
+        """ Reads the LRD subgraph of the concept in one query, the LRD
+        nodes reached from it are then resolved from memory
+        """
+        bundle = kb.get_concept_bundle(name)
+        return cls(bundle, name, bundle.concept.id)
     
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.data['name'], node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.data['name'], node.id)
 
     def get_fields(self):
-        field_nodes = kb.out_dict2(self.node_id, KBEdgeType.FIELD_NODE)
-        
         return {
-            key: ConceptField.from_node(field_nodes)
-            for key, field_nodes in field_nodes.items()
+            key: ConceptField.from_node(self.graph, field_node)
+            for key, field_node in self.graph.get_fields(self.node_id).items()
         }
     
     def get_field(self, name: str) -> 'ConceptField':
-        field_nodes = kb.out_dict2(self.node_id, KBEdgeType.FIELD_NODE)
-        return ConceptField.from_node(field_nodes[name])
+        return ConceptField.from_node(self.graph, self.graph.get_fields(self.node_id)[name])
 
 
 @dataclass
@@ -58,25 +61,25 @@ class ConceptField(LRDNode):
     name: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id, node.data['name'])
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id, node.data['name'])
 
     def get_concept(self) -> Concept:
-        concept_nodes = kb.in_(self.node_id, KBEdgeType.FIELD_NODE)
+        concept_nodes = self.graph.in_(self.node_id, KBEdgeType.FIELD_NODE)
         assert len(concept_nodes) == 1
-        return Concept.from_node(concept_nodes[0])
+        return Concept.from_node(self.graph, concept_nodes[0])
     
     def get_getters(self) -> list['ConceptFieldGetter']:
-        getter_nodes = kb.out(self.node_id, KBEdgeType.FIELD_GETTER)
+        getter_nodes = self.graph.out(self.node_id, KBEdgeType.FIELD_GETTER)
         return [
-            ConceptFieldGetter.from_node(getter_node)
+            ConceptFieldGetter.from_node(self.graph, getter_node)
             for getter_node in getter_nodes
         ]
     
     def get_setters(self) -> list['ConceptFieldSetter']:
-        setter_nodes = kb.in_(self.node_id, KBEdgeType.FIELD_SETTER_TARGET)
+        setter_nodes = self.graph.in_(self.node_id, KBEdgeType.FIELD_SETTER_TARGET)
         return [
-            ConceptFieldSetter.from_node(setter_node)
+            ConceptFieldSetter.from_node(self.graph, setter_node)
             for setter_node in setter_nodes
         ]
     
@@ -84,9 +87,9 @@ class ConceptField(LRDNode):
         """ Returns actions that update this field
         This is a temporary(?) solution for easier traversal
         """
-        setter_nodes = kb.out(self.node_id, KBEdgeType.FIELD_SETTER_ACTION)
+        setter_nodes = self.graph.out(self.node_id, KBEdgeType.FIELD_SETTER_ACTION)
         return [
-            OnActionLRDNode.from_node(setter_node)
+            OnActionLRDNode.from_node(self.graph, setter_node)
             for setter_node in setter_nodes
         ]
     
@@ -94,9 +97,9 @@ class ConceptField(LRDNode):
         """ Returns events that update this field
         This is a temporary(?) solution for easier traversal
         """
-        setter_nodes = kb.out(self.node_id, KBEdgeType.FIELD_SETTER_EVENT)
+        setter_nodes = self.graph.out(self.node_id, KBEdgeType.FIELD_SETTER_EVENT)
         return [
-            OnEventLRDNode.from_node(setter_node)
+            OnEventLRDNode.from_node(self.graph, setter_node)
             for setter_node in setter_nodes
         ]
 
@@ -106,21 +109,21 @@ class LRDLogicNode(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
 
 
 @dataclass
 class BinaryLRDLogicNode(LRDLogicNode):    
     def get_left(self):
-        left = kb.out(self.node_id, KBEdgeType.CONDITION_LEFT)
+        left = self.graph.out(self.node_id, KBEdgeType.CONDITION_LEFT)
         assert len(left) == 1
-        return get_logic_value_node(left[0])
+        return get_logic_value_node(self.graph, left[0])
     
     def get_right(self):
-        left = kb.out(self.node_id, KBEdgeType.CONDITION_RIGHT)
+        left = self.graph.out(self.node_id, KBEdgeType.CONDITION_RIGHT)
         assert len(left) == 1
-        return get_logic_value_node(left[0])
+        return get_logic_value_node(self.graph, left[0])
     
 
 
@@ -135,12 +138,12 @@ class ChangeFieldLRDNode(LRDLogicNode):
     change_type: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id, node.data['name'])
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id, node.data['name'])
     
     def get_value(self):
-        value = kb.out_one(self.node_id, KBEdgeType.FIELD_CHANGE_VALUE)
-        return get_logic_value_node(value)
+        value = self.graph.out_one(self.node_id, KBEdgeType.FIELD_CHANGE_VALUE)
+        return get_logic_value_node(self.graph, value)
 
 
 @dataclass
@@ -159,26 +162,26 @@ class LRDConstant(LRDNode):
     value: any
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id, node.data['name'])
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id, node.data['name'])
 
 
-def get_logic_value_node(node: KBNode):
+def get_logic_value_node(graph, node: KBNode):
     if node.label == 'ObjectField':
-        return ConceptInstanceField.from_node(node)
+        return ConceptInstanceField.from_node(graph, node)
     elif node.label == 'Constant':
-        return LRDConstant.from_node(node)
+        return LRDConstant.from_node(graph, node)
     else:
         raise NotImplementedError(f"Unknown logic value node type: {node.label}")
     
 
-def get_logic_node(node: KBNode):
+def get_logic_node(graph, node: KBNode):
     if node.label == 'Condition':
-        return ConditionLRDNode.from_node(node)
+        return ConditionLRDNode.from_node(graph, node)
     elif node.label == 'ChangeField':
-        return ChangeFieldLRDNode.from_node(node)
+        return ChangeFieldLRDNode.from_node(graph, node)
     elif node.label == 'TriggerEvent':
-        return TriggerEventLRDNode.from_node(node)
+        return TriggerEventLRDNode.from_node(graph, node)
     else:
         raise NotImplementedError(f"Unknown logic node type: {node.label}")
 
@@ -188,18 +191,18 @@ class ConceptFieldGetter(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
     def get_instance(self) -> 'ConceptInstance':
-        instance_nodes = kb.out(self.node_id, KBEdgeType.GETTER_INSTANCE)
+        instance_nodes = self.graph.out(self.node_id, KBEdgeType.GETTER_INSTANCE)
         assert len(instance_nodes) == 1
-        return ConceptInstance.from_node(instance_nodes[0])
+        return ConceptInstance.from_node(self.graph, instance_nodes[0])
 
     def get_logic(self):
-        logic_nodes = kb.out(self.node_id, KBEdgeType.GETTER_LOGIC)
+        logic_nodes = self.graph.out(self.node_id, KBEdgeType.GETTER_LOGIC)
         assert len(logic_nodes) == 1
-        return get_logic_node(logic_nodes[0])
+        return get_logic_node(self.graph, logic_nodes[0])
     
 
 @dataclass
@@ -207,8 +210,8 @@ class ConceptFieldSetter(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
 
 @dataclass
@@ -216,20 +219,20 @@ class OnActionLRDNode(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
     def get_concept(self) -> Concept:
-        concept_node = kb.out_one(self.node_id, KBEdgeType.ON_ACTION_CONCEPT)
-        return Concept.from_node(concept_node)
+        concept_node = self.graph.out_one(self.node_id, KBEdgeType.ON_ACTION_CONCEPT)
+        return Concept.from_node(self.graph, concept_node)
     
     def get_logic(self):
-        logic_node = kb.out_one(self.node_id, KBEdgeType.ON_ACTION_LOGIC)
-        return get_logic_node(logic_node)
+        logic_node = self.graph.out_one(self.node_id, KBEdgeType.ON_ACTION_LOGIC)
+        return get_logic_node(self.graph, logic_node)
     
     def get_object(self) -> 'ConceptInstance':
-        instance_node = kb.out_one(self.node_id, KBEdgeType.ON_ACTION_OBJECT)
-        return ConceptInstance.from_node(instance_node)
+        instance_node = self.graph.out_one(self.node_id, KBEdgeType.ON_ACTION_OBJECT)
+        return ConceptInstance.from_node(self.graph, instance_node)
     
 
 @dataclass
@@ -237,72 +240,93 @@ class OnEventLRDNode(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
     def get_concept(self) -> Concept:
-        concept_node = kb.out_one(self.node_id, KBEdgeType.ON_EVENT_CONCEPT)
-        return Concept.from_node(concept_node)
+        concept_node = self.graph.out_one(self.node_id, KBEdgeType.ON_EVENT_CONCEPT)
+        return Concept.from_node(self.graph, concept_node)
     
     def get_logic(self):
-        logic_node = kb.out_one(self.node_id, KBEdgeType.ON_EVENT_LOGIC)
-        return get_logic_node(logic_node)
+        logic_node = self.graph.out_one(self.node_id, KBEdgeType.ON_EVENT_LOGIC)
+        return get_logic_node(self.graph, logic_node)
     
     def get_object(self) -> 'ConceptInstance':
-        instance_node = kb.out_one(self.node_id, KBEdgeType.ON_EVENT_OBJECT)
-        return ConceptInstance.from_node(instance_node)
+        instance_node = self.graph.out_one(self.node_id, KBEdgeType.ON_EVENT_OBJECT)
+        return ConceptInstance.from_node(self.graph, instance_node)
 
 
 @dataclass
-class ConceptInstance:
+class ConceptInstance(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
     def get_fields(self):
-        field_nodes = kb.out(self.node_id, KBEdgeType.INSTANCE_FIELD)
+        field_nodes = self.graph.out(self.node_id, KBEdgeType.INSTANCE_FIELD)
         
         return [
-            ConceptInstanceField.from_node(field_node)
+            ConceptInstanceField.from_node(self.graph, field_node)
             for field_node in field_nodes
         ]
 
 
 @dataclass
-class ConceptInstanceField:
+class ConceptInstanceField(LRDNode):
     node_id: str
 
     @classmethod
-    def from_node(cls, node: KBNode) -> Self:
-        return cls(node.id)
+    def from_node(cls, graph, node: KBNode) -> Self:
+        return cls(graph, node.id)
     
     def get_concept_field(self) -> ConceptField:
-        field_nodes = kb.out(self.node_id, KBEdgeType.FIELD_CONCEPT_FIELD)
+        field_nodes = self.graph.out(self.node_id, KBEdgeType.FIELD_CONCEPT_FIELD)
         assert len(field_nodes) == 1
-        return ConceptField.from_node(field_nodes[0])
+        return ConceptField.from_node(self.graph, field_nodes[0])
     
     def get_sub_fields(self) -> list[Self]:
-        field_nodes = kb.out(self.node_id, KBEdgeType.INSTANCE_FIELD)
+        field_nodes = self.graph.out(self.node_id, KBEdgeType.INSTANCE_FIELD)
         return [
-            ConceptInstanceField.from_node(field_node)
+            ConceptInstanceField.from_node(self.graph, field_node)
             for field_node in field_nodes
         ]
 
 
+def get_concept_fields(graph, fields: list[ConceptInstanceField]) -> list[ConceptField]:
+    """ ConceptInstanceField.get_concept_field of every field, read in one batch """
+    field_nodes = graph.out_many(
+        [field.node_id for field in fields], KBEdgeType.FIELD_CONCEPT_FIELD)
+    result = []
+    for field in fields:
+        assert len(field_nodes[field.node_id]) == 1
+        result.append(ConceptField.from_node(graph, field_nodes[field.node_id][0]))
+    return result
+
+
+def get_concepts(graph, lrd_nodes: list, edge_type: KBEdgeType) -> list[Concept]:
+    """ get_concept of every event or action node, read in one batch """
+    concept_nodes = graph.out_many([lrd_node.node_id for lrd_node in lrd_nodes], edge_type)
+    result = []
+    for lrd_node in lrd_nodes:
+        assert len(concept_nodes[lrd_node.node_id]) == 1
+        result.append(Concept.from_node(graph, concept_nodes[lrd_node.node_id][0]))
+    return result
+
+
 @dataclass
 class TriggerEventLRDNode(LRDLogicNode):
     def get_object(self) -> ConceptInstance | ConceptInstanceField:
-        instance_node = kb.out_one(self.node_id, KBEdgeType.TRIGGER_EVENT_OBJECT)
+        instance_node = self.graph.out_one(self.node_id, KBEdgeType.TRIGGER_EVENT_OBJECT)
         if instance_node.label == 'ObjectField':
-            return ConceptInstanceField.from_node(instance_node)
+            return ConceptInstanceField.from_node(self.graph, instance_node)
         else:
-            return ConceptInstance.from_node(instance_node)
+            return ConceptInstance.from_node(self.graph, instance_node)
         
     def get_concept(self) -> Concept:
-        concept_node = kb.out_one(self.node_id, KBEdgeType.TRIGGER_EVENT_CONCEPT)
-        return Concept.from_node(concept_node)
+        concept_node = self.graph.out_one(self.node_id, KBEdgeType.TRIGGER_EVENT_CONCEPT)
+        return Concept.from_node(self.graph, concept_node)
 
 
 def build_lrd_obj_map(lrd_node: LRDNode, instance: Instance, result = None):
@@ -313,8 +337,7 @@ def build_lrd_obj_map(lrd_node: LRDNode, instance: Instance, result = None):
         result[lrd_node.node_id] = instance
         fields = lrd_node.get_fields()
 
-        for field in fields:
-            concept_field = field.get_concept_field()
+        for field, concept_field in zip(fields, get_concept_fields(lrd_node.graph, fields)):
             instance_field = Instance("InstanceField", {
                 "instance": instance,
                 "field": concept_field.name,
@@ -328,8 +351,7 @@ def build_lrd_obj_map(lrd_node: LRDNode, instance: Instance, result = None):
             )
     elif isinstance(lrd_node, ConceptInstanceField):
         sub_fields = lrd_node.get_sub_fields()
-        for field in sub_fields:
-            concept_field = field.get_concept_field()
+        for field, concept_field in zip(sub_fields, get_concept_fields(lrd_node.graph, sub_fields)):
             instance_field = Instance("InstanceField", {
                 "instance": instance,
                 "field": concept_field.name,
@@ -441,7 +463,7 @@ def find_options_for_event_goal(kb, goal) -> Instance:
     out_fields = goal.fields.instance.out_fields.get()
 
     for out_instance, out_field in out_fields:
-        con = Concept.from_name(out_instance.concept_name)
+        con = Concept.from_name(kb, out_instance.concept_name)
 
         try:
             field = con.get_field(out_field.name)
@@ -451,8 +473,8 @@ def find_options_for_event_goal(kb, goal) -> Instance:
         # find events that trigger this event
         events = field.get_setter_events()
 
-        for event in events:
-            if event.get_concept().name != goal.fields.event:
+        for event, concept in zip(events, get_concepts(field.graph, events, KBEdgeType.ON_EVENT_CONCEPT)):
+            if concept.name != goal.fields.event:
                 continue
 
             evt_obj = event.get_object()
@@ -495,7 +517,7 @@ def find_options_for_equality_goal(kb: KnowledgeBase, goal: Instance) -> Instanc
 
     reverse_specialise(target_instance, kb)
 
-    con = Concept.from_name(target_instance.concept_name)
+    con = Concept.from_name(kb, target_instance.concept_name)
     field = con.get_field(goal.fields.instance.fields.field)
 
     # find events that set this field
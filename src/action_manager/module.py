@@ -4,7 +4,7 @@ import agci
 
 from src.base_module import AgentModule
 from src.knowledge_base.concept import Concept
-from src.knowledge_base.hierarchy import PlainHierarchy, is_child
+from src.knowledge_base.hierarchy import PlainHierarchy, SubsumptionChecker
 from src.knowledge_base.module import KBEdgeDirection, KBEdgeType
 from src.world_model.instance import Instance
 from src.world_model.wm_entities import InstanceReference
@@ -17,6 +17,7 @@ class InterpreterWithConceptDispatch(agci.StepInterpreter):
     def __init__(self, global_vars: dict[str, any], core):
         super().__init__(global_vars)
         self.core = core
+        self.subsumption = SubsumptionChecker(HIERARCHY)
     
     def dispatch_check_param_types(self, param_type, arg_value):
         if isinstance(arg_value, InstanceReference):
@@ -33,7 +34,7 @@ class InterpreterWithConceptDispatch(agci.StepInterpreter):
         arg_concept = arg_value.get_concept()
         param_concept = Concept.from_cid(param_type)
         
-        return is_child(HIERARCHY, arg_concept, param_concept), arg_value
+        return self.subsumption.is_child(arg_concept, param_concept), arg_value
 
 
 def debug(*args):
@@ -3,13 +3,16 @@ from src.input_processor import InputProcessor
 from src.decision_maker import DecisionMaker
 from src.action_manager import ActionManager
 from src.world_model import WorldModel
-from src.knowledge_base import KnowledgeBase
+from src.knowledge_base import KnowledgeBase, SnapshotKnowledgeBase, KB_SNAPSHOT
 from src.unified_graph.graph import UGraph
 
 
 class AgentCore:
     def __init__(self):
-        self.knowledge_base = KnowledgeBase(self)
+        if KB_SNAPSHOT:
+            self.knowledge_base = SnapshotKnowledgeBase(self)
+        else:
+            self.knowledge_base = KnowledgeBase(self)
         self.input_processor = InputProcessor(self)
         self.decision_maker = DecisionMaker(self)
         self.world_model = WorldModel(self)
@@ -18,16 +18,23 @@ class KBContext(AssociativeEnergyGraph):
         self.hierarchy.prefetch()
         
         tasks = kb.find_nodes(KBNodeType.TASK, ())
-        event_reactions_list = [
-            kb.out(task.id, KBEdgeType.TASK, direction=KBEdgeDirection.IN)
-            for task in tasks
+        event_reactions_list = kb.out_many(
+            [task.id for task in tasks], KBEdgeType.TASK,
+            direction=KBEdgeDirection.IN,
+        ).values()
+        event_reactions = [
+            event_reaction
+            for event_reactions in event_reactions_list
+            for event_reaction in event_reactions
         ]
-        for event_reactions in event_reactions_list:
-            for event_reaction in event_reactions:
-                events = kb.out(event_reaction.id, KBEdgeType.REACTION, direction=KBEdgeDirection.IN)
-                for event in events:
-                    self.set_weight(event_reaction.data['name'], event.data['name'], 1.0)
-                    print(event_reaction.data['name'], event.data['name'])
+        events_map = kb.out_many(
+            [event_reaction.id for event_reaction in event_reactions],
+            KBEdgeType.REACTION, direction=KBEdgeDirection.IN,
+        )
+        for event_reaction in event_reactions:
+            for event in events_map[event_reaction.id]:
+                self.set_weight(event_reaction.data['name'], event.data['name'], 1.0)
+                print(event_reaction.data['name'], event.data['name'])
 
 
 def main():
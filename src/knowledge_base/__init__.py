@@ -1,2 +1,3 @@
-from .module import KnowledgeBase
+from .module import KnowledgeBase, KB_SNAPSHOT
+from .snapshot import SnapshotKnowledgeBase
 from .concept import Concept
\ No newline at end of file
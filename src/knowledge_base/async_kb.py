@@ -0,0 +1,524 @@
+"""
+Async version of the KnowledgeBase for code that runs in an asyncio loop.
+
+It talks to Neo4j through the async driver instead of neomodel, so a
+query doesn't block the event loop for the network round trip. At most
+`pool_size` sessions are open at the same time, other callers wait for
+a free one. Methods and their results are the same as in KnowledgeBase,
+they just have to be awaited. The queries, the decoding of their rows and
+the cache tags are the helpers that KnowledgeBase uses, only the waiting
+for Neo4j is done here.
+
+A write and its entry in the change log run in one transaction, and
+poll_changes() (or step(), every `poll_interval` seconds) applies the
+writes of other processes to the cache, same as in KnowledgeBase.
+"""
+import asyncio
+import json
+import time
+from typing import Callable, Iterable, Optional
+
+from neo4j import AsyncGraphDatabase
+from neo4j.exceptions import Neo4jError
+
+from src.knowledge_base import cypher
+from src.knowledge_base.cache import KBCache, cached_read, label_tag, node_tag
+from src.knowledge_base.concept import Concept
+from src.knowledge_base.hierarchy import closure_hierarchy
+from src.knowledge_base.module import (
+    DB_HOST,
+    DB_PASSWORD,
+    DB_PORT,
+    DB_USER,
+    KB_BUNDLE_DEPTH,
+    KB_KEEP_CHANGES,
+    KB_POLL_INTERVAL,
+    KB_PRUNE_INTERVAL,
+    KB_UNIQUE_KEYS,
+    KBChangeLog,
+    KBEdge,
+    KBEdgeDirection,
+    KBEdgeType,
+    KBIdentityMap,
+    KBIntegrityError,
+    KBNode,
+    KBNodeType,
+    KBNotFoundError,
+    cached_out_many,
+    change_tags,
+    concept_names,
+    concept_subgraph_tags,
+    decode_concepts_many,
+    decode_direct_hierarchy,
+    decode_fields,
+    decode_out_dict,
+    decode_out_dict2,
+    decode_outcomes,
+    decode_version,
+    decode_word_concepts_many,
+    edge_write_tags,
+    fields_tags,
+    missing_constraints,
+    out_dict_tags,
+    out_many_request,
+    out_request,
+    out_tags,
+    outcomes_tags,
+    parent_edges,
+    pick_concept,
+    record_change_params,
+    recorded_seq,
+    store_out_many,
+    update_write_tags,
+)
+
+
+class AsyncKnowledgeBase:
+    def __init__(self, uri: str = None, auth: tuple[str, str] = None,
+                 pool_size: int = 16, cache_size: int = 4096,
+                 cache_ttl: Optional[float] = None,
+                 poll_interval: float = KB_POLL_INTERVAL,
+                 prune_interval: float = KB_PRUNE_INTERVAL,
+                 keep_changes: int = KB_KEEP_CHANGES):
+        if uri is None:
+            uri = f"bolt://{DB_HOST}:{DB_PORT}"
+        if auth is None:
+            auth = (DB_USER, DB_PASSWORD)
+
+        self.driver = AsyncGraphDatabase.driver(
+            uri, auth=auth, max_connection_pool_size=pool_size)
+        self.sessions = asyncio.Semaphore(pool_size)
+        self.cache = KBCache(maxsize=cache_size, ttl=cache_ttl)
+        self.identity_map = KBIdentityMap()
+
+        # the log is first read by the first poll
+        self.changes = KBChangeLog()
+        self._changes_lock = asyncio.Lock()
+        self.poll_interval = poll_interval
+        self._polled_at = time.monotonic()
+        self.prune_interval = prune_interval
+        self.keep_changes = keep_changes
+        self._pruned_at = time.monotonic()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.driver.close()
+
+    @property
+    def applied_seq(self) -> Optional[int]:
+        """ seq of the last change in the log applied to the cache, None
+        until the first poll
+        """
+        return self.changes.applied_seq
+
+    def _to_node(self, raw_node) -> KBNode:
+        return KBNode.create(raw_node, self.identity_map)
+
+    async def cypher_query(self, query: str, params: dict = None) -> list[list]:
+        """ Same as neomodel's db.cypher_query, but only returns the rows """
+        async with self.sessions:
+            async with self.driver.session() as session:
+                result = await session.run(query, params or {})
+                return await result.values()
+
+    async def get_version(self) -> int:
+        return decode_version(await self.cypher_query(cypher.KB_VERSION_QUERY))
+
+    async def write_query(self, query: str, params: dict,
+                          change: Callable[[list[list]], Optional[tuple]]) -> list[list]:
+        """
+        Runs a write and appends it to the change log in one transaction.
+        change(rows) returns the (tags, added, removed) of the write, or
+        None when nothing was written. The change is applied to the cache
+        after the commit. Returns the rows of the write.
+        """
+        async def work(tx):
+            result = await tx.run(query, params)
+            rows = await result.values()
+            logged = change(rows)
+            if logged is None:
+                return rows, None, None
+
+            tags, added, removed = logged
+            result = await tx.run(
+                cypher.RECORD_CHANGE_QUERY, record_change_params(tags, added, removed))
+            return rows, logged, recorded_seq(await result.values())
+
+        if self.applied_seq is None:
+            # the first poll makes the version node that the log needs
+            await self.poll_changes()
+
+        async with self.sessions:
+            async with self.driver.session() as session:
+                rows, logged, seq = await session.execute_write(work)
+
+        if logged is not None:
+            self._apply_change(*logged)
+            self.changes.own(seq)
+        return rows
+
+    def _apply_change(self, tags: Iterable[tuple[str, str]],
+                      added: Iterable[tuple[str, str]] = (),
+                      removed: Iterable[tuple[str, str]] = ()):
+        """ Drops what a write made stale, for writes of this and of other processes """
+        self.cache.invalidate(*change_tags(tags, added, removed))
+
+    async def step(self):
+        if self.applied_seq is None or time.monotonic() - self._polled_at >= self.poll_interval:
+            await self.poll_changes()
+        if self.prune_interval and time.monotonic() - self._pruned_at >= self.prune_interval:
+            await self.prune_changes(self.keep_changes)
+
+    async def poll_changes(self) -> int:
+        """
+        Applies the writes of other processes that were logged since the
+        last poll, returns how many there were
+        """
+        async with self._changes_lock:
+            self._polled_at = time.monotonic()
+            if self.applied_seq is None:
+                # reads made before the first poll can't be checked against the log
+                results = await self.cypher_query(cypher.INIT_VERSION_QUERY)
+                self.changes.start(decode_version(results))
+                self.cache.clear()
+                return 0
+
+            results = await self.cypher_query(cypher.CHANGES_SINCE_QUERY, {
+                "seq": self.applied_seq,
+            })
+            if not results:
+                return 0
+
+            if self.changes.missed(results):
+                self.cache.clear()
+                return len(results)
+
+            foreign = 0
+            for seq, tags, added, removed in self.changes.foreign(results):
+                foreign += 1
+                self._apply_change(tags, added, removed)
+            return foreign
+
+    async def prune_changes(self, keep: int = KB_KEEP_CHANGES):
+        """ Same as KnowledgeBase.prune_changes """
+        self._pruned_at = time.monotonic()
+        await self.cypher_query(cypher.PRUNE_CHANGES_QUERY, {
+            "seq": await self.get_version() - keep,
+        })
+
+    async def check_schema(self, keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
+        """ (label, key) pairs of keys without a uniqueness constraint """
+        try:
+            results = await self.cypher_query(cypher.SHOW_CONSTRAINTS_QUERY)
+        except Neo4jError:
+            return list(keys)
+
+        return missing_constraints(results, keys)
+
+    async def ensure_schema(self, keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
+        """ Same as KnowledgeBase.ensure_schema """
+        created = []
+        errors = []
+        for label, key in await self.check_schema(keys):
+            try:
+                await self.cypher_query(cypher.unique_constraint_query(label, key))
+            except Neo4jError as error:
+                errors.append(f"{label}.{key}: {error}")
+            else:
+                created.append((label, key))
+
+        if errors:
+            raise KBIntegrityError("Can't create KB constraints, " + "; ".join(errors))
+        return created
+
+    @staticmethod
+    def _edge_change(label: str, start_node_id: int, end_node_id: int, start: int = 1):
+        """ change() of write_query for a write of edges between two nodes,
+        the rows have the start and end nodes in the columns start and start + 1
+        """
+        def change(rows):
+            if not rows:
+                return None
+            tags = edge_write_tags(label, start_node_id, end_node_id)
+            edges = parent_edges(label, rows[:1], start)
+            if start == 0:
+                return tags, (), edges
+            return tags, edges, ()
+
+        return change
+
+    @cached_read(out_tags)
+    async def out(self, node_id: int, edge_type: KBEdgeType,
+                  edge_filters: tuple = None, node_filters: tuple = None,
+                  direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                  direct=True) -> list[KBNode]:
+        results = await self.cypher_query(*out_request(
+            node_id, edge_type, edge_filters, node_filters, direction))
+
+        return [self._to_node(row[0]) for row in results]
+
+    async def in_(self, node_id: int, edge_type: KBEdgeType,
+                  edge_filters: tuple = None,
+                  direct=True) -> list[KBNode]:
+        return await self.out(
+            node_id=node_id,
+            edge_type=edge_type,
+            edge_filters=edge_filters,
+            direction=KBEdgeDirection.IN,
+            direct=direct,
+        )
+
+    async def out_one(self, *args, **kwargs) -> KBNode:
+        results = await self.out(*args, **kwargs)
+        if not results:
+            raise KBNotFoundError("No nodes found")
+
+        if len(results) > 1:
+            raise KBIntegrityError("Multiple nodes found")
+
+        return results[0]
+
+    async def out_many(self, node_ids: list[int], edge_type: KBEdgeType,
+                       edge_filters: tuple = None, node_filters: tuple = None,
+                       direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict[int, list[KBNode]]:
+        result, missing = cached_out_many(
+            self, node_ids, edge_type, edge_filters, node_filters, direction)
+        if not missing:
+            return result
+
+        results = await self.cypher_query(*out_many_request(
+            missing, edge_type, edge_filters, node_filters, direction))
+        store_out_many(self, result, missing, results)
+
+        return result
+
+    @cached_read(out_dict_tags)
+    async def out_dict(self, node_id: int, edge_type: KBEdgeType,
+                       edge_filters: tuple = None, key: str = 'name',
+                       direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                       direct=True) -> dict[str, KBNode]:
+        query = cypher.out_query(edge_type.value, direction.name, returns="r, b")
+        results = await self.cypher_query(query, {
+            "node_id": int(node_id),
+        })
+
+        return decode_out_dict(results, self._to_node)
+
+    @cached_read(out_dict_tags)
+    async def out_dict2(self, node_id: int, edge_type: KBEdgeType,
+                        edge_filters: tuple = None, key: str = 'name',
+                        direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                        direct=True) -> dict[str, KBNode]:
+        query = cypher.out_query(edge_type.value, direction.name)
+        results = await self.cypher_query(query, {
+            "node_id": int(node_id),
+        })
+
+        return decode_out_dict2(results, self._to_node)
+
+    @cached_read(lambda args, result: [label_tag(args['node_type'].value)])
+    async def find_nodes(self, node_type: KBNodeType, filters: tuple) -> list[KBNode]:
+        query = cypher.find_nodes_query(node_type.value, cypher.filter_keys(filters))
+        results = await self.cypher_query(query, {
+            "filters": dict(filters),
+        })
+
+        return [self._to_node(row[0]) for row in results]
+
+    async def find_concept(self, cid: str, should_raise: bool = True) -> Optional[KBNode]:
+        concept_name = Concept.get_name(cid)
+        nodes = await self.find_nodes(KBNodeType.CONCEPT, (
+            ("name", concept_name),
+        ))
+        return pick_concept(nodes, concept_name, should_raise)
+
+    async def find_concepts_many(self, cids: list[str]) -> dict[str, Optional[KBNode]]:
+        names = concept_names(cids)
+
+        results = await self.cypher_query(cypher.FIND_CONCEPTS_MANY_QUERY, {
+            "names": list(set(names.values())),
+        })
+
+        return decode_concepts_many(names, results, self._to_node)
+
+    async def get_parents(self, cid: str, direct=False) -> list[KBNode]:
+        node = await self.find_concept(cid)
+        return await self.out(
+            node_id=node.id,
+            edge_type=KBEdgeType.PARENT,
+            edge_filters=None,
+            direct=direct,
+            direction=KBEdgeDirection.OUT,
+        )
+
+    async def get_children(self, cid: str, direct=False, field_expansion=False) -> list[KBNode]:
+        node = await self.find_concept(cid)
+
+        edge_filters = (
+            ("field_expansion", "1"),
+        ) if field_expansion else None
+
+        return await self.out(
+            node_id=node.id,
+            edge_type=KBEdgeType.PARENT,
+            edge_filters=edge_filters,
+            direct=direct,
+            direction=KBEdgeDirection.IN,
+        )
+
+    async def get_node(self, node_id: int) -> KBNode:
+        results = await self.cypher_query(cypher.GET_NODE_QUERY, {
+            "node_id": int(node_id),
+        })
+
+        return self._to_node(results[0][0])
+
+    @cached_read(outcomes_tags)
+    async def get_outcomes(self, node_id):
+        results = await self.cypher_query(cypher.GET_OUTCOMES_QUERY, {
+            "node_id": int(node_id),
+        })
+
+        return decode_outcomes(results, self._to_node)
+
+    @cached_read(lambda args, result: [label_tag('Word')])
+    async def get_word(self, word: str) -> Optional[KBNode]:
+        results = await self.cypher_query(cypher.GET_WORD_QUERY, {
+            "value": word,
+        })
+
+        if not results:
+            return None
+
+        return self._to_node(results[0][0])
+
+    async def get_word_concepts_many(self, words) -> dict[str, list[str]]:
+        words = list(dict.fromkeys(words))
+        results = await self.cypher_query(cypher.WORD_CONCEPTS_MANY_QUERY, {
+            "values": words,
+        })
+
+        return decode_word_concepts_many(words, results)
+
+    @cached_read(fields_tags)
+    async def get_fields(self, concept_id: str) -> dict[str, KBNode]:
+        results = await self.cypher_query(cypher.GET_FIELDS_QUERY, {
+            "node_id": int(concept_id),
+        })
+
+        return decode_fields(results, self._to_node)
+
+    async def get_field(self, concept_id: str, field_name: str) -> Optional[KBNode]:
+        """ Field of the concept or of the nearest parent that has it """
+        return (await self.get_fields(concept_id)).get(field_name)
+
+    async def get_concept_bundle(self, name: str, depth: int = KB_BUNDLE_DEPTH,
+                                 should_raise: bool = True):
+        """ Same as KnowledgeBase.get_concept_bundle, the reads of the
+        bundle have to be awaited
+        """
+        from src.knowledge_base.bundle import AsyncConceptBundle
+
+        subgraph = await self._concept_subgraph(name, depth)
+        if subgraph is None:
+            if should_raise:
+                raise KBNotFoundError(f"Concept '{name}' not found")
+            return None
+
+        concept, index = subgraph
+        return AsyncConceptBundle(concept, index, depth, self)
+
+    @cached_read(concept_subgraph_tags)
+    async def _concept_subgraph(self, name: str, depth: int):
+        from src.knowledge_base.bundle import LRD_EDGE_TYPES, subgraph_from_rows
+
+        results = await self.cypher_query(cypher.concept_bundle_query(LRD_EDGE_TYPES, depth), {
+            "name": name,
+        })
+        return subgraph_from_rows(results, self._to_node)
+
+    async def new_node(self, label: str, data: dict) -> KBNode:
+        results = await self.write_query(cypher.new_node_query(label), {
+            "props": data,
+        }, lambda rows: ([label_tag(label), node_tag(rows[0][0].element_id)], (), ()))
+
+        return self._to_node(results[0][0])
+
+    async def new_concept(self, name: str, x: int = 100, y: int = 100) -> KBNode:
+        return await self.new_node("Concept", {
+            "name": Concept.get_name(name),
+            "_meta": json.dumps({
+                "x": x,
+                "y": y,
+            })
+        })
+
+    async def upsert_concept(self, name: str, x: int = 100, y: int = 100) -> KBNode:
+        concept = await self.find_concept(name, should_raise=False)
+        if concept:
+            return concept
+
+        return await self.new_concept(name, x, y)
+
+    async def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        results = await self.write_query(cypher.new_edge_query(label), {
+            "start_id": int(start_node_id),
+            "end_id": int(end_node_id),
+            "props": data,
+        }, self._edge_change(label, start_node_id, end_node_id))
+
+        return KBEdge(
+            id=results[0][0].element_id,
+            label=label,
+            start_id=start_node_id,
+            end_id=end_node_id,
+            data=data,
+        )
+
+    async def upsert_edge(self, edge_label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        query = cypher.upsert_edge_query(edge_label, cypher.filter_keys(data))
+        results = await self.write_query(query, {
+            "start_id": int(start_node_id),
+            "end_id": int(end_node_id),
+            "props": data,
+        }, self._edge_change(edge_label, start_node_id, end_node_id))
+
+        return KBEdge(
+            id=results[0][0].element_id,
+            label=edge_label,
+            start_id=start_node_id,
+            end_id=end_node_id,
+            data=data,
+        )
+
+    async def delete_edge(self, label: str, start_node_id: int, end_node_id: int) -> int:
+        """Deletes all edges of the label between two nodes, returns how many"""
+        results = await self.write_query(cypher.delete_edge_query(label), {
+            "start_id": int(start_node_id),
+            "end_id": int(end_node_id),
+        }, self._edge_change(label, start_node_id, end_node_id, start=0))
+
+        return len(results)
+
+    async def update_node_data(self, node_id: int, data: dict) -> KBNode:
+        def change(rows):
+            return update_write_tags(node_id, self._to_node(rows[0][0]), data), (), ()
+
+        results = await self.write_query(cypher.UPDATE_NODE_DATA_QUERY, {
+            "node_id": int(node_id),
+            "props": data,
+        }, change)
+
+        return self._to_node(results[0][0])
+
+    async def build_hierarchy(self):
+        direct_parents, _ = await self.build_direct_hierarchy()
+        return closure_hierarchy(direct_parents)
+
+    async def build_direct_hierarchy(self):
+        return decode_direct_hierarchy(await self.cypher_query(cypher.DIRECT_HIERARCHY_QUERY))
@@ -0,0 +1,268 @@
+"""
+In-memory LRD subgraph of one concept.
+
+KnowledgeBase.get_concept_bundle reads the concept, its ancestors and
+everything within `depth` hops of them over the LRD edges (fields,
+getters, setters, their logic and its operands) with one path query.
+The result is kept in a GraphIndex, and a ConceptBundle answers the
+reads the LRD traversal makes (out, in_, out_one, get_fields, ...) with
+the same signatures as the KnowledgeBase, so the traversal can walk it
+without any further queries.
+
+A bundle knows which nodes it holds completely: the concepts it was read
+for (their outgoing edges) and the other nodes closer than `depth` to
+them (edges in both directions). Reads of anything else, e.g. past the
+depth or over other edge types, go to the KB.
+"""
+from typing import Optional
+
+from src.knowledge_base.graph_index import GraphIndex
+from src.knowledge_base.module import (
+    KBEdgeDirection,
+    KBEdgeType,
+    KBIntegrityError,
+    KBNode,
+    KBNodeType,
+    KBNotFoundError,
+)
+
+
+# several edge types share a value, e.g. "concept" and "logic"
+LRD_EDGE_TYPES = tuple(dict.fromkeys(edge_type.value for edge_type in (
+    KBEdgeType.FIELD_NODE,
+    KBEdgeType.FIELD_CONCEPT,
+    KBEdgeType.FIELD_GETTER,
+    KBEdgeType.FIELD_SETTER_ACTION,
+    KBEdgeType.FIELD_SETTER_EVENT,
+    KBEdgeType.FIELD_SETTER_TARGET,
+    KBEdgeType.GETTER_INSTANCE,
+    KBEdgeType.GETTER_LOGIC,
+    KBEdgeType.INSTANCE_FIELD,
+    KBEdgeType.FIELD_CONCEPT_FIELD,
+    KBEdgeType.CONDITION_LEFT,
+    KBEdgeType.CONDITION_RIGHT,
+    KBEdgeType.FIELD_CHANGE_VALUE,
+)))
+
+
+def subgraph_from_rows(results, to_node) -> Optional[tuple[KBNode, GraphIndex]]:
+    """ (concept, GraphIndex) from the rows of cypher.concept_bundle_query,
+    None when the concept doesn't exist
+    """
+    if not results:
+        return None
+
+    index = GraphIndex()
+    concept = to_node(results[0][0])
+    index.add_node(concept)
+    for _, edge, start_node, end_node in results:
+        if edge is None:
+            continue
+        for raw_node in (start_node, end_node):
+            if raw_node.element_id not in index:
+                index.add_node(to_node(raw_node))
+        index.add_edge(start_node.element_id, end_node.element_id, edge.type, dict(edge))
+
+    return concept, index
+
+
+class ConceptBundle:
+    def __init__(self, concept: KBNode, index: GraphIndex, depth: int, kb):
+        self.concept = concept
+        self.index = index
+        self.depth = depth
+        self.kb = kb
+        # the concept and its ancestors
+        self.roots = set(index.iterate_up(concept.id, KBEdgeType.PARENT.value))
+        self.complete = self._complete_nodes()
+
+    def __contains__(self, node_id):
+        return str(node_id) in self.index
+
+    def _complete_nodes(self) -> set:
+        """ Nodes other than concepts that are closer than `depth` to the
+        roots, all their LRD edges were read
+        """
+        distances = dict.fromkeys(self.roots, 0)
+        queue = list(self.roots)
+
+        while queue:
+            next_queue = []
+            for node_id in queue:
+                if node_id in self.roots:
+                    directions = (KBEdgeDirection.OUT, )
+                elif self.index.nodes[node_id].label == KBNodeType.CONCEPT.value:
+                    continue
+                else:
+                    directions = (KBEdgeDirection.OUT, KBEdgeDirection.IN)
+
+                for edge_type in LRD_EDGE_TYPES:
+                    for direction in directions:
+                        for _, node in self.index.out_edges(node_id, edge_type, direction):
+                            if node.id not in distances:
+                                distances[node.id] = distances[node_id] + 1
+                                next_queue.append(node.id)
+            queue = next_queue
+
+        return {
+            node_id
+            for node_id, distance in distances.items()
+            if distance < self.depth
+            and self.index.nodes[node_id].label != KBNodeType.CONCEPT.value
+        }
+
+    def _holds(self, node_id: str, edge_type: str, direction: KBEdgeDirection) -> bool:
+        if node_id in self.roots:
+            return direction is KBEdgeDirection.OUT and (
+                edge_type in LRD_EDGE_TYPES or edge_type == KBEdgeType.PARENT.value)
+        return node_id in self.complete and edge_type in LRD_EDGE_TYPES
+
+    def _local_out(self, node_id, edge_type: KBEdgeType,
+                   edge_filters: tuple = None, node_filters: tuple = None,
+                   direction: KBEdgeDirection = KBEdgeDirection.OUT) -> Optional[list[KBNode]]:
+        """ Result of out from memory, None when the bundle doesn't hold it """
+        if not self._holds(str(node_id), edge_type.value, direction):
+            return None
+
+        return self.index.out(
+            str(node_id), edge_type.value,
+            edge_filters=edge_filters,
+            node_filters=node_filters,
+            direction=direction,
+        )
+
+    def _local_concept(self, cid: str) -> Optional[KBNode]:
+        for node_id in self.roots:
+            node = self.index.nodes[node_id]
+            if node.data.get('name') == cid:
+                return node
+        return None
+
+    def _local_fields(self, concept_id) -> Optional[dict[str, KBNode]]:
+        if str(concept_id) not in self.roots:
+            return None
+
+        fields = {}
+        for ancestor_id in self.index.iterate_up(str(concept_id), KBEdgeType.PARENT.value):
+            for field in self.index.out(ancestor_id, KBEdgeType.FIELD_NODE.value):
+                fields.setdefault(field.data['name'], field)
+        return fields
+
+    @staticmethod
+    def _one(results: list[KBNode]) -> KBNode:
+        if not results:
+            raise KBNotFoundError("No nodes found")
+
+        if len(results) > 1:
+            raise KBIntegrityError("Multiple nodes found")
+
+        return results[0]
+
+    def out(self, node_id, edge_type: KBEdgeType,
+            edge_filters: tuple = None, node_filters: tuple = None,
+            direction: KBEdgeDirection = KBEdgeDirection.OUT,
+            direct=True) -> list[KBNode]:
+        result = self._local_out(node_id, edge_type, edge_filters, node_filters, direction)
+        if result is None:
+            return self.kb.out(node_id, edge_type, edge_filters, node_filters, direction, direct)
+        return result
+
+    def out_many(self, node_ids: list, edge_type: KBEdgeType,
+                 edge_filters: tuple = None, node_filters: tuple = None,
+                 direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict:
+        """ Same as KnowledgeBase.out_many, the nodes the bundle doesn't
+        hold are read from the KB in one batch
+        """
+        result = {
+            node_id: self._local_out(node_id, edge_type, edge_filters, node_filters, direction)
+            for node_id in node_ids
+        }
+        missing = [node_id for node_id, nodes in result.items() if nodes is None]
+        if missing:
+            result.update(self.kb.out_many(
+                missing, edge_type, edge_filters, node_filters, direction))
+        return result
+
+    def in_(self, node_id, edge_type: KBEdgeType,
+            edge_filters: tuple = None,
+            direct=True) -> list[KBNode]:
+        return self.out(
+            node_id=node_id,
+            edge_type=edge_type,
+            edge_filters=edge_filters,
+            direction=KBEdgeDirection.IN,
+            direct=direct,
+        )
+
+    def out_one(self, *args, **kwargs) -> KBNode:
+        return self._one(self.out(*args, **kwargs))
+
+    def find_concept(self, cid: str, should_raise: bool = True) -> Optional[KBNode]:
+        node = self._local_concept(cid)
+        if node is None:
+            return self.kb.find_concept(cid, should_raise=should_raise)
+        return node
+
+    def get_fields(self, concept_id) -> dict[str, KBNode]:
+        """ Same as KnowledgeBase.get_fields, the nearest definition wins """
+        fields = self._local_fields(concept_id)
+        if fields is None:
+            return self.kb.get_fields(concept_id)
+        return fields
+
+    def get_field(self, concept_id, field_name: str) -> Optional[KBNode]:
+        return self.get_fields(concept_id).get(field_name)
+
+
+class AsyncConceptBundle(ConceptBundle):
+    """ ConceptBundle of the AsyncKnowledgeBase, the reads have to be awaited """
+    async def out(self, node_id, edge_type: KBEdgeType,
+                  edge_filters: tuple = None, node_filters: tuple = None,
+                  direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                  direct=True) -> list[KBNode]:
+        result = self._local_out(node_id, edge_type, edge_filters, node_filters, direction)
+        if result is None:
+            return await self.kb.out(node_id, edge_type, edge_filters, node_filters, direction, direct)
+        return result
+
+    async def out_many(self, node_ids: list, edge_type: KBEdgeType,
+                       edge_filters: tuple = None, node_filters: tuple = None,
+                       direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict:
+        result = {
+            node_id: self._local_out(node_id, edge_type, edge_filters, node_filters, direction)
+            for node_id in node_ids
+        }
+        missing = [node_id for node_id, nodes in result.items() if nodes is None]
+        if missing:
+            result.update(await self.kb.out_many(
+                missing, edge_type, edge_filters, node_filters, direction))
+        return result
+
+    async def in_(self, node_id, edge_type: KBEdgeType,
+                  edge_filters: tuple = None,
+                  direct=True) -> list[KBNode]:
+        return await self.out(
+            node_id=node_id,
+            edge_type=edge_type,
+            edge_filters=edge_filters,
+            direction=KBEdgeDirection.IN,
+            direct=direct,
+        )
+
+    async def out_one(self, *args, **kwargs) -> KBNode:
+        return self._one(await self.out(*args, **kwargs))
+
+    async def find_concept(self, cid: str, should_raise: bool = True) -> Optional[KBNode]:
+        node = self._local_concept(cid)
+        if node is None:
+            return await self.kb.find_concept(cid, should_raise=should_raise)
+        return node
+
+    async def get_fields(self, concept_id) -> dict[str, KBNode]:
+        fields = self._local_fields(concept_id)
+        if fields is None:
+            return await self.kb.get_fields(concept_id)
+        return fields
+
+    async def get_field(self, concept_id, field_name: str) -> Optional[KBNode]:
+        return (await self.get_fields(concept_id)).get(field_name)
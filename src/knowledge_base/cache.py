@@ -0,0 +1,339 @@
+"""
+Result cache for KnowledgeBase reads.
+
+Every entry is tagged with the node ids and labels it depends on,
+so a write only drops the entries that it could have changed.
+Misses (empty results) are cached as well, so repeated lookups of
+unknown concepts don't go to the database either.
+"""
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+
+def node_tag(node_id) -> tuple[str, str]:
+    # ids come both as ints and as element id strings
+    return ('node', str(node_id))
+
+
+def label_tag(label: str) -> tuple[str, str]:
+    return ('label', label)
+
+
+def edge_tag(edge_label: str) -> tuple[str, str]:
+    """ Results that depend on all the edges of a type, e.g. the hierarchy """
+    return ('edge', edge_label)
+
+
+def encode_tag(tag: tuple[str, str]) -> str:
+    """ Tags as strings, for the change log in Neo4j """
+    return f"{tag[0]}:{tag[1]}"
+
+
+def decode_tag(text: str) -> tuple[str, str]:
+    kind, _, value = text.partition(':')
+    return kind, value
+
+
+def result_tags(result) -> set[tuple[str, str]]:
+    """ Tags of all KBNodes inside of a cached result """
+    tags = set()
+
+    if result is None:
+        return tags
+
+    if isinstance(result, dict):
+        result = result.values()
+    elif not isinstance(result, (list, tuple)):
+        result = [result, ]
+
+    for item in result:
+        if isinstance(item, (list, tuple, dict)):
+            tags.update(result_tags(item))
+        elif hasattr(item, 'id'):
+            tags.add(node_tag(item.id))
+
+    return tags
+
+
+@dataclass
+class KBCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    store_hits: int = 0
+    # callers that got the result of a read another caller was running
+    coalesced: int = 0
+
+
+# result of a flight whose leader raised or was cancelled
+_FAILED = object()
+
+
+class KBFlight:
+    """ A cached read that is running, other callers of the same key wait for it """
+    __slots__ = ('done', 'value')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _FAILED
+
+
+class KBCache:
+    """ LRU cache with an optional TTL and tag based invalidation
+
+    All methods can be called from several threads. `generation` grows
+    with every invalidation, a read that started before it doesn't store
+    its result (see set's `generation`). `flights` and `async_flights`
+    are the reads of cached_read that are running right now.
+
+    `store` is an optional second level (KBDiskCache) that keeps the
+    entries across restarts, it's asked on misses, written through on
+    set and invalidated together with the memory. The TTL only applies
+    to the memory, the store is valid as long as its version stamp.
+    """
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = None, store=None):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.flights: dict[Hashable, KBFlight] = {}
+        self.async_flights: dict[Hashable, asyncio.Future] = {}
+        self.stats = KBCacheStats()
+        # key -> (value, expires_at, tags)
+        self._entries: OrderedDict = OrderedDict()
+        self._keys_by_tag: dict[Hashable, set] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            found, _ = self._lookup(key)
+        return found
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key: Hashable) -> tuple[bool, Any]:
+        found, value = self._lookup(key)
+        if found:
+            self.stats.hits += 1
+            self._entries.move_to_end(key)
+            return found, value
+
+        if self.store is not None:
+            found, value, tags = self.store.get(key)
+            if found:
+                self.stats.store_hits += 1
+                self._set(key, value, tags)
+                return found, value
+
+        self.stats.misses += 1
+        return found, value
+
+    def _lookup(self, key: Hashable) -> tuple[bool, Any]:
+        try:
+            value, expires_at, _ = self._entries[key]
+        except KeyError:
+            return False, None
+
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.stats.expirations += 1
+            self._remove(key)
+            return False, None
+
+        return True, value
+
+    def set(self, key: Hashable, value, tags: Iterable[Hashable] = (),
+            generation: Optional[int] = None):
+        """ With a generation the value is only stored when nothing was
+        invalidated since the generation was read
+        """
+        tags = frozenset(tags)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._set(key, value, tags)
+            if self.store is not None:
+                self.store.set(key, value, tags)
+
+    def _set(self, key: Hashable, value, tags: frozenset):
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (value, expires_at, tags)
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.maxsize:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats.evictions += 1
+
+    def items(self) -> Iterable[tuple[Hashable, Any, frozenset]]:
+        """ (key, value, tags) of the entries that haven't expired """
+        now = time.monotonic()
+        with self.lock:
+            entries = list(self._entries.items())
+        for key, (value, expires_at, tags) in entries:
+            if expires_at is None or expires_at > now:
+                yield key, value, tags
+
+    def invalidate(self, *tags: Hashable) -> int:
+        """ Drops all entries that depend on any of the tags """
+        with self.lock:
+            self.generation += 1
+            keys = set()
+            for tag in tags:
+                keys.update(self._keys_by_tag.get(tag, ()))
+
+            for key in keys:
+                self._remove(key)
+
+            if self.store is not None:
+                self.store.invalidate(*tags)
+
+            self.stats.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            if self.store is not None:
+                self.store.clear()
+
+    def get_or_join(self, key: Hashable) -> tuple[bool, Any, Optional[KBFlight]]:
+        """ (True, value, None) on a hit, (False, None, flight) when another
+        caller is reading the key already and (False, None, None) when this
+        caller has to read it and call end_flight() afterwards
+        """
+        with self.lock:
+            found, value = self._get(key)
+            if found:
+                return found, value, None
+            flight = self.flights.get(key)
+            if flight is None:
+                self.flights[key] = KBFlight()
+            return False, None, flight
+
+    def end_flight(self, key: Hashable, value=_FAILED):
+        with self.lock:
+            flight = self.flights.pop(key)
+        flight.value = value
+        flight.done.set()
+
+    def _remove(self, key: Hashable):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+
+def cached_read(tags: Callable[[dict, Any], Iterable[Hashable]]):
+    """ Caches a KB method in self.cache
+
+    Arguments are bound to the signature with defaults applied, so
+    `out(1, KBEdgeType.PARENT)` and `out(node_id=1, edge_type=KBEdgeType.PARENT)`
+    share the same entry. `tags(arguments, result)` returns what the entry
+    depends on, all the nodes of the result are added to it automatically.
+    Coroutine methods get an async wrapper that caches the awaited result.
+
+    Calls of the same key that overlap run the method once: the first
+    caller runs it and the others wait for its result. When it raises or
+    is cancelled the waiters try again themselves instead of failing too.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def make_key(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            del arguments['self']
+            return (func.__name__, ) + tuple(arguments.values()), arguments
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                key, arguments = make_key(self, *args, **kwargs)
+                cache = self.cache
+
+                while True:
+                    found, value = cache.get(key)
+                    if found:
+                        return value
+
+                    flight = cache.async_flights.get(key)
+                    if flight is None:
+                        break
+                    # shield: a cancelled waiter doesn't cancel the leader
+                    value = await asyncio.shield(flight)
+                    if value is not _FAILED:
+                        cache.stats.coalesced += 1
+                        return value
+
+                flight = asyncio.get_running_loop().create_future()
+                cache.async_flights[key] = flight
+                generation = cache.generation
+                value = _FAILED
+                try:
+                    value = await func(self, *args, **kwargs)
+                    wrapper.store(self, key, arguments, value, generation)
+                finally:
+                    del cache.async_flights[key]
+                    flight.set_result(value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                key, arguments = make_key(self, *args, **kwargs)
+                cache = self.cache
+
+                while True:
+                    found, value, flight = cache.get_or_join(key)
+                    if found:
+                        return value
+                    if flight is None:
+                        break
+                    flight.done.wait()
+                    if flight.value is not _FAILED:
+                        cache.stats.coalesced += 1
+                        return flight.value
+                    # the leader failed, the next try runs the query again
+
+                generation = cache.generation
+                value = _FAILED
+                try:
+                    value = func(self, *args, **kwargs)
+                    wrapper.store(self, key, arguments, value, generation)
+                finally:
+                    cache.end_flight(key, value)
+                return value
+
+        def store(self, key, arguments, value, generation=None):
+            entry_tags = result_tags(value)
+            entry_tags.update(tags(arguments, value))
+            self.cache.set(key, value, entry_tags, generation)
+
+        wrapper.make_key = make_key
+        wrapper.store = store
+        return wrapper
+
+    return decorator
@@ -1,22 +1,97 @@
 import re
+import weakref
+from types import MappingProxyType
+from typing import Iterator, Optional
 
-from dataclasses import dataclass, field
+from src.knowledge_base.cache import KBCache
 
 
-cid_pattern = re.compile(r'\w+|[!"#$%&\'()*+,\-./:;<=>?@[\]^_`{|}~]')
+# names, everything else except whitespace is a single character token
+token_pattern = re.compile(r'\w+|\S')
+_non_word_pattern = re.compile(r'\W')
+
+# how many characters of a cid buffer are tokenized at a time
+TOKEN_CHUNK_SIZE = 4096
+
+# how many recently parsed cids are kept for reuse
+PARSED_CIDS_SIZE = 65536
 
 
-@dataclass
 class Concept:
-    name: str
-    fields: dict[str, 'Concept'] = field(default_factory=dict)
+    """
+    Immutable, hash-consed concept.
+
+    Concept(name, fields) returns the already existing object while an
+    equal concept is alive, so identical sub-concepts are shared and
+    comparisons are mostly identity checks. The hash is
+    computed on creation and the cid on the first get_cid() call.
+    Concepts that have list fields can't be hashed and are not interned.
+    """
+    __slots__ = ('name', 'fields', '_key', '_hash', '_cid', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+    _parsed = KBCache(maxsize=PARSED_CIDS_SIZE)
+
+    def __new__(cls, name: str, fields: dict[str, 'Concept'] = None):
+        fields = dict(fields or {})
+        # field names are unique, so the values are never compared, the
+        # type keeps 1, 1.0 and True apart, they have different cids
+        key = (name, tuple(sorted(
+            (field, type(value), value) for field, value in fields.items()
+        )))
+
+        try:
+            key_hash = hash(key)
+        except TypeError:
+            key_hash = None
+
+        if key_hash is not None:
+            concept = cls._interned.get(key)
+            if concept is not None:
+                return concept
+
+        concept = object.__new__(cls)
+        object.__setattr__(concept, 'name', name)
+        object.__setattr__(concept, 'fields', MappingProxyType(fields))
+        object.__setattr__(concept, '_key', key)
+        object.__setattr__(concept, '_hash', key_hash)
+        object.__setattr__(concept, '_cid', None)
+
+        if key_hash is not None:
+            # another thread may have interned an equal concept meanwhile
+            concept = cls._interned.setdefault(key, concept)
+        return concept
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Concept is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Concept is immutable")
+
+    def __reduce__(self):
+        return Concept, (self.name, dict(self.fields))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Concept):
+            return NotImplemented
+        return self._hash == other._hash and self._key == other._key
+
+    def __hash__(self):
+        if self._hash is None:
+            raise TypeError(f"Concept with list fields is not hashable: {self.name}")
+        return self._hash
 
     def get_cid(self):
+        if self._cid is not None:
+            return self._cid
+
         cid = [self.name, ]
 
         if self.fields:
             cid.append('{')
-            for key, value in sorted(self.fields.items(), key=lambda x: x[0]):
+            for key, _, value in self._key[1]:
                 if isinstance(value, list):
                     raise NotImplementedError()
                 if isinstance(value, Concept):
@@ -26,59 +101,38 @@ class Concept:
             cid[-1] = cid[-1][:-1]
             cid.append('}')
 
-        return ''.join(cid)
-
-    @classmethod
-    def _from_tokens(cls, tokens: list[str]) -> 'Concept':
-        name = tokens.pop()
-
-        fields = {}
-
-        if tokens[-1] != '{':
-            return Concept(name)
-
-        tokens.pop()  # {
-        while tokens:
-            field_name = tokens.pop()
-            if field_name == '}':
-                break
-            tokens.pop()  # '='
-            field_value = cls._from_tokens(tokens)
-            fields[field_name] = field_value
-            if tokens and tokens[-1] == ',':
-                tokens.pop()
-
-        return Concept(name, fields)
+        object.__setattr__(self, '_cid', ''.join(cid))
+        return self._cid
 
     @classmethod
     def from_cid(cls, cid: str) -> 'Concept':
+        found, concept = cls._parsed.get(cid)
+        if found:
+            return concept
+
         if '{' not in cid:
-            return Concept(cid)
+            concept = Concept(cid)
+        else:
+            concept = parse_cid(cid)
 
-        tokens = re.findall(cid_pattern, cid.strip())[::-1]
-        concept = cls._from_tokens(tokens)
+        cls._parsed.set(cid, concept)
         return concept
 
     @classmethod
     def pprint(cls, cid: str):
-        tokens = re.findall(cid_pattern, cid.strip())
-        indent = 0
-        tokens_len = len(tokens)
-        for idx, token in enumerate(tokens):
-            if token == '}':
-                print('\n' + (indent - 1) * '    ', end='')
-            print(token, end='')
-
-            if token == '{':
-                indent += 1
-                print('\n' + indent * '    ', end='')
-            elif token == '}':
-                indent -= 1
-                if tokens_len < idx + 1 and tokens[idx + 1] != ',':
-                    print('\n' + indent * '    ', end='')
-            elif token == ',':
-                print('\n' + indent * '    ', end='')
-        print('\n')
+        print(cls.pformat(parse_cid(cid)) + '\n')
+
+    @classmethod
+    def pformat(cls, concept: 'Concept', indent: int = 0) -> str:
+        if not concept.fields:
+            return concept.name
+
+        padding = (indent + 1) * '    '
+        fields = ',\n'.join(
+            f'{padding}{key}={cls.pformat(value, indent + 1)}'
+            for key, value in concept.fields.items()
+        )
+        return f"{concept.name}{{\n{fields}\n{indent * '    '}}}"
 
     @classmethod
     def get_name(cls, cid: str):
@@ -101,5 +155,153 @@ class Concept:
 
     def __repr__(self):
         if self.fields:
-            return f"Concept(name='{self.name}', fields={self.fields})"
+            return f"Concept(name='{self.name}', fields={dict(self.fields)})"
         return f"Concept(name='{self.name}')"
+
+
+class CidSyntaxError(ValueError):
+    """ Malformed cid, position is the offset of the bad token """
+    def __init__(self, message: str, cid: str, position: int):
+        super().__init__(f"{message} at position {position}: {cid!r}")
+        self.cid = cid
+        self.position = position
+
+
+class _Tokens:
+    """ Tokens of a cid, or of a buffer of cids, read as the parser goes
+
+    The text is tokenized TOKEN_CHUNK_SIZE characters at a time, so a
+    long buffer is never held as tokens at once. `token` is the current
+    token, None at the end. The parser never looks further ahead.
+    """
+    __slots__ = ('text', 'token', '_tokens', '_index', '_chunk_start', '_chunk_end')
+
+    def __init__(self, text: str):
+        self.text = text
+        self._chunk_end = 0
+        self._next_chunk()
+
+    def advance(self):
+        self._index += 1
+        if self._index < len(self._tokens):
+            self.token = self._tokens[self._index]
+        else:
+            self._next_chunk()
+
+    def _next_chunk(self):
+        text_len = len(self.text)
+        while self._chunk_end < text_len:
+            start = self._chunk_end
+            # chunks end before a non-word character, so no token is split
+            match = _non_word_pattern.search(self.text, start + TOKEN_CHUNK_SIZE)
+            end = match.start() if match else text_len
+            self._chunk_start, self._chunk_end = start, end
+            self._tokens = token_pattern.findall(self.text, start, end)
+            self._index = 0
+            if self._tokens:
+                self.token = self._tokens[0]
+                return
+
+        self._chunk_start = text_len
+        self._tokens = []
+        self._index = 0
+        self.token = None
+
+    def error(self, expected: str) -> CidSyntaxError:
+        if self.token is None:
+            return CidSyntaxError(f"Expected {expected}, got end of cid", self.text, len(self.text))
+
+        # positions are only looked up on errors, so the common path
+        # doesn't have to keep a match object for every token
+        matches = token_pattern.finditer(self.text, self._chunk_start, self._chunk_end)
+        for index, match in enumerate(matches):
+            if index == self._index:
+                return CidSyntaxError(
+                    f"Expected {expected}, got {self.token!r}", self.text, match.start())
+
+
+def _is_name(token: Optional[str]) -> bool:
+    return token is not None and (token[0].isalnum() or token[0] == '_')
+
+
+def _field_name(tokens: _Tokens) -> str:
+    name = tokens.token
+    if not _is_name(name):
+        raise tokens.error("a field name")
+    tokens.advance()
+    if tokens.token != '=':
+        raise tokens.error("'='")
+    tokens.advance()
+    return name
+
+
+def _parse_tokens(tokens: _Tokens) -> Concept:
+    """ Parses one concept from the tokens, up to the token after it
+
+    cid    := name ['{' [field (',' field)* [',']] '}']
+    field  := name '=' cid
+    The fields that are still open are kept on a stack instead of
+    recursing, so deeply nested cids don't hit the recursion limit.
+    """
+    # (name, fields, name of the field being parsed) of every open '{'
+    stack = []
+
+    while True:
+        name = tokens.token
+        if not _is_name(name):
+            raise tokens.error("a concept name")
+        tokens.advance()
+
+        if tokens.token == '{':
+            tokens.advance()
+            if tokens.token != '}':
+                stack.append((name, {}, _field_name(tokens)))
+                continue
+            tokens.advance()
+        concept = Concept(name)
+
+        # the concept is complete, close the fields it ends
+        while stack:
+            name, fields, field_name = stack[-1]
+            fields[field_name] = concept
+
+            if tokens.token == ',':
+                tokens.advance()
+                if tokens.token != '}':
+                    stack[-1] = (name, fields, _field_name(tokens))
+                    break
+            elif tokens.token != '}':
+                raise tokens.error("',' or '}'")
+
+            tokens.advance()
+            stack.pop()
+            concept = Concept(name, fields)
+        else:
+            return concept
+
+
+def parse_cid(cid: str) -> Concept:
+    """ Parses a whole cid, unlike Concept.from_cid the result is not cached """
+    tokens = _Tokens(cid)
+    concept = _parse_tokens(tokens)
+    if tokens.token is not None:
+        raise tokens.error("end of cid")
+
+    return concept
+
+
+def iter_cids(buffer: str) -> Iterator[Concept]:
+    """ Parses cids separated by whitespace or commas one by one
+
+    The buffer is tokenized as the concepts are consumed, so only the
+    tokens of the current cid are held. A malformed cid raises
+    CidSyntaxError when it's reached, with the position of the bad token
+    in the buffer.
+    """
+    tokens = _Tokens(buffer)
+    while tokens.token is not None:
+        if tokens.token == ',':
+            tokens.advance()
+            continue
+
+        yield _parse_tokens(tokens)
@@ -0,0 +1,302 @@
+"""
+Cypher templates used by the KnowledgeBase.
+
+Ids and property values are never written into the query text, they are
+sent as bound parameters ($node_id, $props, ...), so Neo4j can reuse the
+query plan between calls. Only the parts that Cypher can't parameterize
+(labels, relationship types, direction and the set of filtered keys) end
+up in the template, and every such shape is built once and then cached.
+"""
+import functools
+import re
+
+
+identifier_pattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def check_identifier(value: str) -> str:
+    """ Labels, edge types and property keys are part of the template text,
+    so they have to be plain identifiers
+    """
+    if not isinstance(value, str) or not identifier_pattern.match(value):
+        raise ValueError(f"Invalid identifier in a query: {value!r}")
+    return value
+
+
+def filter_keys(filters) -> tuple[str, ...]:
+    """ Returns sorted keys of filters given as a tuple of pairs or a dict """
+    if not filters:
+        return ()
+    return tuple(sorted(dict(filters).keys()))
+
+
+def _map_pattern(param: str, keys: tuple[str, ...]) -> str:
+    """ (b {name: $node_filters.name}), param is "$node_filters" here """
+    if not keys:
+        return ""
+    fields = ", ".join(
+        f"{check_identifier(key)}: {param}.{key}"
+        for key in keys
+    )
+    return f" {{{fields}}}"
+
+
+def _arrows(direction: str) -> tuple[str, str]:
+    if direction == "OUT":
+        return "-", "->"
+    if direction == "IN":
+        return "<-", "-"
+    # ANY matches edges in both directions, like the in-memory KBs do,
+    # the queries before the templates matched it as IN
+    return "-", "-"
+
+
+@functools.cache
+def out_query(edge_type: str, direction: str,
+              edge_keys: tuple[str, ...] = (), node_keys: tuple[str, ...] = (),
+              returns: str = "b") -> str:
+    left_arr, right_arr = _arrows(direction)
+    edge_filters = _map_pattern("$edge_filters", edge_keys)
+    node_filters = _map_pattern("$node_filters", node_keys)
+
+    return (
+        f"MATCH (a){left_arr}[r:{check_identifier(edge_type)}{edge_filters}]{right_arr}"
+        f"(b{node_filters}) WHERE id(a) = $node_id RETURN {returns}"
+    )
+
+
+@functools.cache
+def out_many_query(edge_type: str, direction: str,
+                   edge_keys: tuple[str, ...] = (), node_keys: tuple[str, ...] = ()) -> str:
+    left_arr, right_arr = _arrows(direction)
+    edge_filters = _map_pattern("$edge_filters", edge_keys)
+    node_filters = _map_pattern("$node_filters", node_keys)
+
+    return (
+        "UNWIND $node_ids AS node_id "
+        f"MATCH (a){left_arr}[r:{check_identifier(edge_type)}{edge_filters}]{right_arr}"
+        f"(b{node_filters}) WHERE id(a) = node_id RETURN node_id, b"
+    )
+
+
+@functools.cache
+def find_nodes_query(label: str, keys: tuple[str, ...]) -> str:
+    filters = _map_pattern("$filters", keys)
+    return f"MATCH (a:{check_identifier(label)}{filters}) RETURN a"
+
+
+@functools.cache
+def new_node_query(label: str) -> str:
+    return f"CREATE (a:{check_identifier(label)} $props) RETURN a"
+
+
+@functools.cache
+def new_edge_query(label: str) -> str:
+    return (
+        "MATCH (a), (b) WHERE id(a) = $start_id AND id(b) = $end_id "
+        f"CREATE (a)-[r:{check_identifier(label)} $props]->(b) RETURN r, a, b"
+    )
+
+
+@functools.cache
+def upsert_edge_query(label: str, keys: tuple[str, ...]) -> str:
+    # parameter maps are not allowed in MERGE patterns, so every key
+    # is referenced separately
+    props = _map_pattern("$props", keys)
+    return (
+        "MATCH (a), (b) WHERE id(a) = $start_id AND id(b) = $end_id "
+        f"MERGE (a)-[r:{check_identifier(label)}{props}]->(b) RETURN r, a, b"
+    )
+
+
+@functools.cache
+def delete_edge_query(label: str) -> str:
+    return (
+        f"MATCH (a)-[r:{check_identifier(label)}]->(b) "
+        "WHERE id(a) = $start_id AND id(b) = $end_id "
+        "DELETE r RETURN a, b"
+    )
+
+
+@functools.cache
+def bulk_merge_nodes_query(label: str, key: str) -> str:
+    return (
+        "UNWIND $rows AS row "
+        f"MERGE (a:{check_identifier(label)} {{{check_identifier(key)}: row.key}}) "
+        "ON CREATE SET a += row.props "
+        "RETURN row.key, a"
+    )
+
+
+@functools.cache
+def bulk_merge_edges_query(start_label: str, start_key: str,
+                           end_label: str, end_key: str, edge_type: str) -> str:
+    return (
+        "UNWIND $rows AS row "
+        f"MATCH (a:{check_identifier(start_label)} {{{check_identifier(start_key)}: row.start}}) "
+        f"MATCH (b:{check_identifier(end_label)} {{{check_identifier(end_key)}: row.end}}) "
+        f"MERGE (a)-[r:{check_identifier(edge_type)}]->(b) "
+        "ON CREATE SET r += row.props "
+        "RETURN row.start, row.end, id(a), id(b)"
+    )
+
+
+@functools.cache
+def create_nodes_query(label: str) -> str:
+    return (
+        "UNWIND $rows AS row "
+        f"CREATE (a:{check_identifier(label)}) SET a = row.props "
+        "RETURN row.ref, a"
+    )
+
+
+@functools.cache
+def create_edges_query(label: str) -> str:
+    return (
+        "UNWIND $rows AS row "
+        "MATCH (a), (b) WHERE id(a) = row.start_id AND id(b) = row.end_id "
+        f"CREATE (a)-[r:{check_identifier(label)}]->(b) SET r = row.props "
+        "RETURN a, b"
+    )
+
+
+@functools.cache
+def merge_edges_query(label: str, keys: tuple[str, ...]) -> str:
+    props = _map_pattern("row.props", keys)
+    return (
+        "UNWIND $rows AS row "
+        "MATCH (a), (b) WHERE id(a) = row.start_id AND id(b) = row.end_id "
+        f"MERGE (a)-[r:{check_identifier(label)}{props}]->(b) "
+        "RETURN a, b"
+    )
+
+
+UPDATE_NODES_MANY_QUERY = (
+    "UNWIND $rows AS row MATCH (a) WHERE id(a) = row.node_id SET a += row.props "
+    "RETURN row.node_id, a"
+)
+
+GET_NODE_QUERY = "MATCH (a) WHERE id(a) = $node_id RETURN a"
+
+GET_OUTCOMES_QUERY = (
+    "MATCH (a:Concept)-[:outcome]->(b:Outcome)-[:act]->(c:Concept) "
+    "WHERE id(c) = $node_id RETURN a, b"
+)
+
+FIND_CONCEPTS_MANY_QUERY = (
+    "UNWIND $names AS name MATCH (a:Concept {name: name}) RETURN name, a"
+)
+
+GET_WORD_QUERY = "MATCH (a:Word {value: $value}) RETURN a"
+
+# names of the concepts associated with each of the words that exist
+WORD_CONCEPTS_MANY_QUERY = (
+    "UNWIND $values AS value MATCH (a:Word {value: value}) "
+    "OPTIONAL MATCH (a)-[:associated]->(b) RETURN value, collect(b.name)"
+)
+
+ALL_WORD_CONCEPTS_QUERY = (
+    "MATCH (a:Word) OPTIONAL MATCH (a)-[:associated]->(b) RETURN a.value, collect(b.name)"
+)
+
+UPDATE_NODE_DATA_QUERY = "MATCH (a) WHERE id(a) = $node_id SET a += $props RETURN a"
+
+DIRECT_HIERARCHY_QUERY = "MATCH (a:Concept) -[r:parent]-> (b:Concept) RETURN a.name, b.name"
+
+# names of the ancestors and of the descendants of one concept, nearest
+# first, made distinct before their depth is taken like in GET_FIELDS_QUERY
+ANCESTOR_NAMES_QUERY = (
+    "MATCH (c:Concept {name: $name})-[:parent*1..]->(a:Concept) WITH DISTINCT c, a "
+    "MATCH p = shortestPath((c)-[:parent*1..]->(a)) "
+    "RETURN a.name ORDER BY length(p)"
+)
+DESCENDANT_NAMES_QUERY = (
+    "MATCH (c:Concept {name: $name})<-[:parent*1..]-(a:Concept) WITH DISTINCT c, a "
+    "MATCH p = shortestPath((c)<-[:parent*1..]-(a)) "
+    "RETURN a.name ORDER BY length(p)"
+)
+
+HOT_CONCEPTS_QUERY = (
+    "MATCH (a:Concept) RETURN a ORDER BY size([(a)--() | 1]) DESC LIMIT $limit"
+)
+
+KB_VERSION_QUERY = "MATCH (m:KBMeta {key: 'version'}) RETURN m.version"
+
+# run when a KB starts, before it writes. Without the KBMeta.key constraint
+# two processes that start on an empty KB at the same time can both make it
+INIT_VERSION_QUERY = (
+    "MERGE (m:KBMeta {key: 'version'}) "
+    "SET m.version = coalesce(m.version, 0) "
+    "RETURN m.version"
+)
+
+# the version of the KB is the seq of the last change in the log. The
+# version node is matched rather than merged, concurrent writes would
+# make one each, so a write without it returns no row
+RECORD_CHANGE_QUERY = (
+    "MATCH (m:KBMeta {key: 'version'}) "
+    "SET m.version = m.version + 1 "
+    "CREATE (c:KBChange {seq: m.version, tags: $tags, added: $added, removed: $removed}) "
+    "RETURN c.seq"
+)
+
+CHANGES_SINCE_QUERY = (
+    "MATCH (c:KBChange) WHERE c.seq > $seq "
+    "RETURN c.seq, c.tags, c.added, c.removed ORDER BY c.seq"
+)
+
+PRUNE_CHANGES_QUERY = "MATCH (c:KBChange) WHERE c.seq <= $seq DELETE c"
+
+# constraints that Neo4j versions before 4.4 don't list are just created again
+SHOW_CONSTRAINTS_QUERY = (
+    "SHOW CONSTRAINTS YIELD labelsOrTypes, properties, type "
+    "RETURN labelsOrTypes, properties, type"
+)
+
+
+@functools.cache
+def unique_constraint_query(label: str, key: str) -> str:
+    """ Also creates the index that lookups by the key use """
+    label, key = check_identifier(label), check_identifier(key)
+    return (
+        f"CREATE CONSTRAINT kb_{label.lower()}_{key.lower()} IF NOT EXISTS "
+        f"FOR (a:{label}) REQUIRE a.{key} IS UNIQUE"
+    )
+
+
+# fields of the concept and of all its ancestors, nearest first. The
+# ancestors are made distinct before their depth is taken, so Neo4j
+# expands each one once instead of enumerating every parent path,
+# which grows exponentially with diamonds in the hierarchy. shortestPath
+# fails when its start and end are the same node, the concept itself
+# is at depth 0 without it
+GET_FIELDS_QUERY = (
+    "MATCH (c) WHERE id(c) = $node_id "
+    "MATCH (c)-[:parent*0..]->(a) WITH DISTINCT c, a "
+    "WITH a, CASE WHEN a = c THEN 0 "
+    "ELSE length(shortestPath((c)-[:parent*1..]->(a))) END AS depth "
+    "MATCH (a)-[:fields]->(f) "
+    "RETURN f.name, f ORDER BY depth"
+)
+
+
+@functools.cache
+def concept_bundle_query(edge_types: tuple[str, ...], depth: int) -> str:
+    """
+    Edges within `depth` hops of the concept and of its ancestors, one
+    row per edge. Paths leave the concepts over outgoing edges and stop
+    at other concepts, so the bundle doesn't spread over the whole KB.
+    """
+    types = "|".join(check_identifier(edge_type) for edge_type in edge_types)
+    return (
+        "MATCH (c:Concept {name: $name}) "
+        "OPTIONAL MATCH up = (c)-[:parent*0..]->(a:Concept) "
+        "WITH c, a, relationships(up) AS parents "
+        f"OPTIONAL MATCH p = (a)-[:{types}*1..{int(depth)}]-() "
+        "WHERE startNode(relationships(p)[0]) = a "
+        "AND none(n IN nodes(p)[1..-1] WHERE n:Concept) "
+        "WITH c, parents + coalesce(relationships(p), []) AS edges "
+        "UNWIND CASE WHEN edges = [] THEN [null] ELSE edges END AS r "
+        "WITH DISTINCT c, r "
+        "RETURN c, r, startNode(r), endNode(r)"
+    )
@@ -0,0 +1,102 @@
+"""
+On-disk second level of the KBCache.
+
+Entries are kept in an SQLite file together with their tags, so a
+restarted agent can answer the same reads without going to Neo4j.
+The file is stamped with the KB version (see KnowledgeBase.get_version)
+it was filled at: when it's opened for another version all entries are
+dropped, since it's not known what changed in between. Writes of this
+process drop the entries by their tags like in memory, and move the
+stamp to the new version as long as nobody else wrote in the meantime.
+
+Keys and tags are stored as their repr(), values are pickled, results
+that can't be pickled are just not stored.
+"""
+import pickle
+import sqlite3
+from typing import Any, Hashable, Iterable
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, tags BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));
+CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+"""
+
+
+class KBDiskCache:
+    def __init__(self, path: str, version: int):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        self.version = None if row is None else row[0]
+        if self.version != version:
+            self.clear()
+            self._set_version(version)
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, key: Hashable) -> tuple[bool, Any, frozenset]:
+        row = self.connection.execute(
+            "SELECT value, tags FROM entries WHERE key = ?", (repr(key), )).fetchone()
+        if row is None:
+            return False, None, frozenset()
+        return True, pickle.loads(row[0]), pickle.loads(row[1])
+
+    def set(self, key: Hashable, value, tags: Iterable[Hashable] = ()):
+        try:
+            data = pickle.dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+
+        tags = frozenset(tags)
+        key = repr(key)
+        with self.connection:
+            self.connection.execute("DELETE FROM tags WHERE key = ?", (key, ))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, tags) VALUES (?, ?, ?)",
+                (key, data, pickle.dumps(tags)))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)",
+                [(repr(tag), key) for tag in tags])
+
+    def invalidate(self, *tags: Hashable) -> int:
+        keys = set()
+        for tag in tags:
+            keys.update(self.connection.execute(
+                "SELECT key FROM tags WHERE tag = ?", (repr(tag), )).fetchall())
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", keys)
+            self.connection.executemany("DELETE FROM tags WHERE key = ?", keys)
+        return len(keys)
+
+    def advance(self, version: int):
+        """ Moves the stamp to the version after a write of this process
+
+        The entries it could have changed are already invalidated, so
+        they stay valid when it's the only change since the last stamp.
+        """
+        if self.version is None or version != self.version + 1:
+            self.clear()
+        self._set_version(version)
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM tags")
+
+    def _set_version(self, version: int):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version, ))
+        self.version = version
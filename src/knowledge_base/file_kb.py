@@ -0,0 +1,565 @@
+"""
+Embedded KB stored in a single memory-mapped file.
+
+The file is opened with mmap and records are decoded only when a read
+touches them, so opening a KB doesn't depend on its size.
+Writes are kept in memory on top of the file and are written out by
+save(), which writes a new file next to the old one and swaps them.
+
+File layout (little endian):
+
+    header       magic, version, counts and offsets of the sections below
+    strings      offsets table + utf-8 bytes of all unique strings, sorted,
+                 so comparing string ids is the same as comparing strings
+    nodes        (id, label, data, meta) sorted by id,
+                 data is a JSON object, meta is the raw _meta string
+    labels       (label, name, node record) sorted, used by find_nodes
+    edges        (start id, end id, type, data) sorted by (start, type, end)
+    in_edges     edge record numbers sorted by (end, type, start)
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+from typing import Iterable, Optional
+
+from src.knowledge_base.graph_index import _matches
+from src.knowledge_base.hierarchy import closure_hierarchy
+from src.knowledge_base.module import (
+    KBNode,
+    KBEdge,
+    KBEdgeType,
+    KBNodeType,
+    KBEdgeDirection,
+    KBNotFoundError,
+    BaseKnowledgeBase,
+    decode_direct_hierarchy,
+)
+
+
+MAGIC = b'AKB1'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIIII6Q')
+STRING_OFFSET = struct.Struct('<Q')
+NODE = struct.Struct('<qIII')
+LABEL = struct.Struct('<III')
+EDGE = struct.Struct('<qqII')
+IN_EDGE = struct.Struct('<I')
+
+# name id of nodes without a name in the label index
+NO_NAME = 0xFFFFFFFF
+
+
+class _Records:
+    """ Read-only sequence view over fixed size records, for bisect """
+    def __init__(self, buffer, offset: int, count: int, record: struct.Struct, key=None):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.record = record
+        self.key = key
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx: int):
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        value = self.record.unpack_from(self.buffer, self.offset + idx * self.record.size)
+        if self.key is not None:
+            return self.key(value)
+        return value
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def write_kb_file(path: str, nodes: Iterable[KBNode],
+                  edges: Iterable[tuple[int, int, str, dict]]):
+    """ Writes nodes and (start id, end id, edge type, data) edges
+    to a new KB file, the old file is replaced atomically
+    """
+    nodes = sorted(nodes, key=lambda node: node.id)
+    edges = list(edges)
+
+    node_strings = [
+        (
+            node.label,
+            _dumps(node.data),
+            node.metadata if isinstance(node.metadata, str) else _dumps(node.metadata) if node.metadata else "",
+        )
+        for node in nodes
+    ]
+    edge_strings = [(edge_type, _dumps(data or {})) for _, _, edge_type, data in edges]
+
+    strings = set()
+    for label, data, meta in node_strings:
+        strings.update((label, data, meta))
+    for node in nodes:
+        if isinstance(node.data.get('name'), str):
+            strings.add(node.data['name'])
+    for edge_type, data in edge_strings:
+        strings.update((edge_type, data))
+
+    strings = sorted(strings)
+    string_ids = {string: idx for idx, string in enumerate(strings)}
+    encoded_strings = [string.encode('utf-8') for string in strings]
+
+    node_records = [
+        (node.id, string_ids[label], string_ids[data], string_ids[meta])
+        for node, (label, data, meta) in zip(nodes, node_strings)
+    ]
+
+    label_records = sorted(
+        (
+            string_ids[node.label],
+            string_ids[node.data['name']] if isinstance(node.data.get('name'), str) else NO_NAME,
+            record_idx,
+        )
+        for record_idx, node in enumerate(nodes)
+    )
+
+    edge_records = sorted(
+        (
+            (start_id, end_id, string_ids[edge_type], string_ids[data])
+            for (start_id, end_id, _, _), (edge_type, data) in zip(edges, edge_strings)
+        ),
+        key=lambda record: (record[0], record[2], record[1]),
+    )
+
+    in_edge_records = sorted(
+        range(len(edge_records)),
+        key=lambda idx: (edge_records[idx][1], edge_records[idx][2], edge_records[idx][0]),
+    )
+
+    string_offsets_offset = HEADER.size
+    string_bytes_offset = string_offsets_offset + STRING_OFFSET.size * (len(strings) + 1)
+    nodes_offset = string_bytes_offset + sum(len(string) for string in encoded_strings)
+    labels_offset = nodes_offset + NODE.size * len(node_records)
+    edges_offset = labels_offset + LABEL.size * len(label_records)
+    in_edges_offset = edges_offset + EDGE.size * len(edge_records)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, len(strings), len(node_records), len(edge_records),
+            string_offsets_offset, string_bytes_offset, nodes_offset,
+            labels_offset, edges_offset, in_edges_offset,
+        ))
+
+        position = 0
+        for string in encoded_strings:
+            f.write(STRING_OFFSET.pack(position))
+            position += len(string)
+        f.write(STRING_OFFSET.pack(position))
+        for string in encoded_strings:
+            f.write(string)
+
+        for record in node_records:
+            f.write(NODE.pack(*record))
+        for record in label_records:
+            f.write(LABEL.pack(*record))
+        for record in edge_records:
+            f.write(EDGE.pack(*record))
+        for record in in_edge_records:
+            f.write(IN_EDGE.pack(record))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+class FileKB(BaseKnowledgeBase):
+    """ Writable KB persisted to a memory-mapped file
+
+    Node ids are ints. New nodes and edges, updated node data and deleted
+    edges are kept in memory until save() is called.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.exists(path):
+            write_kb_file(path, [], [])
+
+        self._file = None
+        self._buffer = None
+        self._open()
+
+        # writes that are not saved yet, _new_by_label has the _new_nodes
+        # by label, edges of the file that were deleted are left out of reads
+        self._new_nodes: dict[int, KBNode] = {}
+        self._new_by_label: dict[str, dict[int, KBNode]] = {}
+        self._deleted_edges: set[tuple[int, int, str]] = set()
+        self._new_out: dict[int, dict[str, list[tuple[dict, int]]]] = {}
+        self._new_in: dict[int, dict[str, list[tuple[dict, int]]]] = {}
+        self._new_edges: list[tuple[int, int, str, dict]] = []
+
+        self._decoded_nodes: dict[int, KBNode] = {}
+        self.next_id = max(self._last_file_node_id() + 1, 1)
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, string_count, node_count, edge_count,
+         string_offsets_offset, string_bytes_offset, nodes_offset,
+         labels_offset, edges_offset, in_edges_offset) = HEADER.unpack_from(self._buffer, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a KB file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported KB file version: {version}")
+
+        self._string_offsets = _Records(
+            self._buffer, string_offsets_offset, string_count + 1, STRING_OFFSET,
+            key=lambda value: value[0])
+        self._string_bytes_offset = string_bytes_offset
+        self._strings = _StringPool(self)
+
+        self._nodes = _Records(self._buffer, nodes_offset, node_count, NODE)
+        self._node_ids = _Records(
+            self._buffer, nodes_offset, node_count, NODE, key=lambda value: value[0])
+        self._labels = _Records(self._buffer, labels_offset, node_count, LABEL)
+        self._edges = _Records(self._buffer, edges_offset, edge_count, EDGE)
+        self._out_keys = _Records(
+            self._buffer, edges_offset, edge_count, EDGE,
+            key=lambda value: (value[0], value[2]))
+        self._in_edges = _Records(
+            self._buffer, in_edges_offset, edge_count, IN_EDGE,
+            key=lambda value: value[0])
+        self._in_keys = _InEdgeKeys(self)
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._file.close()
+            self._buffer = None
+            self._file = None
+
+    def save(self):
+        """ Writes the file together with all unsaved changes and reopens it """
+        nodes = {
+            record[0]: self._decode_node(record)
+            for record in self._nodes
+        }
+        nodes.update(self._new_nodes)
+
+        edges = []
+        for start_id, end_id, edge_type, data in self._edges:
+            edge_type = self._string(edge_type)
+            if (start_id, end_id, edge_type) not in self._deleted_edges:
+                edges.append((start_id, end_id, edge_type, json.loads(self._string(data))))
+        edges += self._new_edges
+
+        self.close()
+        write_kb_file(self.path, nodes.values(), edges)
+        self._open()
+
+        self._new_nodes.clear()
+        self._new_by_label.clear()
+        self._deleted_edges.clear()
+        self._new_out.clear()
+        self._new_in.clear()
+        self._new_edges.clear()
+        self._decoded_nodes.clear()
+
+    def _string(self, string_id: int) -> str:
+        start = self._string_offsets[string_id]
+        end = self._string_offsets[string_id + 1]
+        offset = self._string_bytes_offset
+        return self._buffer[offset + start: offset + end].decode('utf-8')
+
+    def _string_id(self, string: str) -> Optional[int]:
+        idx = bisect.bisect_left(self._strings, string)
+        if idx < len(self._strings) and self._strings[idx] == string:
+            return idx
+        return None
+
+    def _decode_node(self, record) -> KBNode:
+        node_id, label, data, meta = record
+        try:
+            return self._decoded_nodes[node_id]
+        except KeyError:
+            pass
+
+        meta = self._string(meta)
+        node = KBNode(
+            id=node_id,
+            label=self._string(label),
+            data=json.loads(self._string(data)),
+            metadata=meta if meta else {},
+        )
+        self._decoded_nodes[node_id] = node
+        return node
+
+    def _last_file_node_id(self) -> int:
+        if not len(self._node_ids):
+            return 0
+        return self._node_ids[len(self._node_ids) - 1]
+
+    def get_node(self, node_id: int) -> KBNode:
+        try:
+            return self._new_nodes[node_id]
+        except KeyError:
+            pass
+
+        idx = bisect.bisect_left(self._node_ids, node_id)
+        if idx == len(self._node_ids) or self._node_ids[idx] != node_id:
+            raise KBNotFoundError(f"Node {node_id} not found")
+
+        return self._decode_node(self._nodes[idx])
+
+    def _file_edges(self, node_id: int, edge_type: str,
+                    direction: KBEdgeDirection) -> list[tuple[dict, int]]:
+        type_id = self._string_id(edge_type)
+        if type_id is None:
+            return []
+
+        result = []
+
+        if direction in (KBEdgeDirection.OUT, KBEdgeDirection.ANY):
+            start = bisect.bisect_left(self._out_keys, (node_id, type_id))
+            end = bisect.bisect_right(self._out_keys, (node_id, type_id))
+            for idx in range(start, end):
+                _, end_id, _, data = self._edges[idx]
+                if (node_id, end_id, edge_type) not in self._deleted_edges:
+                    result.append((json.loads(self._string(data)), end_id))
+
+        if direction in (KBEdgeDirection.IN, KBEdgeDirection.ANY):
+            start = bisect.bisect_left(self._in_keys, (node_id, type_id))
+            end = bisect.bisect_right(self._in_keys, (node_id, type_id))
+            for idx in range(start, end):
+                start_id, _, _, data = self._edges[self._in_edges[idx]]
+                if (start_id, node_id, edge_type) not in self._deleted_edges:
+                    result.append((json.loads(self._string(data)), start_id))
+
+        return result
+
+    def _unsaved_edges(self, node_id: int, edge_type: str,
+                       direction: KBEdgeDirection) -> list[tuple[dict, int]]:
+        result = []
+        if direction in (KBEdgeDirection.OUT, KBEdgeDirection.ANY):
+            result.extend(self._new_out.get(node_id, {}).get(edge_type, ()))
+        if direction in (KBEdgeDirection.IN, KBEdgeDirection.ANY):
+            result.extend(self._new_in.get(node_id, {}).get(edge_type, ()))
+        return result
+
+    def out_edges(self, node_id: int, edge_type: KBEdgeType,
+                  direction: KBEdgeDirection = KBEdgeDirection.OUT) -> list[tuple[dict, KBNode]]:
+        edges = (
+            self._file_edges(node_id, edge_type.value, direction) +
+            self._unsaved_edges(node_id, edge_type.value, direction)
+        )
+        return [
+            (data, self.get_node(other_id))
+            for data, other_id in edges
+        ]
+
+    def out(self, node_id: int, edge_type: KBEdgeType,
+            edge_filters: tuple = None, direction: KBEdgeDirection = KBEdgeDirection.OUT,
+            direct=True, node_filters: tuple = None) -> list[KBNode]:
+        return [
+            node
+            for data, node in self.out_edges(node_id, edge_type, direction)
+            if _matches(data, edge_filters) and _matches(node.data, node_filters)
+        ]
+
+    def out_dict(self, node_id: int, edge_type: KBEdgeType,
+                 edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                 direct=True) -> dict[str, KBNode]:
+        return {
+            data[key]: node
+            for data, node in self.out_edges(node_id, edge_type, direction)
+        }
+
+    def out_dict2(self, node_id: int, edge_type: KBEdgeType,
+                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                  direct=True) -> dict[str, KBNode]:
+        return {
+            node.data[key]: node
+            for _, node in self.out_edges(node_id, edge_type, direction)
+        }
+
+    def find_nodes(self, node_type: KBNodeType, filters: tuple) -> list[KBNode]:
+        return self._find_nodes(node_type.value, filters)
+
+    def _find_nodes(self, label: str, filters: tuple) -> list[KBNode]:
+        filters = tuple(filters or ())
+        result = {}
+
+        label_id = self._string_id(label)
+        if label_id is not None:
+            name = dict(filters).get('name')
+            if isinstance(name, str):
+                name_id = self._string_id(name)
+                key = (label_id, name_id)
+            else:
+                name_id = 0
+                key = (label_id, )
+
+            if name_id is not None:
+                start = bisect.bisect_left(self._labels, key)
+                for idx in range(start, len(self._labels)):
+                    record = self._labels[idx]
+                    if record[:len(key)] != key:
+                        break
+                    node = self.get_node(self._nodes[record[2]][0])
+                    result[node.id] = node
+
+        # get_node already gave the unsaved data of saved nodes, the
+        # filters below drop the ones that no longer match
+        result.update(self._new_by_label.get(label, {}))
+
+        return [
+            node for node in result.values()
+            if _matches(node.data, filters)
+        ]
+
+    def get_word(self, word: str) -> Optional[KBNode]:
+        nodes = self._find_nodes('Word', (('value', word), ))
+        if not nodes:
+            return None
+        return nodes[0]
+
+    def new_node(self, label: str, data: dict) -> KBNode:
+        data = dict(data)
+        node = KBNode(
+            id=self.next_id,
+            label=label,
+            data=data,
+            metadata=data.pop('_meta', {}),
+        )
+        self.next_id += 1
+        self._set_unsaved(node)
+        return node
+
+    def _set_unsaved(self, node: KBNode):
+        self._new_nodes[node.id] = node
+        self._new_by_label.setdefault(node.label, {})[node.id] = node
+
+    def update_node_data(self, node_id: int, data: dict) -> KBNode:
+        old_node = self.get_node(node_id)
+        node = KBNode(
+            id=old_node.id,
+            label=old_node.label,
+            data={**old_node.data, **data},
+            metadata=old_node.metadata,
+        )
+        self._set_unsaved(node)
+        return node
+
+    def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        self.get_node(start_node_id)
+        self.get_node(end_node_id)
+
+        data = dict(data or {})
+        self._new_out.setdefault(start_node_id, {}).setdefault(label, []).append((data, end_node_id))
+        self._new_in.setdefault(end_node_id, {}).setdefault(label, []).append((data, start_node_id))
+        self._new_edges.append((start_node_id, end_node_id, label, data))
+
+        return KBEdge(
+            id=len(self._edges) + len(self._new_edges) - 1,
+            label=label,
+            start_id=start_node_id,
+            end_id=end_node_id,
+            data=data,
+        )
+
+    def upsert_edge(self, edge_label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        data = dict(data or {})
+        edges = self._file_edges(start_node_id, edge_label, KBEdgeDirection.OUT)
+        edges += self._unsaved_edges(start_node_id, edge_label, KBEdgeDirection.OUT)
+
+        for edge_data, end_id in edges:
+            if end_id == end_node_id and edge_data == data:
+                return KBEdge(
+                    id=None,
+                    label=edge_label,
+                    start_id=start_node_id,
+                    end_id=end_node_id,
+                    data=data,
+                )
+
+        return self.new_edge(edge_label, start_node_id, end_node_id, data)
+
+
+    def delete_edge(self, label: str, start_node_id: int, end_node_id: int) -> int:
+        """Deletes all edges of the label between two nodes, returns how many"""
+        removed = len([
+            end_id
+            for _, end_id in self._file_edges(start_node_id, label, KBEdgeDirection.OUT)
+            if end_id == end_node_id
+        ])
+        if removed:
+            self._deleted_edges.add((start_node_id, end_node_id, label))
+
+        unsaved = len(self._new_edges)
+        self._new_edges = [
+            edge for edge in self._new_edges
+            if edge[:3] != (start_node_id, end_node_id, label)
+        ]
+        removed += unsaved - len(self._new_edges)
+
+        out_edges = self._new_out.get(start_node_id, {})
+        if label in out_edges:
+            out_edges[label] = [edge for edge in out_edges[label] if edge[1] != end_node_id]
+        in_edges = self._new_in.get(end_node_id, {})
+        if label in in_edges:
+            in_edges[label] = [edge for edge in in_edges[label] if edge[1] != start_node_id]
+
+        return removed
+
+    def _iterate_edges(self, edge_type: str) -> Iterable[tuple[int, int]]:
+        """ Yields (start id, end id) of all saved and unsaved edges of the type """
+        type_id = self._string_id(edge_type)
+        if type_id is not None:
+            for start_id, end_id, record_type, _ in self._edges:
+                if record_type == type_id and (start_id, end_id, edge_type) not in self._deleted_edges:
+                    yield start_id, end_id
+
+        for start_id, end_id, label, _ in self._new_edges:
+            if label == edge_type:
+                yield start_id, end_id
+
+    def build_hierarchy(self):
+        direct_parents, _ = self.build_direct_hierarchy()
+        return closure_hierarchy(direct_parents)
+
+    def build_direct_hierarchy(self):
+        rows = []
+        for start_id, end_id in self._iterate_edges(KBEdgeType.PARENT.value):
+            child, parent = self.get_node(start_id), self.get_node(end_id)
+            if child.label == parent.label == KBNodeType.CONCEPT.value:
+                rows.append((child.data['name'], parent.data['name']))
+
+        return decode_direct_hierarchy(rows)
+
+
+class _StringPool:
+    """ Sequence of decoded strings of the string pool, for bisect """
+    def __init__(self, kb: FileKB):
+        self.kb = kb
+
+    def __len__(self):
+        return len(self.kb._string_offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.kb._string(idx)
+
+
+class _InEdgeKeys:
+    """ (end id, type) keys of edges in the order of the in_edges section """
+    def __init__(self, kb: FileKB):
+        self.kb = kb
+
+    def __len__(self):
+        return len(self.kb._in_edges)
+
+    def __getitem__(self, idx: int):
+        start_id, end_id, edge_type, data = self.kb._edges[self.kb._in_edges[idx]]
+        return end_id, edge_type
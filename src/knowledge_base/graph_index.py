@@ -0,0 +1,218 @@
+"""
+In-process indexed copy of a KB graph.
+
+Nodes are stored by id, edges are kept in per node adjacency lists
+grouped by edge type (one for each direction), and property lookups
+are answered from a (label, key) -> value -> node ids index that is
+built the first time a key is used in a filter.
+"""
+from collections import defaultdict
+from typing import Any, Iterable, Optional
+
+from src.knowledge_base.hierarchy import closure_hierarchy
+from src.knowledge_base.module import KBEdgeDirection, KBNode
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+def _matches(data: dict, filters: Optional[tuple]) -> bool:
+    if not filters:
+        return True
+
+    for key, value in filters:
+        if data.get(key) != value:
+            return False
+    return True
+
+
+class GraphIndex:
+    def __init__(self):
+        self.nodes: dict[Any, KBNode] = {}
+        # node id -> edge type -> [(edge data, other node id), ...]
+        self._out: dict[Any, dict[str, list]] = {}
+        self._in: dict[Any, dict[str, list]] = {}
+        # dicts are used as ordered sets
+        self._by_label: dict[str, dict] = defaultdict(dict)
+        # (label, key) -> value -> {node id: None}
+        self._by_property: dict[tuple[str, str], dict] = {}
+        self.edge_count = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.nodes
+
+    def add_node(self, node: KBNode):
+        if node.id in self.nodes:
+            self._unindex_properties(self.nodes[node.id])
+
+        self.nodes[node.id] = node
+        self._by_label[node.label][node.id] = None
+
+        for (label, key), values in self._by_property.items():
+            if label == node.label and key in node.data:
+                values[_hashable(node.data[key])][node.id] = None
+
+    def update_node(self, node: KBNode):
+        """ Replaces stored node with a node that has new data """
+        self.add_node(node)
+
+    def get_node(self, node_id) -> Optional[KBNode]:
+        return self.nodes.get(node_id)
+
+    def add_edge(self, start_id, end_id, edge_type: str, data: dict = None):
+        data = {} if data is None else data
+        self._out.setdefault(start_id, {}).setdefault(edge_type, []).append((data, end_id))
+        self._in.setdefault(end_id, {}).setdefault(edge_type, []).append((data, start_id))
+        self.edge_count += 1
+
+    def has_edge(self, start_id, end_id, edge_type: str, data: dict = None) -> bool:
+        data = {} if data is None else data
+        for edge_data, other_id in self._edges(self._out, start_id, edge_type):
+            if other_id == end_id and edge_data == data:
+                return True
+        return False
+
+    def remove_edge(self, start_id, end_id, edge_type: str) -> int:
+        """ Removes all edges of the type between two nodes """
+        out_edges = self._edges(self._out, start_id, edge_type)
+        in_edges = self._edges(self._in, end_id, edge_type)
+
+        before = len(out_edges)
+        out_edges[:] = [edge for edge in out_edges if edge[1] != end_id]
+        in_edges[:] = [edge for edge in in_edges if edge[1] != start_id]
+
+        removed = before - len(out_edges)
+        self.edge_count -= removed
+        return removed
+
+    def remove_node_edges(self, node_id) -> int:
+        """ Removes all edges from and to the node """
+        removed = 0
+        for adjacency, other_adjacency in ((self._out, self._in), (self._in, self._out)):
+            for edge_type, edges in adjacency.pop(node_id, {}).items():
+                for _, other_id in edges:
+                    other_edges = self._edges(other_adjacency, other_id, edge_type)
+                    other_edges[:] = [edge for edge in other_edges if edge[1] != node_id]
+                # edges to itself are gone from _in after the outgoing ones
+                removed += len(edges)
+        self.edge_count -= removed
+        return removed
+
+    def out_edges(self, node_id, edge_type: str,
+                  direction: KBEdgeDirection = KBEdgeDirection.OUT) -> list[tuple[dict, KBNode]]:
+        """ Returns (edge data, connected node) pairs """
+        if direction is KBEdgeDirection.OUT:
+            edges = self._edges(self._out, node_id, edge_type)
+        elif direction is KBEdgeDirection.IN:
+            edges = self._edges(self._in, node_id, edge_type)
+        else:
+            edges = (
+                self._edges(self._out, node_id, edge_type) +
+                self._edges(self._in, node_id, edge_type)
+            )
+
+        return [
+            (data, self.nodes[other_id])
+            for data, other_id in edges
+        ]
+
+    def out(self, node_id, edge_type: str,
+            edge_filters: tuple = None, node_filters: tuple = None,
+            direction: KBEdgeDirection = KBEdgeDirection.OUT) -> list[KBNode]:
+        return [
+            node
+            for data, node in self.out_edges(node_id, edge_type, direction)
+            if _matches(data, edge_filters) and _matches(node.data, node_filters)
+        ]
+
+    def find_nodes(self, label: str, filters: tuple = ()) -> list[KBNode]:
+        if not filters:
+            return [self.nodes[node_id] for node_id in self._by_label.get(label, ())]
+
+        (key, value), *other_filters = filters
+        node_ids = self._property_index(label, key).get(_hashable(value), ())
+
+        return [
+            self.nodes[node_id]
+            for node_id in node_ids
+            if _matches(self.nodes[node_id].data, other_filters)
+        ]
+
+    @staticmethod
+    def _edges(adjacency: dict, node_id, edge_type: str) -> list:
+        try:
+            return adjacency[node_id][edge_type]
+        except KeyError:
+            return []
+
+    def _property_index(self, label: str, key: str) -> dict:
+        try:
+            return self._by_property[(label, key)]
+        except KeyError:
+            pass
+
+        values = defaultdict(dict)
+        for node_id in self._by_label.get(label, ()):
+            data = self.nodes[node_id].data
+            if key in data:
+                values[_hashable(data[key])][node_id] = None
+
+        self._by_property[(label, key)] = values
+        return values
+
+    def _unindex_properties(self, node: KBNode):
+        for (label, key), values in self._by_property.items():
+            if label == node.label and key in node.data:
+                values[_hashable(node.data[key])].pop(node.id, None)
+
+    def iterate_up(self, node_id, edge_type: str):
+        """ Yields the node and then everything reachable over edges of 
+        the type, breadth first, so the nearest ancestors come first
+        """
+        visited = {node_id, }
+        queue = [node_id, ]
+
+        while queue:
+            next_queue = []
+            for current_id in queue:
+                yield current_id
+                for _, parent_id in self._edges(self._out, current_id, edge_type):
+                    if parent_id not in visited:
+                        visited.add(parent_id)
+                        next_queue.append(parent_id)
+            queue = next_queue
+
+    def build_hierarchy(self, edge_type: str, label: str, direct=False):
+        """ Returns (parents, children) dicts of node names, same as 
+        KnowledgeBase.build_hierarchy
+        """
+        parents = defaultdict(list)
+        children = defaultdict(list)
+
+        for node_id in self._by_label.get(label, ()):
+            child_name = self.nodes[node_id].data['name']
+            for _, parent_id in self._edges(self._out, node_id, edge_type):
+                parent = self.nodes[parent_id]
+                if parent.label != label:
+                    continue
+                parents[child_name].append(parent.data['name'])
+                children[parent.data['name']].append(child_name)
+
+        if direct:
+            return parents, children
+
+        return closure_hierarchy(parents)
+
+    def iterate_edges(self, edge_type: str) -> Iterable[tuple[Any, Any, dict]]:
+        """ Yields (start id, end id, data) of all edges of the type """
+        for start_id, edges in self._out.items():
+            for data, end_id in edges.get(edge_type, ()):
+                yield start_id, end_id, data
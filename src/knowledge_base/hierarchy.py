@@ -1,8 +1,104 @@
 from collections import defaultdict
+from typing import Iterable, Optional
 
+from src.knowledge_base.cache import KBCache
 from src.knowledge_base.concept import Concept
 
 
+def _strongly_connected(direct_parents: dict[str, list[str]]) -> list[list[str]]:
+    """ Tarjan's algorithm without recursion. Components are returned
+    parents first: every component comes after all components it
+    has edges to
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in list(direct_parents):
+        if root in index:
+            continue
+
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(direct_parents.get(root, ())))]
+
+        while work:
+            node, parents = work[-1]
+            for parent in parents:
+                if parent not in index:
+                    index[parent] = lowlink[parent] = len(index)
+                    stack.append(parent)
+                    on_stack.add(parent)
+                    work.append((parent, iter(direct_parents.get(parent, ()))))
+                    break
+                if parent in on_stack:
+                    lowlink[node] = min(lowlink[node], index[parent])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+def closure_hierarchy(direct_parents: dict[str, list[str]]):
+    """
+    Transitive closure of direct parent edges, returns (parents, children)
+    dicts with all ancestors and descendants of every concept, without
+    duplicates and without the concept itself.
+
+    Concepts that are in a cycle are ancestors of each other, the cycle
+    is handled as one component, so every edge is visited once.
+    """
+    ancestors_by_component = {}
+    component_of = {}
+    parents = defaultdict(list)
+
+    for component in _strongly_connected(direct_parents):
+        component_id = len(ancestors_by_component)
+        members = set(component)
+
+        # dict is used as an ordered set
+        ancestors = {}
+        if len(component) > 1:
+            ancestors.update(dict.fromkeys(component))
+        for member in component:
+            component_of[member] = component_id
+            for parent in direct_parents.get(member, ()):
+                if parent in members:
+                    ancestors[parent] = None
+                    continue
+                ancestors[parent] = None
+                ancestors.update(ancestors_by_component[component_of[parent]])
+        ancestors_by_component[component_id] = ancestors
+
+        for member in component:
+            member_parents = [ancestor for ancestor in ancestors if ancestor != member]
+            if member_parents:
+                parents[member] = member_parents
+
+    children = defaultdict(list)
+    for child, child_parents in parents.items():
+        for parent in child_parents:
+            children[parent].append(child)
+
+    return parents, children
+
+
 class BaseHierarchy:
     def get_parents(self, cid: str, include_self=True) -> list[str]:
         pass
@@ -40,20 +136,55 @@ class DictHierarchy(BaseHierarchy):
             raise ValueError("Provide only children or parents")
         else:
             raise ValueError("Provide children or parents")
-
-    def get_parents(self, cid: str, include_self=True) -> list[str]:
-        self_as_parent = [cid, ] if include_self else []
         
-        try:
-            result = set(self_as_parent)
-
-            for parent in self.parents[cid]:
-                result.add(parent)
-                result.update(self.get_parents(parent))
+        # closure of self.parents, computed on first use
+        self._ancestors: Optional[dict[str, list[str]]] = None
+        # (cid, include_self) -> sorted parents
+        self._parents_cache: dict[tuple[str, bool], tuple[str, ...]] = {}
+        self.version = 0
 
-            return sorted(list(result))
+    def get_parents(self, cid: str, include_self=True) -> tuple[str, ...]:
+        try:
+            return self._parents_cache[(cid, include_self)]
         except KeyError:
-            return self_as_parent
+            pass
+        
+        if self._ancestors is None:
+            self._ancestors, _ = closure_hierarchy(self.parents)
+        
+        if cid not in self._ancestors:
+            # unknown concepts are not cached, the parser asks for a lot of them
+            return (cid, ) if include_self else ()
+        
+        result = set(self._ancestors[cid])
+        if include_self:
+            result.add(cid)
+        
+        parents = tuple(sorted(result))
+        self._parents_cache[(cid, include_self)] = parents
+        return parents
+    
+    def get_parents_many(self, cids: Iterable[str], include_self=True) -> dict[str, tuple[str, ...]]:
+        return {
+            cid: self.get_parents(cid, include_self)
+            for cid in cids
+        }
+    
+    def add_parent(self, cid: str, parent: str):
+        self.parents.setdefault(cid, []).append(parent)
+        self.children.setdefault(parent, []).append(cid)
+        self.invalidate()
+    
+    def remove_parent(self, cid: str, parent: str):
+        self.parents[cid].remove(parent)
+        self.children[parent].remove(cid)
+        self.invalidate()
+    
+    def invalidate(self):
+        """ Has to be called after self.parents is changed directly """
+        self._ancestors = None
+        self._parents_cache.clear()
+        self.version += 1
 
     def get_children(self, cid: str, include_self=False) -> list[str]:
         self_as_parent = [cid, ] if include_self else []
@@ -78,7 +209,7 @@ def is_child(hierarchy: BaseHierarchy, concept: Concept, parent: Concept) -> boo
         assert parent.fields == {}
         return True
     
-    if parent.name not in hierarchy.get_parents(concept.get_cid()):
+    if not hierarchy.is_subconcept(concept.get_cid(), parent.name):
         return False
 
     for field_name, field_value in parent.fields.items():
@@ -92,29 +223,180 @@ def is_child(hierarchy: BaseHierarchy, concept: Concept, parent: Concept) -> boo
     return True
 
 
+class SubsumptionChecker:
+    """
+    Cached is_child. Results are kept per (concept cid, pattern cid) pair
+    for every level of the field tree, so patterns that share fields
+    reuse each other's results. The cache is bounded and is dropped when
+    the version of the hierarchy changes.
+    """
+    def __init__(self, hierarchy: BaseHierarchy, maxsize: int = 65536):
+        self.hierarchy = hierarchy
+        self.results = KBCache(maxsize=maxsize)
+        self._version = getattr(hierarchy, 'version', 0)
+
+    def is_child(self, concept: Concept, parent: Concept) -> bool:
+        version = getattr(self.hierarchy, 'version', 0)
+        if version != self._version:
+            self.results.clear()
+            self._version = version
+
+        return self._is_child(concept, parent)
+
+    def _is_child(self, concept: Concept, parent: Concept) -> bool:
+        if parent.name == 'Concept':
+            assert parent.fields == {}
+            return True
+
+        key = (concept.get_cid(), parent.get_cid())
+        found, result = self.results.get(key)
+        if found:
+            return result
+
+        result = self.hierarchy.is_subconcept(key[0], parent.name)
+        if result:
+            for field_name, field_value in parent.fields.items():
+                concept_field_value = concept.fields.get(field_name)
+                if concept_field_value is None or not self._is_child(concept_field_value, field_value):
+                    result = False
+                    break
+
+        self.results.set(key, result)
+        return result
+
+
 class StaticKBHierarchy(BaseHierarchy):
+    """
+    Hierarchy of the KB concepts kept in memory.
+
+    prefetch() loads the direct parent edges, after that the KB reports
+    every added or removed parent edge with add_parent/remove_parent and
+    only the ancestors of the child's subtree and the descendants of the
+    parent's ancestors are recomputed. `version` changes with every change
+    so callers can tell when their own derived data is outdated.
+
+    Results of get_parents/get_children are precomputed tuples (with the
+    concept itself at the end) and ancestors are also kept as frozensets,
+    so reads and is_subconcept don't build anything on every call.
+    """
     def __init__(self, kb):
         self.kb = kb
-        self.cached_children = {}
-        self.cached_parents = {}
+        # concept -> (ancestors or descendants..., concept)
+        self.cached_children: dict[str, tuple[str, ...]] = {}
+        self.cached_parents: dict[str, tuple[str, ...]] = {}
+        self.ancestor_sets: dict[str, frozenset[str]] = {}
+        self.direct_parents = defaultdict(list)
+        self.direct_children = defaultdict(list)
         self.prefeteched = False
+        self.version = 0
 
     def prefetch(self):
         self.prefeteched = True
-        self.cached_parents, self.cached_children = self.kb.build_hierarchy()
+        self.direct_parents, self.direct_children = self.kb.build_direct_hierarchy()
+        parents, children = closure_hierarchy(self.direct_parents)
+
+        self.cached_parents = {}
+        self.cached_children = {}
+        self.ancestor_sets = {}
+        for concept, ancestors in parents.items():
+            self._set_parents(concept, ancestors)
+        for concept, descendants in children.items():
+            self._set_children(concept, descendants)
+        self.version += 1
+
+    def apply_change(self, added: Iterable[tuple[str, str]],
+                     removed: Iterable[tuple[str, str]] = (),
+                     seq: Optional[int] = None):
+        """ (child, parent) edges of a write, a write without edges renamed
+        a concept, seq is the change of the write in the KB change log
+        """
+        if not (added or removed):
+            self.prefetch()
+            return
+        for concept, parent in removed:
+            self.remove_parent(concept, parent)
+        for concept, parent in added:
+            self.add_parent(concept, parent)
+
+    def add_parent(self, concept: str, parent: str):
+        if parent in self.direct_parents[concept]:
+            return
+        self.direct_parents[concept].append(parent)
+        self.direct_children[parent].append(concept)
+        self._update_around(concept, parent)
+
+    def remove_parent(self, concept: str, parent: str):
+        if parent not in self.direct_parents.get(concept, ()):
+            return
+        # ancestors before the removal also lose descendants
+        ancestors = self._walk(parent, self.direct_parents)
+        self.direct_parents[concept] = [
+            other for other in self.direct_parents[concept] if other != parent
+        ]
+        self.direct_children[parent] = [
+            other for other in self.direct_children[parent] if other != concept
+        ]
+        self._update_around(concept, parent, ancestors)
+
+    def _update_around(self, concept: str, parent: str, ancestors: list[str] = ()):
+        for descendant in [concept, ] + self._walk(concept, self.direct_children):
+            self._update_parents(descendant)
+        for ancestor in {parent, *ancestors, *self._walk(parent, self.direct_parents)}:
+            self._update_children(ancestor)
+        self.version += 1
+
+    def _update_parents(self, concept: str):
+        self._set_parents(concept, self._walk(concept, self.direct_parents))
+
+    def _update_children(self, concept: str):
+        self._set_children(concept, self._walk(concept, self.direct_children))
+
+    def _set_parents(self, concept: str, ancestors: list[str]):
+        if ancestors:
+            self.cached_parents[concept] = (*ancestors, concept)
+            self.ancestor_sets[concept] = frozenset(ancestors)
+        else:
+            self.cached_parents.pop(concept, None)
+            self.ancestor_sets.pop(concept, None)
+
+    def _set_children(self, concept: str, descendants: list[str]):
+        if descendants:
+            self.cached_children[concept] = (*descendants, concept)
+        else:
+            self.cached_children.pop(concept, None)
+
+    @staticmethod
+    def _walk(concept: str, edges: dict[str, list[str]]) -> list[str]:
+        """ All concepts reachable over the edges, nearest first """
+        visited = {concept, }
+        result = []
+        queue = [concept, ]
+        while queue:
+            next_queue = []
+            for current in queue:
+                for other in edges.get(current, ()):
+                    if other not in visited:
+                        visited.add(other)
+                        result.append(other)
+                        next_queue.append(other)
+            queue = next_queue
+        return result
+
+    def is_subconcept(self, cid: str, parent_cid: str) -> bool:
+        return cid == parent_cid or parent_cid in self.ancestor_sets.get(cid, ())
 
-    def get_children(self, concept: str, include_self=False):
-        if concept not in self.cached_children:
-            if self.prefeteched:
-                return [concept, ]
+    def get_children(self, concept: str, include_self=False) -> tuple[str, ...]:
+        try:
+            return self.cached_children[concept]
+        except KeyError:
+            return (concept, )
         #     node = self.kb.find_concept(concept)
         #     self.cached_children[concept] = [
         #         node.data['name']
         #         for node in self.kb.find_children(node.id)
         #     ]
-        return self.cached_children[concept] + [concept]
 
-    def get_parents(self, concept: str, include_self=True):
+    def get_parents(self, concept: str, include_self=True) -> tuple[str, ...]:
         # if '{' in concept:
         #     concept_obj = Concept.from_cid(concept)
         #     concept_kb = self.kb.find_concept(concept_obj.name)
@@ -141,9 +423,10 @@ class StaticKBHierarchy(BaseHierarchy):
 
         #     return sorted(list(set(parent_names + aug_parents + [concept_obj.name])))
     
-        if concept not in self.cached_parents:
-            if self.prefeteched:
-                return [concept, ]
+        try:
+            return self.cached_parents[concept]
+        except KeyError:
+            return (concept, )
         #     try:
         #         node = self.kb.find_concept(concept)
         #     except KeyError:
@@ -153,4 +436,85 @@ class StaticKBHierarchy(BaseHierarchy):
         #         node.data['name']
         #         for node in self.kb.find_parents(node.id)
         #     ]
-        return self.cached_parents[concept] + [concept]
+
+
+class SharedKBHierarchy(BaseHierarchy):
+    """
+    Hierarchy read from the file of a SharedKBCache, so the agents of a
+    host don't each keep their own copy of the closure.
+
+    Until the refresher publishes a file with their change, the concepts
+    that writes of this or of other processes moved are read from the kb
+    one by one (the concepts of both ends and the subtrees below the child
+    and above the parent). Without a file all concepts are read that way.
+    """
+    def __init__(self, shared, kb):
+        self.shared = shared
+        self.kb = kb
+        # concept -> seq of the last change that moved it
+        self.overridden: dict[str, int] = {}
+        # seq of the last rename, all concepts are read from the kb
+        self.overridden_all: Optional[int] = None
+        self._changes = 0
+        self._generation = shared.generation
+
+    @property
+    def version(self):
+        self._expire()
+        return (self.shared.generation, self._changes)
+
+    def prefetch(self):
+        self.shared.refresh()
+
+    def _expire(self):
+        """ Drops what a newly published file has """
+        self.shared.maybe_refresh()
+        if self.shared.generation == self._generation:
+            return
+        self._generation = self.shared.generation
+        version = self.shared.version
+
+        if self.overridden_all is not None and version >= self.overridden_all:
+            self.overridden_all = None
+        self.overridden = {
+            concept: seq for concept, seq in self.overridden.items() if seq > version
+        }
+
+    def apply_change(self, added: Iterable[tuple[str, str]],
+                     removed: Iterable[tuple[str, str]] = (),
+                     seq: Optional[int] = None):
+        if not (added or removed):
+            self.overridden_all = seq
+        # the subtrees are taken after the change, neither one depends on the edge
+        moved = [
+            concept
+            for child, parent in (*added, *removed)
+            for concept in (*self.get_children(child), *self.get_parents(parent))
+        ]
+        for concept in moved:
+            self.overridden[concept] = seq
+        self._changes += 1
+
+    def _is_overridden(self, concept: str) -> bool:
+        return not self.shared.attached or self.overridden_all is not None or \
+            concept in self.overridden
+
+    def is_subconcept(self, cid: str, parent_cid: str) -> bool:
+        self._expire()
+        if cid == parent_cid:
+            return True
+        if self._is_overridden(cid):
+            return parent_cid in self.kb.get_ancestor_names(cid)
+        return self.shared.is_ancestor(cid, parent_cid)
+
+    def get_children(self, concept: str, include_self=False) -> tuple[str, ...]:
+        self._expire()
+        if self._is_overridden(concept):
+            return (*self.kb.get_descendant_names(concept), concept)
+        return (*self.shared.descendants(concept), concept)
+
+    def get_parents(self, concept: str, include_self=True) -> tuple[str, ...]:
+        self._expire()
+        if self._is_overridden(concept):
+            return (*self.kb.get_ancestor_names(concept), concept)
+        return (*self.shared.ancestors(concept), concept)
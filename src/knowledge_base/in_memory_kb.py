@@ -1,122 +1,193 @@
 from typing import Optional
+from src.knowledge_base.graph_index import GraphIndex
 from src.knowledge_base.module import (
     KBNode,
     KBEdge,
     KBEdgeType,
     KBNodeType,
     KBEdgeDirection,
+    KBNotFoundError,
     BaseKnowledgeBase,
 )
 
 
+def _edge_label(edge_type: KBEdgeType | str) -> str:
+    """ Edges are kept by their raw label, not every label is a KBEdgeType """
+    return getattr(edge_type, 'value', edge_type)
+
+
 class InMemoryKB(BaseKnowledgeBase):
-    def __init__(self, nodes: list[dict], edges: list[tuple[int, int, str]]):
+    def __init__(self, nodes: list[dict], edges: list[tuple[int, int, KBEdgeType | str]]):
         self.nodes = {}
+        self.index = GraphIndex()
         for node in nodes:
             if node['id'] in self.nodes:
                 raise ValueError(f"Duplicate node id: {node['id']}")
             self.nodes[node['id']] = node
-        
-        self.edges = edges
+            self.index.add_node(KBNode(**node))
+
+        self.edges = [
+            (start_id, end_id, _edge_label(edge_type), *data)
+            for start_id, end_id, edge_type, *data in edges
+        ]
+        for start_id, end_id, label, *data in self.edges:
+            self.index.add_edge(start_id, end_id, label, *data)
+
         self.next_id = max([node['id'] for node in nodes], default=0) + 1
-        
-    def out(self, node_id: int, edge_type: KBEdgeType, 
-            edge_filters: tuple = None, direction: KBEdgeDirection = KBEdgeDirection.OUT, 
-            direct=True) -> list[KBNode]:
-        result = []
-        
-        for start_id, end_id, edge_name in self.edges:
-            if direction is KBEdgeDirection.IN:
-                start_id, end_id = end_id, start_id
-            
-            if direction is KBEdgeDirection.ANY and end_id == node_id:
-                start_id, end_id = end_id, start_id
-                
-            if start_id != node_id:
-                continue
-            
-            if edge_name is not edge_type:
-                continue
-            
-            node = self.nodes[end_id]
-            result.append(KBNode(**node))
-            
-        return result
-    
-    def out_dict(self, node_id: int, edge_type: KBEdgeType, 
-                 edge_filters: tuple, key: str, direction: KBEdgeDirection, 
+        # concept id -> {field name: field node}, nearest definition wins
+        self._fields_cache: dict[int, dict[str, KBNode]] = {}
+
+    def out(self, node_id: int, edge_type: KBEdgeType,
+            edge_filters: tuple = None, direction: KBEdgeDirection = KBEdgeDirection.OUT,
+            direct=True, node_filters: tuple = None) -> list[KBNode]:
+        return self.index.out(
+            node_id, edge_type.value,
+            edge_filters=edge_filters,
+            node_filters=node_filters,
+            direction=direction,
+        )
+
+    def out_dict(self, node_id: int, edge_type: KBEdgeType,
+                 edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
                  direct=True) -> dict[str, KBNode]:
-        pass
-    
-    def out_dict2(self, node_id: int, edge_type: KBEdgeType, 
-                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT, 
+        return {
+            edge[key]: node
+            for edge, node in self.index.out_edges(node_id, edge_type.value, direction)
+        }
+
+    def out_dict2(self, node_id: int, edge_type: KBEdgeType,
+                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
                   direct=True) -> dict[str, KBNode]:
-        result = {}
-        
-        for start_id, end_id, edge_name in self.edges:
-            if start_id != node_id:
-                continue
-            
-            if edge_name is not edge_type:
-                continue
-            
-            node = self.nodes[end_id]
-            result[node['data'][key]] = KBNode(**node)
-            
-        return result
-    
+        return {
+            node.data[key]: node
+            for node in self.index.out(node_id, edge_type.value, direction=direction)
+        }
+
     def find_nodes(self, node_type: KBNodeType, filters: tuple) -> list[KBNode]:
-        result = []
-        
-        for node in self.nodes.values():
-            if node['label'] != node_type.value:
-                continue
-            
-            for key, value in filters:
-                if node['data'].get(key) != value:
-                    break
-            else:
-                result.append(node)
-                
-        return [
-            KBNode(**node) for node in result   
-        ]
-                
+        return self.index.find_nodes(node_type.value, filters)
 
     def get_node(self, node_id: int) -> KBNode:
-        pass
-    
+        node = self.index.get_node(node_id)
+        if node is None:
+            raise KBNotFoundError(f"Node {node_id} not found")
+        return node
+
+    def get_word(self, word: str) -> Optional[KBNode]:
+        nodes = self.index.find_nodes('Word', (('value', word), ))
+        if not nodes:
+            return None
+        return nodes[0]
+
     def new_node(self, label: str, data: dict) -> KBNode:
-        pass
-    
+        data = dict(data)
+        node = {
+            "id": self.next_id,
+            "label": label,
+            "data": data,
+        }
+        if '_meta' in data:
+            node["metadata"] = data.pop('_meta')
+        self.next_id += 1
+
+        self.nodes[node['id']] = node
+        kb_node = KBNode(**node)
+        self.index.add_node(kb_node)
+        return kb_node
+
+    def update_node_data(self, node_id: int, data: dict) -> KBNode:
+        old_node = self.get_node(node_id)
+        data = dict(data)
+        # same as new_node, _meta is the metadata and not part of the data
+        metadata = data.pop('_meta', old_node.metadata)
+        node = KBNode(
+            id=old_node.id,
+            label=old_node.label,
+            data={**old_node.data, **data},
+            metadata=metadata,
+        )
+        self.nodes[node_id] = {
+            "id": node.id,
+            "label": node.label,
+            "data": node.data,
+            "metadata": node.metadata,
+        }
+        self.index.update_node(node)
+        self._fields_cache.clear()
+        return node
+
     def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
-        pass
-    
-    def _iterate_hierarchy_up(self, concept_id: int, already_visited: set[int] = None):
-        if already_visited is None:
-            already_visited = set()
-                        
-        if concept_id in already_visited:
-            return
-            
-        already_visited.add(concept_id)
+        self.get_node(start_node_id)
+        self.get_node(end_node_id)
         
-        yield concept_id
+        label = _edge_label(label)
+        data = dict(data or {})
+        self.edges.append((start_node_id, end_node_id, label, data))
+        self.index.add_edge(start_node_id, end_node_id, label, data)
         
-        parents = []
+        if label in (KBEdgeType.PARENT.value, KBEdgeType.FIELD_NODE.value):
+            self._fields_cache.clear()
+
+        return KBEdge(
+            id=len(self.edges) - 1,
+            label=label,
+            start_id=start_node_id,
+            end_id=end_node_id,
+            data=data,
+        )
+
+    def upsert_edge(self, edge_label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        edge_label = _edge_label(edge_label)
+        if not self.index.has_edge(start_node_id, end_node_id, edge_label, data or {}):
+            return self.new_edge(edge_label, start_node_id, end_node_id, data)
         
-        for edge in self.edges:
-            if edge[0] == concept_id and edge[2] is KBEdgeType.PARENT:
-                yield edge[0]
-                parents.append(edge[1])
-                
-        for parent in parents:
-            yield from self._iterate_hierarchy_up(parent)
+        return KBEdge(
+            id=self._edge_position(start_node_id, end_node_id, edge_label, data or {}),
+            label=edge_label,
+            start_id=start_node_id,
+            end_id=end_node_id,
+            data=data,
+        )
+    
+    def delete_edge(self, label: str, start_node_id: int, end_node_id: int) -> int:
+        label = _edge_label(label)
+        self.edges = [
+            edge for edge in self.edges
+            if (edge[0], edge[1], edge[2]) != (start_node_id, end_node_id, label)
+        ]
+        removed = self.index.remove_edge(start_node_id, end_node_id, label)
+
+        if label in (KBEdgeType.PARENT.value, KBEdgeType.FIELD_NODE.value):
+            self._fields_cache.clear()
+
+        return removed
+
+    def _edge_position(self, start_node_id, end_node_id, edge_label, data) -> int:
+        for idx, (start_id, end_id, label, *edge_data) in enumerate(self.edges):
+            if (start_id, end_id, label) != (start_node_id, end_node_id, edge_label):
+                continue
+            if (edge_data[0] if edge_data else {}) == data:
+                return idx
+
+    def build_hierarchy(self):
+        return self.index.build_hierarchy(
+            KBEdgeType.PARENT.value, KBNodeType.CONCEPT.value)
+
+    def build_direct_hierarchy(self):
+        return self.index.build_hierarchy(
+            KBEdgeType.PARENT.value, KBNodeType.CONCEPT.value, direct=True)
+
+    def get_fields(self, concept_id: int) -> dict[str, KBNode]:
+        """ All fields of the concept including inherited ones """
+        fields = self._fields_cache.get(concept_id)
+        if fields is None:
+            fields = {}
+            for parent_id in self.index.iterate_up(concept_id, KBEdgeType.PARENT.value):
+                for field in self.index.out(parent_id, KBEdgeType.FIELD_NODE.value):
+                    fields.setdefault(field.data['name'], field)
+            self._fields_cache[concept_id] = fields
+
+        # a copy, callers may change the dict they get
+        return dict(fields)
 
     def get_field(self, concept_id: int, field_name: str) -> Optional[KBNode]:
-        for parent_id in self._iterate_hierarchy_up(concept_id):
-            for edge in self.edges:
-                if edge[0] == parent_id and edge[2] is KBEdgeType.FIELD_NODE:
-                    field = self.nodes[edge[1]]
-                    if field['data']['name'] == field_name:
-                        return KBNode(**field)
+        return self.get_fields(concept_id).get(field_name)
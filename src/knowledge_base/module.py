@@ -3,14 +3,29 @@ import json
 import os
 import abc
 import enum
-import functools
-from typing import Optional
-from dataclasses import dataclass, field
+import threading
+import time
+import weakref
+from typing import Any, Callable, Iterable, Optional
+from dataclasses import dataclass
 
+from neo4j.exceptions import Neo4jError
 from neomodel import db, config
 from dotenv import load_dotenv
 
-from src.knowledge_base.hierarchy import StaticKBHierarchy
+from src.knowledge_base import cypher
+from src.knowledge_base.cache import (
+    KBCache,
+    cached_read,
+    decode_tag,
+    edge_tag,
+    encode_tag,
+    label_tag,
+    node_tag,
+)
+from src.knowledge_base.disk_cache import KBDiskCache
+from src.knowledge_base.hierarchy import SharedKBHierarchy, StaticKBHierarchy, closure_hierarchy
+from src.knowledge_base.shared_cache import SharedKBCache
 
 from .concept import Concept
 from src.base_module import AgentModule
@@ -22,6 +37,24 @@ DB_USER = os.environ["DB_USER"]
 DB_PASSWORD = os.environ["DB_PASSWORD"]
 DB_HOST = os.environ["DB_HOST"]
 DB_PORT = os.environ["DB_PORT"]
+# "1" makes the agent load the whole KB into memory at startup
+KB_SNAPSHOT = os.environ.get("KB_SNAPSHOT", "0") == "1"
+# "1" creates missing constraints at startup, otherwise they are
+# created with `python -m src.knowledge_base.schema`
+KB_ENSURE_SCHEMA = os.environ.get("KB_ENSURE_SCHEMA", "0") == "1"
+# SQLite file that keeps cached reads between restarts, off when not set
+KB_CACHE_PATH = os.environ.get("KB_CACHE_PATH")
+# file published by `python -m src.knowledge_base.shared_cache`, used
+# instead of KB_CACHE_PATH when set
+KB_SHARED_CACHE_PATH = os.environ.get("KB_SHARED_CACHE_PATH")
+# hops from a concept that get_concept_bundle reads
+KB_BUNDLE_DEPTH = 6
+# seconds between checks of the change log of other processes in step()
+KB_POLL_INTERVAL = float(os.environ.get("KB_POLL_INTERVAL", "1"))
+# seconds between prunings of the change log in step(), 0 to not prune,
+# processes that fall more than KB_KEEP_CHANGES changes behind drop their cache
+KB_PRUNE_INTERVAL = float(os.environ.get("KB_PRUNE_INTERVAL", "600"))
+KB_KEEP_CHANGES = int(os.environ.get("KB_KEEP_CHANGES", "10000"))
 
 config.DATABASE_URL = f"bolt://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}"
 
@@ -86,51 +119,162 @@ class KBNodeType(enum.Enum):
     TASK = "Task"
     
     
+# property that identifies a node of the label in bulk_upsert
+BULK_UPSERT_KEYS = {
+    "Concept": "name",
+    "Word": "value",
+}
+
+
+# (label, key) pairs that identify nodes, ensure_schema() makes them unique
+# the change log is read and pruned by ranges of seq, through the
+# index of its constraint
+KB_CHANGE_LOG_KEYS = (
+    ("KBMeta", "key"),
+    ("KBChange", "seq"),
+)
+KB_UNIQUE_KEYS = (
+    *BULK_UPSERT_KEYS.items(),
+    *KB_CHANGE_LOG_KEYS,
+)
+
+
+def report_progress(stage: str, done: int, total: int):
+    print(f"{stage}: {done}/{total}")
+
+
+def parent_edge_names(edge_label: str, start_node, end_node) -> Optional[tuple[str, str]]:
+    """ (child, parent) names when the raw nodes of an edge form a
+    parent edge between concepts, these are kept in the hierarchy
+    """
+    if edge_label != "parent":
+        return None
+    if "Concept" not in start_node.labels or "Concept" not in end_node.labels:
+        return None
+    return start_node['name'], end_node['name']
+
+
+def encode_parent_edges(edges: Iterable[tuple[str, str]]) -> list[str]:
+    # concept names never contain tabs
+    return [f"{child}\t{parent}" for child, parent in edges]
+
+
+def decode_parent_edges(edges: Optional[list[str]]) -> list[tuple[str, str]]:
+    return [tuple(edge.split("\t", 1)) for edge in edges or ()]
+
+
 class KBEdgeDirection(enum.Enum):
     """
     enum.auto() guarantees that each value will be unique
     """
     OUT = enum.auto()
     IN = enum.auto()
+    # edges in both directions, in every backend
     ANY = enum.auto()
 
 
-@dataclass
 class KBNode:
     """
-    @dataclass decorator saves you boilerplate code, lines belows are
-    equivalent to doing all the __init__ and self.var = var, etc.
-
     This KBNode class is what the KB will use to manage knowledge
 
+    KBNode(id, label, data, metadata) works like a plain record, metadata
+    is the raw `_meta` value (a JSON string) and `meta` is its decoded dict.
 
-    field is being used in here to assign a default value of an empty dict,
-    it's being used because otherwise every instance of KBNode would share
-    the same default dictionary
+    Nodes made by create() only keep the Neo4j record, `data` and `meta`
+    are decoded from it on first access, so big out() results don't copy
+    properties that nobody reads. __slots__ keeps the objects small.
     """
-    id: int
-    label: str
-    data: dict
-    metadata: dict = field(repr=False, default_factory=dict)
-    
+    __slots__ = ('id', 'label', '_raw', '_data', '_metadata', '_meta', '__weakref__')
+
+    # KBNode(...) == KBNode(...) compares the contents, like the dataclass did
+    __hash__ = None
+
+    def __init__(self, id: int, label: str, data: dict, metadata: dict = None):
+        self.id = id
+        self.label = label
+        self._raw = None
+        self._data = data
+        self._metadata = {} if metadata is None else metadata
+        self._meta = None
+
     @classmethod
-    def create(cls, raw_node):
+    def create(cls, raw_node, identity_map: 'KBIdentityMap' = None):
         """
         raw_node is a Neo4j Node in Cypher_Query syntax
 
-        I think guidelines indicate that it should be named
-        from_raw_node, but create might be more appropiate and intuitive
+        With an identity_map the node that was already created for the
+        same element id is reused and refreshed with the new record.
         """
-        node_data = dict(raw_node)
-        metadata = node_data.pop('_meta')
+        if identity_map is not None:
+            node = identity_map.get(raw_node.element_id)
+            if node is not None:
+                node._set_raw(raw_node)
+                return node
+
+        node = cls.__new__(cls)
+        node.id = raw_node.element_id
+        node.label = next(iter(raw_node.labels))
+        node._set_raw(raw_node)
+
+        if identity_map is not None:
+            identity_map[node.id] = node
+        return node
+
+    def _set_raw(self, raw_node):
+        self._raw = raw_node
+        self._data = None
+        self._metadata = None
+        self._meta = None
+
+    def _decode(self):
+        data = dict(self._raw)
+        self._metadata = data.pop('_meta', {})
+        self._data = data
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._decode()
+        return self._data
+
+    @data.setter
+    def data(self, data: dict):
+        if self._data is None and self._raw is not None:
+            self._decode()
+        self._data = data
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._decode()
+        return self._metadata
+
+    @property
+    def meta(self) -> dict:
+        """ Decoded metadata (x/y of the node in the editor, ...) """
+        if self._meta is None:
+            metadata = self.metadata
+            self._meta = json.loads(metadata) if isinstance(metadata, str) else dict(metadata)
+        return self._meta
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, KBNode):
+            return NotImplemented
+        return (self.id, self.label, self.data, self.metadata) == \
+            (other.id, other.label, other.data, other.metadata)
+
+    def __reduce__(self):
+        return KBNode, (self.id, self.label, self.data, self.metadata)
+
+    def __repr__(self):
+        return f"KBNode(id={self.id!r}, label={self.label!r}, data={self.data!r})"
+
+
+# element id -> the KBNode object of it that is still in use somewhere
+KBIdentityMap = weakref.WeakValueDictionary
 
-        return cls(
-            id=raw_node.element_id,
-            label=list(raw_node.labels)[0],
-            data=node_data,
-            metadata=metadata,
-        )
-        
 
 @dataclass
 class KBEdge:
@@ -169,17 +313,7 @@ class BaseKnowledgeBase(abc.ABC):
         nodes = self.find_nodes(KBNodeType.CONCEPT, (
             ("name", concept_name),
         ))
-        
-        # len(nodes) > 1 is critical, so raise
-        if len(nodes) > 1:
-            raise KBIntegrityError(f"Multiple concepts with name '{concept_name}' found")
-        
-        if not nodes:
-            if should_raise:
-                raise KBNotFoundError(f"Concept '{concept_name}' not found")
-            return None
-        
-        return nodes[0]
+        return pick_concept(nodes, concept_name, should_raise)
     
     def get_parents(self, cid: str, direct=False) -> list[KBNode]:
         node = self.find_concept(cid)
@@ -206,6 +340,61 @@ class BaseKnowledgeBase(abc.ABC):
             direction=KBEdgeDirection.IN,
         )
     
+    def upsert_concept(self, name: str, x: int = 100, y: int = 100):
+        concept = self.find_concept(name, should_raise=False)
+        if concept:
+            return concept
+        
+        return self.new_concept(name, x, y)
+
+    def new_concept(self, name: str, x: int = 100, y: int = 100):
+        # same name that find_concept and upsert_concept look up
+        return self.new_node("Concept", {
+            "name": Concept.get_name(name),
+            "_meta": json.dumps({
+                "x": x,
+                "y": y,
+            })
+        })
+
+    def unit_of_work(self):
+        """
+        Buffers writes until commit(), see unit_of_work.py
+        """
+        from src.knowledge_base.unit_of_work import UnitOfWork
+        return UnitOfWork(self)
+
+    def flush_unit_of_work(self, uow) -> dict:
+        """
+        Writes a unit of work one operation at a time,
+        returns {temporary id: written node}
+        """
+        from src.knowledge_base.unit_of_work import TempId
+
+        resolved = {}
+
+        def real_id(node_id):
+            return resolved[node_id].id if isinstance(node_id, TempId) else node_id
+
+        for node in uow.nodes:
+            existing = []
+            if node.merge_key is not None:
+                existing = self.find_nodes(KBNodeType(node.label), (
+                    (node.merge_key, node.data[node.merge_key]),
+                ))
+            resolved[node.temp_id] = existing[0] if existing else self.new_node(node.label, node.data)
+
+        for node_id, data in uow.updates.items():
+            node = self.update_node_data(real_id(node_id), data)
+            if isinstance(node_id, TempId):
+                resolved[node_id] = node
+
+        for edge in uow.edges:
+            write = self.upsert_edge if edge.merge else self.new_edge
+            write(edge.label, real_id(edge.start_id), real_id(edge.end_id), edge.data)
+
+        return resolved
+
     """
     All these @abstractmethod mean that the child has to define those
     methods itself, otherwise it will raise a TypeError
@@ -228,6 +417,33 @@ class BaseKnowledgeBase(abc.ABC):
             direct=direct,
         )
     
+    def out_many(self, node_ids: list[int], edge_type: KBEdgeType,
+                 edge_filters: tuple = None, node_filters: tuple = None,
+                 direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict[int, list[KBNode]]:
+        """
+        Batch version of out, returns {node_id: [connected nodes]}
+        with an entry for every given node id
+        """
+        return {
+            node_id: self.out(
+                node_id=node_id,
+                edge_type=edge_type,
+                edge_filters=edge_filters,
+                node_filters=node_filters,
+                direction=direction,
+            )
+            for node_id in node_ids
+        }
+    
+    def find_concepts_many(self, cids: list[str]) -> dict[str, Optional[KBNode]]:
+        """
+        Batch version of find_concept, returns {cid: node or None}
+        """
+        return {
+            cid: self.find_concept(cid, should_raise=False)
+            for cid in cids
+        }
+    
     @abc.abstractmethod
     def out_dict(self, node_id: int, edge_type: KBEdgeType, 
                  edge_filters: tuple, key: str, direction: KBEdgeDirection, 
@@ -256,41 +472,534 @@ class BaseKnowledgeBase(abc.ABC):
     def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
         pass
     
-    @abc.abstractmethod
+    def get_fields(self, concept_id: str) -> dict[str, KBNode]:
+        """ All fields of the concept including inherited ones,
+        the nearest definition wins
+        """
+        fields = {}
+        visited = {concept_id, }
+        queue = [concept_id, ]
+
+        while queue:
+            next_queue = []
+            for node_id in queue:
+                for field in self.out(node_id, KBEdgeType.FIELD_NODE):
+                    fields.setdefault(field.data['name'], field)
+                for parent in self.out(node_id, KBEdgeType.PARENT):
+                    if parent.id not in visited:
+                        visited.add(parent.id)
+                        next_queue.append(parent.id)
+            queue = next_queue
+
+        return fields
+
     def get_field(self, concept_id: str, field_name: str) -> Optional[KBNode]:
-        pass
+        """ Field of the concept or of the nearest parent that has it """
+        return self.get_fields(concept_id).get(field_name)
+
+
+# Queries, results and cache tags that KnowledgeBase and AsyncKnowledgeBase
+# share, the two only differ in how they wait for Neo4j
+
+
+def pick_concept(nodes: list[KBNode], concept_name: str, should_raise: bool) -> Optional[KBNode]:
+    """ The node of find_concept among the nodes found by its name """
+    # len(nodes) > 1 is critical, so raise
+    if len(nodes) > 1:
+        raise KBIntegrityError(f"Multiple concepts with name '{concept_name}' found")
+
+    if not nodes:
+        if should_raise:
+            raise KBNotFoundError(f"Concept '{concept_name}' not found")
+        return None
+
+    return nodes[0]
+
+
+def out_request(node_id, edge_type: KBEdgeType,
+                edge_filters: tuple = None, node_filters: tuple = None,
+                direction: KBEdgeDirection = KBEdgeDirection.OUT) -> tuple[str, dict]:
+    """ Query and parameters of out() """
+    query = cypher.out_query(
+        edge_type.value, direction.name,
+        cypher.filter_keys(edge_filters),
+        cypher.filter_keys(node_filters),
+    )
+    return query, {
+        "node_id": int(node_id),
+        "edge_filters": dict(edge_filters or ()),
+        "node_filters": dict(node_filters or ()),
+    }
+
+
+def out_tags(args: dict, result: list[KBNode]) -> list[tuple[str, str]]:
+    return [
+        node_tag(args['node_id']),
+        # the nodes are copies of the neighbours, a neighbour that changes
+        # can also start or stop matching the filters
+        *(node_tag(node.id) for node in result),
+        *([edge_tag(args['edge_type'].value)] if args['edge_filters'] or args['node_filters'] else []),
+    ]
+
+
+def out_dict_tags(args: dict, result: dict[str, KBNode]) -> list[tuple[str, str]]:
+    return [
+        node_tag(args['node_id']),
+        *(node_tag(node.id) for node in result.values()),
+        *([edge_tag(args['edge_type'].value)] if args['edge_filters'] else []),
+    ]
+
+
+def decode_out_dict(results, to_node) -> dict[str, KBNode]:
+    """ out_dict() from rows of (edge, node) """
+    return {edge['name']: to_node(node) for edge, node in results}
+
+
+def decode_out_dict2(results, to_node) -> dict[str, KBNode]:
+    """ out_dict2() from rows of (node, ) """
+    nodes = [to_node(row[0]) for row in results]
+    return {node.data['name']: node for node in nodes}
+
+
+def cached_out_many(kb, node_ids: list, edge_type: KBEdgeType,
+                    edge_filters: tuple = None, node_filters: tuple = None,
+                    direction: KBEdgeDirection = KBEdgeDirection.OUT) -> tuple[dict, dict]:
+    """ {node id: nodes} of out_many with the cached out() results filled
+    in, and {node id: (key, arguments)} of the out() calls that are missing
+    """
+    result = {}
+    missing = {}
+    for node_id in node_ids:
+        key, arguments = kb.out.make_key(
+            kb, node_id, edge_type, edge_filters, node_filters, direction)
+        found, nodes = kb.cache.get(key)
+        if found:
+            result[node_id] = nodes
+        else:
+            result[node_id] = []
+            missing[node_id] = (key, arguments)
+    return result, missing
+
+
+def out_many_request(missing: dict, edge_type: KBEdgeType,
+                     edge_filters: tuple = None, node_filters: tuple = None,
+                     direction: KBEdgeDirection = KBEdgeDirection.OUT) -> tuple[str, dict]:
+    query = cypher.out_many_query(
+        edge_type.value, direction.name,
+        cypher.filter_keys(edge_filters),
+        cypher.filter_keys(node_filters),
+    )
+    return query, {
+        "node_ids": [int(node_id) for node_id in missing],
+        "edge_filters": dict(edge_filters or ()),
+        "node_filters": dict(node_filters or ()),
+    }
+
+
+def store_out_many(kb, result: dict, missing: dict, results):
+    """ Adds the rows of (source id, node) to result and caches them as out() """
+    source_ids = {int(node_id): node_id for node_id in missing}
+    for source_id, node in results:
+        result[source_ids[source_id]].append(kb._to_node(node))
+
+    for node_id, (key, arguments) in missing.items():
+        kb.out.store(kb, key, arguments, result[node_id])
 
 
-def dict_to_fields(dct: dict):
+def concept_names(cids: list[str]) -> dict[str, str]:
+    """ {cid: name} of find_concepts_many, the names are queried once """
+    return {cid: Concept.get_name(cid) for cid in cids}
+
+
+def decode_concepts_many(names: dict[str, str], results, to_node) -> dict[str, Optional[KBNode]]:
+    """ find_concepts_many() from rows of (name, node) """
+    nodes = defaultdict(list)
+    for name, node in results:
+        nodes[name].append(to_node(node))
+
+    result = {}
+    for cid, name in names.items():
+        if len(nodes[name]) > 1:
+            raise KBIntegrityError(f"Multiple concepts with name '{name}' found")
+        result[cid] = nodes[name][0] if nodes[name] else None
+
+    return result
+
+
+def decode_word_concepts_many(words: list[str], results) -> dict[str, list[str]]:
+    # fresh lists, callers may add to them
+    concepts = {word: [] for word in words}
+    concepts.update((word, list(names)) for word, names in results)
+    return concepts
+
+
+def outcomes_tags(args: dict, result: list) -> list[tuple[str, str]]:
+    return [
+        node_tag(args['node_id']),
+        *(node_tag(node.id) for pair in result for node in pair),
+        # new outcome edges of outcome nodes that were already there
+        edge_tag('act'),
+        edge_tag('outcome'),
+    ]
+
+
+def decode_outcomes(results, to_node) -> list[tuple[KBNode, KBNode]]:
+    return [(to_node(row[0]), to_node(row[1])) for row in results]
+
+
+def fields_tags(args: dict, result: dict[str, KBNode]) -> list[tuple[str, str]]:
+    return [
+        node_tag(args['concept_id']),
+        edge_tag(KBEdgeType.PARENT.value),
+        edge_tag(KBEdgeType.FIELD_NODE.value),
+        *(node_tag(field.id) for field in result.values()),
+    ]
+
+
+def decode_fields(results, to_node) -> dict[str, KBNode]:
+    """ get_fields() from rows of (name, field) nearest first """
+    fields = {}
+    for name, node in results:
+        if name not in fields:
+            fields[name] = to_node(node)
+    return fields
+
+
+def concept_subgraph_tags(args: dict, result) -> list[tuple[str, str]]:
+    if result is None:
+        return [label_tag(KBNodeType.CONCEPT.value)]
+    return [
+        edge_tag(KBEdgeType.PARENT.value),
+        *(node_tag(node_id) for node_id in result[1].nodes),
+    ]
+
+
+def missing_constraints(results, keys: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    """ (label, key) pairs of keys that the rows of SHOW_CONSTRAINTS_QUERY
+    don't have a uniqueness constraint for
     """
-    Turns given dict into a string written like a dict,
-    only change is that it gets rid of keys's quotation marks
+    existing = {
+        (labels[0], properties[0])
+        for labels, properties, kind in results
+        if labels and properties and len(properties) == 1 and "UNIQUE" in kind
+    }
+    return [pair for pair in keys if pair not in existing]
+
+
+def decode_version(results) -> int:
+    """ Version from the rows of KB_VERSION_QUERY or INIT_VERSION_QUERY """
+    return results[0][0] if results else 0
+
+
+def recorded_seq(results) -> int:
+    """ seq of a change from the rows of RECORD_CHANGE_QUERY """
+    if not results:
+        raise KBIntegrityError(
+            "KB version node is missing, the KB has to be started before it is written to")
+    return results[0][0]
+
+
+def check_schema(keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
+    """ (label, key) pairs of keys without a uniqueness constraint """
+    try:
+        results, _ = db.cypher_query(cypher.SHOW_CONSTRAINTS_QUERY)
+    except Neo4jError:
+        return list(keys)
+
+    return missing_constraints(results, keys)
+
+
+def ensure_schema(keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
     """
-    result = ""
-    
-    for i, (key, value) in enumerate(dct.items()):
-        if i != 0:
-            result += ', '
-        if isinstance(value, str):
-            result += f'{key}: \'{value}\''
+    Creates the uniqueness constraints, and with them the indexes, that
+    find_concept, get_word and the change log look nodes up by.
+    Returns the ones it created, raises KBIntegrityError when some
+    can't be created, e.g. because the KB already has duplicates.
+    Only needs the database, not a KnowledgeBase.
+    """
+    created = []
+    errors = []
+    for label, key in check_schema(keys):
+        try:
+            db.cypher_query(cypher.unique_constraint_query(label, key))
+        except Neo4jError as error:
+            errors.append(f"{label}.{key}: {error}")
         else:
-            result += f'{key}: {value}'
-    return f"{{{result}}}"
+            created.append((label, key))
+
+    if errors:
+        raise KBIntegrityError("Can't create KB constraints, " + "; ".join(errors))
+    return created
+
+
+def record_change_params(tags: Iterable[tuple[str, str]],
+                         added: Iterable[tuple[str, str]] = (),
+                         removed: Iterable[tuple[str, str]] = ()) -> dict:
+    """ Parameters of RECORD_CHANGE_QUERY """
+    return {
+        "tags": [encode_tag(tag) for tag in tags],
+        "added": encode_parent_edges(added),
+        "removed": encode_parent_edges(removed),
+    }
+
+
+def change_tags(tags: Iterable[tuple[str, str]],
+                added: Iterable[tuple[str, str]] = (),
+                removed: Iterable[tuple[str, str]] = ()) -> set[tuple[str, str]]:
+    """ All the tags that a change invalidates """
+    tags = set(tags)
+    if added or removed:
+        tags.add(edge_tag(KBEdgeType.PARENT.value))
+    return tags
+
+
+def edge_write_tags(edge_label: str, start_node_id, end_node_id) -> list[tuple[str, str]]:
+    tags = [node_tag(start_node_id), node_tag(end_node_id)]
+    # parent edges drop their tag through the hierarchy edges of the change
+    if edge_label != KBEdgeType.PARENT.value:
+        tags.append(edge_tag(edge_label))
+    return tags
+
+
+def parent_edges(edge_label: str, results, start: int = 1) -> list[tuple[str, str]]:
+    """ Parent edges between concepts among the rows of a write,
+    the start and end nodes are in the columns start and start + 1
+    """
+    edges = []
+    for row in results:
+        edge = parent_edge_names(edge_label, row[start], row[start + 1])
+        if edge is not None and edge not in edges:
+            edges.append(edge)
+    return edges
+
+
+def update_write_tags(node_id, node: KBNode, data: dict) -> list[tuple[str, str]]:
+    tags = [node_tag(node_id), label_tag(node.label)]
+    if "name" in data and node.label == KBNodeType.CONCEPT.value:
+        # the hierarchy is keyed by names
+        tags.append(edge_tag(KBEdgeType.PARENT.value))
+    return tags
+
+
+def decode_direct_hierarchy(results) -> tuple[dict, dict]:
+    """ {child: direct parents} and {parent: direct children} from rows
+    of DIRECT_HIERARCHY_QUERY
+    """
+    parents = defaultdict(list)
+    children = defaultdict(list)
+    for child, parent in results:
+        parents[child].append(parent)
+        children[parent].append(child)
+
+    return parents, children
+
+
+class KBChangeLog:
+    """
+    Which changes of the KB change log a process has applied. Own writes
+    are applied when they are made and skipped when they are polled, the
+    writes of other processes are applied in the order of the log.
+    """
+    def __init__(self, applied_seq: Optional[int] = None):
+        # seq of the last change applied, None until it was first read.
+        # own writes that got ahead of changes of others wait in own_changes
+        self.applied_seq = applied_seq
+        self.own_changes: set[int] = set()
+
+    def start(self, version: int):
+        """ Changes up to version are applied """
+        self.applied_seq = version
+        self.own_changes = {seq for seq in self.own_changes if seq > version}
+
+    def own(self, seq: int) -> bool:
+        """ This process wrote the change seq, returns if applied_seq moved """
+        self.own_changes.add(seq)
+        if self.applied_seq is None:
+            return False
+
+        moved = False
+        while self.applied_seq + 1 in self.own_changes:
+            self.applied_seq += 1
+            self.own_changes.discard(self.applied_seq)
+            moved = True
+        return moved
+
+    def missed(self, results) -> bool:
+        """ The log was pruned past the last applied change before the rows
+        of CHANGES_SINCE_QUERY, the changes in between are lost and
+        applied_seq moves to the last of the rows
+        """
+        if results[0][0] == self.applied_seq + 1:
+            return False
+        self.start(results[-1][0])
+        return True
+
+    def foreign(self, results):
+        """ Yields the (seq, tags, added, removed) changes of other processes
+        among the rows of CHANGES_SINCE_QUERY, applied_seq follows the
+        changes as they are applied
+        """
+        for seq, tags, added, removed in results:
+            if seq in self.own_changes:
+                self.own_changes.discard(seq)
+            else:
+                yield (
+                    seq,
+                    [decode_tag(tag) for tag in tags or ()],
+                    decode_parent_edges(added),
+                    decode_parent_edges(removed),
+                )
+            self.applied_seq = seq
 
 
 class KnowledgeBase(BaseKnowledgeBase, AgentModule):
     """
     Classes separated by commas indicates a multiple inheritance
 
-    What @cache does is remembering the result of a previous computation.
-    f(n) is stored so when called again there's no need to run the function
+    What @cached_read does is remembering the result of a previous computation.
+    f(n) is stored in self.cache so when called again there's no need to run 
+    the function, writes drop the results they could have changed
     """
-    def __init__(self, core):
+    def __init__(self, core, cache_size: int = 4096, cache_ttl: Optional[float] = None,
+                 cache_path: Optional[str] = KB_CACHE_PATH,
+                 shared_cache_path: Optional[str] = KB_SHARED_CACHE_PATH,
+                 poll_interval: float = KB_POLL_INTERVAL,
+                 prune_interval: float = KB_PRUNE_INTERVAL,
+                 keep_changes: int = KB_KEEP_CHANGES):
         super().__init__(core)
-        self.hierarchy = StaticKBHierarchy(self)
+        if KB_ENSURE_SCHEMA:
+            self.ensure_schema()
+
+        results, _ = db.cypher_query(cypher.INIT_VERSION_QUERY)
+        self.changes = KBChangeLog(decode_version(results))
+        self._changes_lock = threading.Lock()
+        self.poll_interval = poll_interval
+        self._polled_at = time.monotonic()
+        self.prune_interval = prune_interval
+        self.keep_changes = keep_changes
+        self._pruned_at = time.monotonic()
+
+        if shared_cache_path:
+            store = SharedKBCache(shared_cache_path)
+        elif cache_path:
+            store = KBDiskCache(cache_path, self.applied_seq)
+        else:
+            store = None
+        self.cache = KBCache(maxsize=cache_size, ttl=cache_ttl, store=store)
+
+        if shared_cache_path:
+            self.hierarchy = SharedKBHierarchy(store, self)
+        else:
+            self.hierarchy = StaticKBHierarchy(self)
+        self.identity_map = KBIdentityMap()
+        self.hierarchy.prefetch()
+
+    @property
+    def applied_seq(self) -> int:
+        """ seq of the last change in the log that this process has applied """
+        return self.changes.applied_seq
+
+    def _to_node(self, raw_node) -> KBNode:
+        return KBNode.create(raw_node, self.identity_map)
+
+    def get_hot_concepts(self, limit: int) -> list[KBNode]:
+        """ Concepts with the most edges """
+        results, _ = db.cypher_query(cypher.HOT_CONCEPTS_QUERY, {
+            "limit": limit,
+        })
+        return [self._to_node(row[0]) for row in results]
+
+    def step(self):
+        if time.monotonic() - self._polled_at >= self.poll_interval:
+            self.poll_changes()
+        if self.prune_interval and time.monotonic() - self._pruned_at >= self.prune_interval:
+            self.prune_changes(self.keep_changes)
+
+    def check_schema(self, keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
+        """ Same as check_schema() of this module """
+        return check_schema(keys)
+
+    def ensure_schema(self, keys: Iterable[tuple[str, str]] = KB_UNIQUE_KEYS) -> list[tuple[str, str]]:
+        """ Same as ensure_schema() of this module """
+        return ensure_schema(keys)
+
+    def get_version(self) -> int:
+        """ Version stamp of the KB, seq of the last change in the change log """
+        results, _ = db.cypher_query(cypher.KB_VERSION_QUERY)
+        return decode_version(results)
+
+    def _record_change(self, tags: Iterable[tuple[str, str]],
+                       added: Iterable[tuple[str, str]] = (),
+                       removed: Iterable[tuple[str, str]] = ()) -> int:
+        """
+        Appends a write to the change log, in the transaction of the write
+        when there is one. tags are the cache tags it invalidates, added
+        and removed the (child, parent) edges of the hierarchy.
+        Returns the seq of the change, the new version of the KB.
+        """
+        results, _ = db.cypher_query(
+            cypher.RECORD_CHANGE_QUERY, record_change_params(tags, added, removed))
+        return recorded_seq(results)
+
+    def _apply_change(self, tags: Iterable[tuple[str, str]],
+                      added: Iterable[tuple[str, str]] = (),
+                      removed: Iterable[tuple[str, str]] = (),
+                      seq: Optional[int] = None, own: bool = True):
+        """ Drops what a write made stale, for writes of this (own) and of
+        other processes, seq is the change of the write in the log
+        """
+        tags = change_tags(tags, added, removed)
+        self.cache.invalidate(*tags)
+
+        if edge_tag(KBEdgeType.PARENT.value) in tags:
+            self.hierarchy.apply_change(added, removed, seq)
+
+    def _applied_own_change(self, seq: int):
+        with self._changes_lock:
+            if self.changes.own(seq) and self.cache.store is not None:
+                self.cache.store.advance(self.applied_seq)
+
+    def poll_changes(self) -> int:
+        """
+        Applies the writes of other processes that were logged since the
+        last poll, returns how many there were
+        """
+        with self._changes_lock:
+            self._polled_at = time.monotonic()
+            results, _ = db.cypher_query(cypher.CHANGES_SINCE_QUERY, {
+                "seq": self.applied_seq,
+            })
+            if not results:
+                return 0
+
+            if self.changes.missed(results):
+                self._missed_changes()
+                foreign = len(results)
+            else:
+                foreign = 0
+                for seq, tags, added, removed in self.changes.foreign(results):
+                    foreign += 1
+                    self._apply_change(tags, added, removed, seq, own=False)
+
+            if self.cache.store is not None:
+                self.cache.store.advance(self.applied_seq)
+            return foreign
+
+    def _missed_changes(self):
+        """ Changes of other processes were pruned before they were applied """
+        self.cache.clear()
         self.hierarchy.prefetch()
+
+    def prune_changes(self, keep: int = KB_KEEP_CHANGES):
+        """ Deletes all but the last `keep` changes from the log, processes
+        that haven't seen the deleted ones drop their whole cache
+        """
+        self._pruned_at = time.monotonic()
+        db.cypher_query(cypher.PRUNE_CHANGES_QUERY, {
+            "seq": self.get_version() - keep,
+        })
     
-    @functools.cache
+    @cached_read(out_tags)
     def out(self, node_id: int, edge_type: KBEdgeType, 
             edge_filters: tuple = None, node_filters: tuple = None,
               direction: KBEdgeDirection = KBEdgeDirection.OUT, 
@@ -300,18 +1009,10 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
         all nodes (b) that are connected to (a) meeting the other 3
         arguments of edge type, edge filter and direction
         """
+        results, columns = db.cypher_query(*out_request(
+            node_id, edge_type, edge_filters, node_filters, direction))
 
-        # if direction == KBEdgeDirection.OUT points edge from a to b
-        left_arr = "-" if direction == KBEdgeDirection.OUT else "<-"
-        right_arr = "->" if direction == KBEdgeDirection.OUT else "-"
-        
-        edge_filters = dict_to_fields(dict(edge_filters)) if edge_filters else ""
-        node_filters = dict_to_fields(dict(node_filters)) if node_filters else ""
-        
-        results, columns = db.cypher_query(
-            f"""MATCH (a){left_arr}[r:{edge_type.value}{edge_filters}]{right_arr}(b {node_filters}) WHERE id(a)={int(node_id)} RETURN b""")
-
-        return [KBNode.create(row[0]) for row in results]
+        return [self._to_node(row[0]) for row in results]
     
     def out_one(self, *args, **kwargs):
         """
@@ -326,7 +1027,38 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
         
         return results[0]
 
-    @functools.cache
+    def out_many(self, node_ids: list[int], edge_type: KBEdgeType,
+                 edge_filters: tuple = None, node_filters: tuple = None,
+                 direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict[int, list[KBNode]]:
+        """
+        Same as out but for many nodes in one round trip,
+        results are grouped by the source node id
+        """
+        result, missing = cached_out_many(
+            self, node_ids, edge_type, edge_filters, node_filters, direction)
+        if not missing:
+            return result
+        
+        results, columns = db.cypher_query(*out_many_request(
+            missing, edge_type, edge_filters, node_filters, direction))
+        store_out_many(self, result, missing, results)
+
+        return result
+    
+    def find_concepts_many(self, cids: list[str]) -> dict[str, Optional[KBNode]]:
+        """
+        Same as find_concept(cid, should_raise=False) for many concepts
+        in one round trip
+        """
+        names = concept_names(cids)
+        
+        results, columns = db.cypher_query(cypher.FIND_CONCEPTS_MANY_QUERY, {
+            "names": list(set(names.values())),
+        })
+            
+        return decode_concepts_many(names, results, self._to_node)
+    
+    @cached_read(out_dict_tags)
     def out_dict(self, node_id: int, edge_type: KBEdgeType, 
                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT, 
                  direct=True) -> dict[str, KBNode]:
@@ -337,15 +1069,14 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
            + value is (b)
          - No Edge filter
         """
-        left_arr = "-" if direction == KBEdgeDirection.OUT else "<-"
-        right_arr = "->" if direction == KBEdgeDirection.OUT else "-"
-        
-        results, columns = db.cypher_query(
-            f"""MATCH (a){left_arr}[r:{edge_type.value}]{right_arr}(b) WHERE id(a)={int(node_id)} RETURN r, b""")
+        query = cypher.out_query(edge_type.value, direction.name, returns="r, b")
+        results, columns = db.cypher_query(query, {
+            "node_id": int(node_id),
+        })
 
-        return {edge['name']: KBNode.create(node) for edge, node in results}
+        return decode_out_dict(results, self._to_node)
     
-    @functools.cache
+    @cached_read(out_dict_tags)
     def out_dict2(self, node_id: int, edge_type: KBEdgeType, 
                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT, 
                  direct=True) -> dict[str, KBNode]:
@@ -355,71 +1086,108 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
         nodes is a list of KBNodes based on (b)'s
         returned dict is {KBNode.name:KBNode}
         """
-        left_arr = "-" if direction == KBEdgeDirection.OUT else "<-"
-        right_arr = "->" if direction == KBEdgeDirection.OUT else "-"
-        
-        results, columns = db.cypher_query(
-            f"""MATCH (a){left_arr}[r:{edge_type.value}]{right_arr}(b) WHERE id(a)={int(node_id)} RETURN b""")
+        query = cypher.out_query(edge_type.value, direction.name)
+        results, columns = db.cypher_query(query, {
+            "node_id": int(node_id),
+        })
 
-        nodes = [KBNode.create(result[0]) for result in results]
-        return {node.data['name']: node for node in nodes}
+        return decode_out_dict2(results, self._to_node)
     
-    @functools.cache
+    @cached_read(lambda args, result: [label_tag(args['node_type'].value)])
     def find_nodes(self, node_type: KBNodeType, filters: tuple) -> list[KBNode]:
         """Find all nodes that match the label and filters"""
-        filters = dict_to_fields(dict(filters))
-        
-        node_label = node_type.value
-        
-        results, columns = db.cypher_query(
-            f"""MATCH (a:{node_label}{filters}) RETURN a""")
+        query = cypher.find_nodes_query(node_type.value, cypher.filter_keys(filters))
+        results, columns = db.cypher_query(query, {
+            "filters": dict(filters),
+        })
 
         return [
-            KBNode.create(row[0]) for row in results
+            self._to_node(row[0]) for row in results
         ]
 
     def get_node(self, node_id: int) -> KBNode:
         """Search node by id"""
-        results, columns = db.cypher_query(
-            f"""MATCH (a) WHERE id(a)={int(node_id)} RETURN a""")
+        results, columns = db.cypher_query(cypher.GET_NODE_QUERY, {
+            "node_id": int(node_id),
+        })
 
-        return KBNode.create(results[0][0])
+        return self._to_node(results[0][0])
     
-    @functools.cache
+    @cached_read(outcomes_tags)
     def get_outcomes(self, node_id):
-        results, columns = db.cypher_query(
-            f"""MATCH (a:Concept)-[:outcome]->(b:Outcome)-[:act]->(c:Concept) WHERE id(c)={int(node_id)} RETURN a, b""")
-
-        results = [
-            (KBNode.create(row[0]), KBNode.create(row[1]))
-            for row in results
-        ]
+        results, columns = db.cypher_query(cypher.GET_OUTCOMES_QUERY, {
+            "node_id": int(node_id),
+        })
 
-        return results
+        return decode_outcomes(results, self._to_node)
     
-    @functools.cache
+    @cached_read(lambda args, result: [label_tag('Word')])
     def get_word(self, word: str):
-        results, columns = db.cypher_query(
-            f"""MATCH (a:Word {{value: '{word}'}}) RETURN a""")
+        results, columns = db.cypher_query(cypher.GET_WORD_QUERY, {
+            "value": word,
+        })
         
         if not results:
             return None
 
-        return KBNode.create(results[0][0])
+        return self._to_node(results[0][0])
+
+    def get_word_concepts_many(self, words: Iterable[str]) -> dict[str, list[str]]:
+        """ {word: names of its associated concepts} for all the words in
+        one round trip, words that aren't in the KB have none
+        """
+        words = list(dict.fromkeys(words))
+        results, _ = db.cypher_query(cypher.WORD_CONCEPTS_MANY_QUERY, {
+            "values": words,
+        })
+
+        return decode_word_concepts_many(words, results)
+
+    @cached_read(lambda args, result: [
+        label_tag('Word'),
+        edge_tag(KBEdgeType.ASSOCIATED.value),
+        # concepts were renamed
+        edge_tag(KBEdgeType.PARENT.value),
+    ])
+    def word_concepts(self) -> dict[str, tuple[str, ...]]:
+        """
+        {word: names of its associated concepts} of all the words in the
+        KB, loaded with one query the first time and after writes that
+        could change it. The dict is shared by all callers, the names are
+        tuples so they can't be changed by accident
+        """
+        results, _ = db.cypher_query(cypher.ALL_WORD_CONCEPTS_QUERY)
+        return {word: tuple(names) for word, names in results}
+
+    def word_concepts_loaded(self) -> bool:
+        key, _ = KnowledgeBase.word_concepts.make_key(self)
+        return self.cache.get(key)[0]
     
     def new_node(self, label: str, data: dict) -> KBNode:
-        data = dict_to_fields(data)
-        
-        results, columns = db.cypher_query(
-            f"""CREATE (a:{label} {data}) RETURN a""")
+        with db.transaction:
+            results, columns = db.cypher_query(cypher.new_node_query(label), {
+                "props": data,
+            })
+            # the node tag tells other processes which node is new
+            tags = [label_tag(label), node_tag(results[0][0].element_id)]
+            seq = self._record_change(tags)
+        self._apply_change(tags, seq=seq)
+        self._applied_own_change(seq)
 
-        return KBNode.create(results[0][0])
+        return self._to_node(results[0][0])
 
     def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
-        data = dict_to_fields(data)
-        
-        results, columns = db.cypher_query(
-            f"""MATCH (a), (b) WHERE id(a)={int(start_node_id)} AND id(b)={int(end_node_id)} CREATE (a)-[r:{label} {data}]->(b) RETURN r""")
+        tags = edge_write_tags(label, start_node_id, end_node_id)
+        with db.transaction:
+            results, columns = db.cypher_query(cypher.new_edge_query(label), {
+                "start_id": int(start_node_id),
+                "end_id": int(end_node_id),
+                "props": data,
+            })
+            added = parent_edges(label, results)
+            seq = self._record_change(tags, added)
+        self._apply_change(tags, added, seq=seq)
+        self._applied_own_change(seq)
 
         return KBEdge(
             id=results[0][0].element_id,
@@ -430,13 +1198,22 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
         )
         
     def upsert_edge(self, edge_label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
-        data = dict_to_fields(data)
         """
         I think this creates edges but only if they don't exist in that
         specific configuration
         """
-        results, columns = db.cypher_query(
-            f"""MATCH (a), (b) WHERE id(a)={int(start_node_id)} AND id(b)={int(end_node_id)} MERGE (a)-[r:{edge_label} {data}]->(b) RETURN r""")
+        query = cypher.upsert_edge_query(edge_label, cypher.filter_keys(data))
+        tags = edge_write_tags(edge_label, start_node_id, end_node_id)
+        with db.transaction:
+            results, columns = db.cypher_query(query, {
+                "start_id": int(start_node_id),
+                "end_id": int(end_node_id),
+                "props": data,
+            })
+            added = parent_edges(edge_label, results)
+            seq = self._record_change(tags, added)
+        self._apply_change(tags, added, seq=seq)
+        self._applied_own_change(seq)
 
         return KBEdge(
             id=results[0][0].element_id,
@@ -446,53 +1223,271 @@ class KnowledgeBase(BaseKnowledgeBase, AgentModule):
             data=data,
         )
         
+    def delete_edge(self, label: str, start_node_id: int, end_node_id: int) -> int:
+        """Deletes all edges of the label between two nodes, returns how many"""
+        tags = edge_write_tags(label, start_node_id, end_node_id)
+        with db.transaction:
+            results, columns = db.cypher_query(cypher.delete_edge_query(label), {
+                "start_id": int(start_node_id),
+                "end_id": int(end_node_id),
+            })
+            if not results:
+                return 0
+            removed = parent_edges(label, results[:1], start=0)
+            seq = self._record_change(tags, removed=removed)
+        self._apply_change(tags, removed=removed, seq=seq)
+        self._applied_own_change(seq)
+
+        return len(results)
+
     def update_node_data(self, node_id: int, data: dict):
-        data = dict_to_fields(data)
         """Changes the properties of a node"""
-        results, columns = db.cypher_query(
-            f"""MATCH (a) WHERE id(a)={int(node_id)} SET a += {data} RETURN a""")
+        with db.transaction:
+            results, columns = db.cypher_query(cypher.UPDATE_NODE_DATA_QUERY, {
+                "node_id": int(node_id),
+                "props": data,
+            })
+            node = self._to_node(results[0][0])
+            tags = update_write_tags(node_id, node, data)
+            seq = self._record_change(tags)
+        self._apply_change(tags, seq=seq)
+        self._applied_own_change(seq)
 
-        return KBNode.create(results[0][0])
-    
-    def get_field(self, concept_id: str, field_name: str) -> Optional[KBNode]:
-        raise NotImplementedError()
+        return node
     
-    def build_hierarchy(self):
-        results, _ = db.cypher_query(
-            """MATCH (a:Concept) -[r:parent*]-> (b:Concept) RETURN a, b""")
+    @cached_read(fields_tags)
+    def get_fields(self, concept_id: str) -> dict[str, KBNode]:
+        """ All fields of the concept including inherited ones, in one
+        query over the parent chain, the nearest definition wins
+        """
+        results, _ = db.cypher_query(cypher.GET_FIELDS_QUERY, {
+            "node_id": int(concept_id),
+        })
 
-        parents = defaultdict(list)
-        children = defaultdict(list)
-        for child, parent in results:
-            parents[child['name']].append(parent['name'])
-            children[parent['name']].append(child['name'])
+        return decode_fields(results, self._to_node)
 
-        return parents, children
+    def get_concept_bundle(self, name: str, depth: int = KB_BUNDLE_DEPTH,
+                           should_raise: bool = True):
+        """
+        The LRD subgraph of the concept and of its ancestors up to `depth`
+        hops, read in one query, see ConceptBundle
+        """
+        from src.knowledge_base.bundle import ConceptBundle
 
-    def build_direct_hierarchy(self):
-        results, _ = db.cypher_query(
-            """MATCH (a:Concept) -[r:parent]-> (b:Concept) RETURN a, b""")
+        subgraph = self._concept_subgraph(name, depth)
+        if subgraph is None:
+            if should_raise:
+                raise KBNotFoundError(f"Concept '{name}' not found")
+            return None
 
-        parents = defaultdict(list)
-        children = defaultdict(list)
-        for child, parent in results:
-            parents[child['name']].append(parent['name'])
-            children[parent['name']].append(child['name'])
+        concept, index = subgraph
+        return ConceptBundle(concept, index, depth, self)
 
-        return parents, children
+    @cached_read(concept_subgraph_tags)
+    def _concept_subgraph(self, name: str, depth: int):
+        from src.knowledge_base.bundle import LRD_EDGE_TYPES, subgraph_from_rows
 
-    def upsert_concept(self, name: str, x: int = 100, y: int = 100):
-        concept = self.find_concept(name, should_raise=False)
-        if concept:
-            return concept
+        results, _ = db.cypher_query(cypher.concept_bundle_query(LRD_EDGE_TYPES, depth), {
+            "name": name,
+        })
+        return subgraph_from_rows(results, self._to_node)
+    
+    def bulk_upsert(self, nodes: Iterable[tuple[str, dict]] = (),
+                    edges: Iterable[tuple[str, Any, Any]] = (),
+                    chunk_size: int = 1000,
+                    progress: Optional[Callable[[str, int, int], None]] = None,
+                    ) -> dict[tuple[str, str], KBNode]:
+        """
+        Creates nodes and edges that don't exist yet, in chunks of 
+        `chunk_size` rows per transaction. Each chunk is logged in its
+        transaction, a failed import leaves the chunks before it logged.
         
-        return self.new_concept(name, x, y)
+        nodes are (label, data) pairs, they are identified by the
+        BULK_UPSERT_KEYS property, e.g. Concept by its name, and duplicates
+        are merged together. Data of nodes that already exist is not changed.
+        edges are (edge label, start, end), where start and end are
+        (label, key) pairs or just concept names.
+        
+        Returns {(label, key): node} of all given nodes
+        """
+        rows_by_label = defaultdict(dict)
+        for label, data in nodes:
+            key = data[BULK_UPSERT_KEYS[label]]
+            props = rows_by_label[label].setdefault(key, {})
+            props.update(data)
 
-    def new_concept(self, name: str, x: int = 100, y: int = 100):
-        return self.new_node("Concept", {
-            "name": name,
-            "_meta": json.dumps({
-                "x": x,
-                "y": y,
-            })
-        })
\ No newline at end of file
+        rows_by_shape = defaultdict(dict)
+        for edge_label, start, end, *data in edges:
+            start_label, start_key = ("Concept", start) if isinstance(start, str) else start
+            end_label, end_key = ("Concept", end) if isinstance(end, str) else end
+            shape = (start_label, end_label, edge_label)
+            rows_by_shape[shape][(start_key, end_key)] = data[0] if data else {}
+
+        result = {}
+
+        for label, rows in rows_by_label.items():
+            query = cypher.bulk_merge_nodes_query(label, BULK_UPSERT_KEYS[label])
+            rows = [{"key": key, "props": props} for key, props in rows.items()]
+            for chunk_start in range(0, len(rows), chunk_size):
+                tags = [label_tag(label)]
+                with db.transaction:
+                    results, _ = db.cypher_query(query, {
+                        "rows": rows[chunk_start: chunk_start + chunk_size],
+                    })
+                    for key, node in results:
+                        result[(label, key)] = self._to_node(node)
+                        tags.append(node_tag(node.element_id))
+                    seq = self._record_change(tags)
+                self._apply_change(tags, seq=seq)
+                self._applied_own_change(seq)
+                if progress is not None:
+                    progress(label, min(chunk_start + chunk_size, len(rows)), len(rows))
+
+        for (start_label, end_label, edge_label), rows in rows_by_shape.items():
+            query = cypher.bulk_merge_edges_query(
+                start_label, BULK_UPSERT_KEYS[start_label],
+                end_label, BULK_UPSERT_KEYS[end_label],
+                edge_label,
+            )
+            rows = [
+                {"start": start_key, "end": end_key, "props": props}
+                for (start_key, end_key), props in rows.items()
+            ]
+            for chunk_start in range(0, len(rows), chunk_size):
+                tags = [edge_tag(edge_label)]
+                added = []
+                with db.transaction:
+                    results, _ = db.cypher_query(query, {
+                        "rows": rows[chunk_start: chunk_start + chunk_size],
+                    })
+                    for start_key, end_key, start_id, end_id in results:
+                        tags.extend((node_tag(start_id), node_tag(end_id)))
+                        if (start_label, end_label, edge_label) == ("Concept", "Concept", KBEdgeType.PARENT.value):
+                            added.append((start_key, end_key))
+                    seq = self._record_change(tags, added)
+                self._apply_change(tags, added, seq=seq)
+                self._applied_own_change(seq)
+                if progress is not None:
+                    progress(edge_label, min(chunk_start + chunk_size, len(rows)), len(rows))
+
+        return result
+
+    def flush_unit_of_work(self, uow) -> dict:
+        """
+        Writes a unit of work in one transaction, with one UNWIND query
+        per node label and per edge shape, temporary ids are resolved
+        from the results of the node queries
+        """
+        from src.knowledge_base.unit_of_work import TempId
+
+        created = defaultdict(list)
+        merged = defaultdict(list)
+        for node in uow.nodes:
+            if node.merge_key is None:
+                created[node.label].append(node)
+            else:
+                merged[(node.label, node.merge_key)].append(node)
+
+        resolved = {}
+        updated = {}
+        added = []
+
+        def real_id(node_id):
+            return int(resolved[node_id].id if isinstance(node_id, TempId) else node_id)
+
+        with db.transaction:
+            for label, nodes in created.items():
+                results, _ = db.cypher_query(cypher.create_nodes_query(label), {
+                    "rows": [{"ref": node.temp_id.number, "props": node.data} for node in nodes],
+                })
+                for ref, raw_node in results:
+                    resolved[TempId(ref)] = self._to_node(raw_node)
+
+            for (label, key), nodes in merged.items():
+                temp_ids = {node.data[key]: node.temp_id for node in nodes}
+                results, _ = db.cypher_query(cypher.bulk_merge_nodes_query(label, key), {
+                    "rows": [{"key": node.data[key], "props": node.data} for node in nodes],
+                })
+                for value, raw_node in results:
+                    resolved[temp_ids[value]] = self._to_node(raw_node)
+
+            if uow.updates:
+                results, _ = db.cypher_query(cypher.UPDATE_NODES_MANY_QUERY, {
+                    "rows": [
+                        {"node_id": real_id(node_id), "props": data}
+                        for node_id, data in uow.updates.items()
+                    ],
+                })
+                updated = {node_id: self._to_node(raw_node) for node_id, raw_node in results}
+                for node_id in uow.updates:
+                    if isinstance(node_id, TempId):
+                        resolved[node_id] = updated[real_id(node_id)]
+
+            edges = defaultdict(list)
+            for edge in uow.edges:
+                keys = cypher.filter_keys(edge.data) if edge.merge else ()
+                edges[(edge.label, edge.merge, keys)].append({
+                    "start_id": real_id(edge.start_id),
+                    "end_id": real_id(edge.end_id),
+                    "props": edge.data,
+                })
+            for (label, merge, keys), rows in edges.items():
+                if merge:
+                    query = cypher.merge_edges_query(label, keys)
+                else:
+                    query = cypher.create_edges_query(label)
+                results, _ = db.cypher_query(query, {
+                    "rows": rows,
+                })
+                added.extend(parent_edges(label, results, start=0))
+
+            tags = [
+                *(label_tag(node.label) for node in uow.nodes),
+                *(node_tag(real_id(node.temp_id)) for node in uow.nodes),
+                *(node_tag(real_id(node_id)) for node_id in uow.updates),
+                *(label_tag(node.label) for node in updated.values()),
+                *(node_tag(real_id(edge.start_id)) for edge in uow.edges),
+                *(node_tag(real_id(edge.end_id)) for edge in uow.edges),
+                *(edge_tag(edge.label) for edge in uow.edges if edge.label != KBEdgeType.PARENT.value),
+            ]
+            if any("name" in data for data in uow.updates.values()):
+                tags.append(edge_tag(KBEdgeType.PARENT.value))
+            seq = self._record_change(tags, added)
+
+        self._apply_change(tags, added, seq=seq)
+        self._applied_own_change(seq)
+
+        return resolved
+
+    def build_hierarchy(self):
+        """
+        All ancestors and descendants of the concepts, the closure is
+        computed here from the direct edges, asking Neo4j for all
+        parent* paths is exponential on diamond shaped hierarchies
+        """
+        direct_parents, _ = self.build_direct_hierarchy()
+        return closure_hierarchy(direct_parents)
+
+    def build_direct_hierarchy(self):
+        # the rows are cached rather than the dicts, the hierarchy
+        # changes the dicts it gets when edges are added later
+        key = ('build_direct_hierarchy', )
+        found, results = self.cache.get(key)
+        if not found:
+            results, _ = db.cypher_query(cypher.DIRECT_HIERARCHY_QUERY)
+            results = [tuple(row) for row in results]
+            self.cache.set(key, results, [edge_tag(KBEdgeType.PARENT.value)])
+
+        return decode_direct_hierarchy(results)
+
+    @cached_read(lambda args, result: [edge_tag(KBEdgeType.PARENT.value)])
+    def get_ancestor_names(self, name: str) -> tuple[str, ...]:
+        """ Ancestors of one concept, nearest first, without loading the hierarchy """
+        results, _ = db.cypher_query(cypher.ANCESTOR_NAMES_QUERY, {"name": name})
+        return tuple(row[0] for row in results)
+
+    @cached_read(lambda args, result: [edge_tag(KBEdgeType.PARENT.value)])
+    def get_descendant_names(self, name: str) -> tuple[str, ...]:
+        """ Descendants of one concept, nearest first, without loading the hierarchy """
+        results, _ = db.cypher_query(cypher.DESCENDANT_NAMES_QUERY, {"name": name})
+        return tuple(row[0] for row in results)
@@ -37,10 +37,9 @@ def reverse_specialise(instance: Instance, kb: KnowledgeBase):
         except KBNotFoundError:
             continue
         
-        field = kb.out_one(
-            concept.id, KBEdgeType.FIELD_NODE,
-            node_filters=(("name", out_field.name),)
-        )
+        field = kb.get_field(concept.id, out_field.name)
+        if field is None:
+            raise KBNotFoundError(f"{out_instance.concept_name} has no field {out_field.name}")
         field_concept = kb.out_one(field.id, KBEdgeType.FIELD_CONCEPT)
 
         if field_concept.data['name'] == instance.concept_name:
@@ -0,0 +1,38 @@
+"""
+Creates the uniqueness constraints of the KB, ensure_schema() of
+src.knowledge_base.module, as a one-off command after setting up a database or adding a key to
+KB_UNIQUE_KEYS. Agents only do it at startup when KB_ENSURE_SCHEMA=1,
+the shared cache refresher creates the ones of the change log.
+
+    python -m src.knowledge_base.schema [--check]
+"""
+import argparse
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Creates the uniqueness constraints of the KB")
+    parser.add_argument("--check", action="store_true", help="only list the missing constraints")
+    args = parser.parse_args()
+
+    # only the database is needed, not a KnowledgeBase and its caches
+    from src.knowledge_base.module import KBIntegrityError, check_schema, ensure_schema
+
+    if args.check:
+        missing = check_schema()
+        for label, key in missing:
+            print(f"missing: {label}.{key}")
+        sys.exit(1 if missing else 0)
+
+    try:
+        created = ensure_schema()
+    except KBIntegrityError as error:
+        print(error)
+        sys.exit(1)
+
+    for label, key in created:
+        print(f"created: {label}.{key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Read-only KB cache shared by all the agent processes of a host.
+
+One refresher process (`python -m src.knowledge_base.shared_cache PATH`)
+writes the hierarchy closure and the neighbourhoods of the most connected
+concepts into a file whenever the KB version changes, and moves it over
+the old one with os.replace, so readers see either the old or the new
+file, never a half written one. Agents mmap the file read-only, the page
+cache holds one copy for all of them, and they look things up in place
+instead of building their own dicts. The refresher also prunes the KB
+change log every --prune-interval seconds, agents that fall further
+behind than --keep-changes changes drop their whole cache.
+
+Layout: header, then sections of uint32/uint64 arrays and byte blobs
+- names:     sorted concept names, index of a name is its position
+- parents:   for every name the sorted indices of its ancestors
+- children:  same for the descendants
+- entries:   sorted repr() of KBCache keys, pickled (value, tags)
+- tables:    open addressing hash tables (crc32) of the names and the keys
+
+Writes of the agent itself are not in the file until the refresher
+publishes a version that has them, until then the entries with the
+invalidated tags are hidden (see invalidate/advance).
+"""
+import argparse
+import bisect
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+from array import array
+from typing import Any, Hashable, Iterable, Optional
+
+from src.knowledge_base.cache import KBCache
+
+
+MAGIC = b'KBSHARE1'
+# magic, KB version, number of names, number of entries, section offsets
+HEADER = struct.Struct('<8sqII12Q')
+
+NAMES_INDEX, NAMES_BLOB, PARENTS_INDEX, PARENTS_DATA, CHILDREN_INDEX, \
+    CHILDREN_DATA, KEYS_INDEX, KEYS_BLOB, VALUES_INDEX, VALUES_BLOB, \
+    NAMES_TABLE, KEYS_TABLE = range(12)
+
+
+def _pack_blobs(blobs: list[bytes]) -> tuple[array, bytes]:
+    index = array('Q', [0])
+    for blob in blobs:
+        index.append(index[-1] + len(blob))
+    return index, b''.join(blobs)
+
+
+def _table_size(count: int) -> int:
+    """ Power of two with at most half of the slots used """
+    size = 1
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def _pack_table(blobs: list[bytes]) -> array:
+    """ slot -> position + 1 of the blob, 0 is an empty slot """
+    table = array('I', bytes(4 * _table_size(len(blobs))))
+    mask = len(table) - 1
+    for position, blob in enumerate(blobs):
+        slot = zlib.crc32(blob) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = position + 1
+    return table
+
+
+def _pack_lists(lists: list[list[int]]) -> tuple[array, array]:
+    index = array('Q', [0])
+    data = array('I')
+    for items in lists:
+        data.extend(items)
+        index.append(len(data))
+    return index, data
+
+
+def write_shared_cache(path: str, version: int,
+                       parents: dict[str, list[str]],
+                       children: dict[str, list[str]],
+                       entries: Iterable[tuple[Hashable, Any, frozenset]] = ()):
+    """ Writes the file next to path and atomically replaces path with it
+
+    parents and children are closures without the concept itself, as
+    returned by closure_hierarchy. entries are (key, value, tags) of
+    KBCache, the ones that can't be pickled are skipped.
+    """
+    names = sorted({*parents, *children})
+    positions = {name: position for position, name in enumerate(names)}
+
+    encoded_names = [name.encode() for name in names]
+    names_index, names_blob = _pack_blobs(encoded_names)
+    # sorted, so membership is a binary search, and names come out sorted too
+    parents_index, parents_data = _pack_lists([
+        sorted(positions[parent] for parent in parents.get(name, ())) for name in names])
+    children_index, children_data = _pack_lists([
+        sorted(positions[child] for child in children.get(name, ())) for name in names])
+
+    packed = {}
+    for key, value, tags in entries:
+        try:
+            packed[repr(key).encode()] = pickle.dumps((value, frozenset(tags)))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            continue
+    keys = sorted(packed)
+    keys_index, keys_blob = _pack_blobs(keys)
+    values_index, values_blob = _pack_blobs([packed[key] for key in keys])
+
+    sections = [
+        names_index.tobytes(), names_blob,
+        parents_index.tobytes(), parents_data.tobytes(),
+        children_index.tobytes(), children_data.tobytes(),
+        keys_index.tobytes(), keys_blob,
+        values_index.tobytes(), values_blob,
+        _pack_table(encoded_names).tobytes(), _pack_table(keys).tobytes(),
+    ]
+
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        # arrays are read with memoryview.cast, which wants them aligned
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version, len(names), len(keys), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class SharedKBCache:
+    """
+    Reader of the shared file. It's used as the store of a KBCache
+    (get/set/invalidate/clear/advance like KBDiskCache, but set does
+    nothing) and by SharedKBHierarchy for the closure.
+
+    Whether a new file was published is checked at most every
+    `check_interval` seconds, `generation` changes with every file.
+    """
+    def __init__(self, path: str, check_interval: float = 1.0, names_cache_size: int = 4096):
+        self.path = path
+        self.check_interval = check_interval
+        self.generation = 0
+        self.version: Optional[int] = None
+        # tags invalidated by this process since the file was written
+        self.hidden_tags: set = set()
+        self.hide_all = False
+        # version of the last write of this process that the file doesn't have yet
+        self.pending_version: Optional[int] = None
+        self._names = KBCache(maxsize=names_cache_size)
+        self._file = None
+        self._mmap = None
+        self._views = []
+        self._checked_at = 0.0
+        self._stat = None
+        self.refresh()
+
+    @property
+    def attached(self) -> bool:
+        return self._mmap is not None
+
+    def refresh(self) -> bool:
+        """ Attaches the latest published file, returns if it changed """
+        self._checked_at = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+
+        if self._stat is not None and \
+                (stat.st_ino, stat.st_mtime_ns) == (self._stat.st_ino, self._stat.st_mtime_ns):
+            return False
+
+        self._detach()
+        self._file = open(self.path, 'rb')
+        self._stat = os.fstat(self._file.fileno())
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(self._mmap)
+        magic, self.version, self._names_count, self._entries_count, *offsets = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"Not a shared KB cache file: {self.path}")
+
+        counts = {
+            NAMES_INDEX: self._names_count + 1,
+            PARENTS_INDEX: self._names_count + 1,
+            CHILDREN_INDEX: self._names_count + 1,
+            KEYS_INDEX: self._entries_count + 1,
+            VALUES_INDEX: self._entries_count + 1,
+        }
+        tables = {
+            NAMES_TABLE: _table_size(self._names_count),
+            KEYS_TABLE: _table_size(self._entries_count),
+        }
+        views = []
+        for section, offset in enumerate(offsets):
+            if section in counts:
+                views.append(buffer[offset: offset + counts[section] * 8].cast('Q'))
+            elif section in tables:
+                views.append(buffer[offset: offset + tables[section] * 4].cast('I'))
+            else:
+                views.append(buffer[offset:])
+        # data of the lists is as long as the last index says
+        views[PARENTS_DATA] = views[PARENTS_DATA][:views[PARENTS_INDEX][-1] * 4].cast('I')
+        views[CHILDREN_DATA] = views[CHILDREN_DATA][:views[CHILDREN_INDEX][-1] * 4].cast('I')
+        self._views = [buffer, *views]
+
+        self.generation += 1
+        self._names.clear()
+        if self.pending_version is None or self.version >= self.pending_version:
+            self.hidden_tags.clear()
+            self.hide_all = False
+            self.pending_version = None
+        return True
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+
+    def _detach(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = self._file = None
+
+    def close(self):
+        self._detach()
+        self._stat = None
+
+    def _view(self, section: int) -> memoryview:
+        return self._views[section + 1]
+
+    def _blob(self, index: int, section: int) -> bytes:
+        offsets = self._view(section)
+        return self._view(section + 1)[offsets[index]: offsets[index + 1]].tobytes()
+
+    def _find(self, value: bytes, section: int, table_section: int) -> int:
+        """ Position of the value in the blobs of the section or -1 """
+        table = self._view(table_section)
+        offsets = self._view(section)
+        blob = self._view(section + 1)
+        mask = len(table) - 1
+        slot = zlib.crc32(value) & mask
+        while True:
+            position = table[slot]
+            if not position:
+                return -1
+            if blob[offsets[position - 1]: offsets[position]] == value:
+                return position - 1
+            slot = (slot + 1) & mask
+
+    def _name_position(self, name: str) -> int:
+        if not self.attached:
+            return -1
+        return self._find(name.encode(), NAMES_INDEX, NAMES_TABLE)
+
+    def _related(self, name: str, section: int) -> tuple[str, ...]:
+        key = (section, name)
+        found, result = self._names.get(key)
+        if found:
+            return result
+
+        position = self._name_position(name)
+        if position < 0:
+            result = ()
+        else:
+            offsets = self._view(section)
+            data = self._view(section + 1)
+            result = tuple(
+                self._blob(other, NAMES_INDEX).decode()
+                for other in data[offsets[position]: offsets[position + 1]]
+            )
+        self._names.set(key, result)
+        return result
+
+    def ancestors(self, name: str) -> tuple[str, ...]:
+        self.maybe_refresh()
+        return self._related(name, PARENTS_INDEX)
+
+    def descendants(self, name: str) -> tuple[str, ...]:
+        self.maybe_refresh()
+        return self._related(name, CHILDREN_INDEX)
+
+    def is_ancestor(self, name: str, ancestor: str) -> bool:
+        self.maybe_refresh()
+        position = self._name_position(name)
+        if position < 0:
+            return False
+        ancestor_position = self._name_position(ancestor)
+        if ancestor_position < 0:
+            return False
+        offsets = self._view(PARENTS_INDEX)
+        data = self._view(PARENTS_DATA)
+        end = offsets[position + 1]
+        found = bisect.bisect_left(data, ancestor_position, offsets[position], end)
+        return found < end and data[found] == ancestor_position
+
+    def get(self, key: Hashable) -> tuple[bool, Any, frozenset]:
+        self.maybe_refresh()
+        if not self.attached or self.hide_all:
+            return False, None, frozenset()
+
+        position = self._find(repr(key).encode(), KEYS_INDEX, KEYS_TABLE)
+        if position < 0:
+            return False, None, frozenset()
+
+        value, tags = pickle.loads(self._blob(position, VALUES_INDEX))
+        if not self.hidden_tags.isdisjoint(tags):
+            return False, None, frozenset()
+        return True, value, tags
+
+    def set(self, key: Hashable, value, tags: Iterable[Hashable] = ()):
+        """ Only the refresher writes the file """
+
+    def invalidate(self, *tags: Hashable) -> int:
+        self.hidden_tags.update(tags)
+        return 0
+
+    def clear(self):
+        self.hide_all = True
+
+    def advance(self, version: int):
+        """ This process wrote, the hidden entries stay hidden until a
+        file with at least this version is published
+        """
+        self.pending_version = version
+
+
+def publish(kb, path: str, version: int, hot_concepts: int = 1000):
+    """ Writes the hierarchy and the out() neighbourhoods of the most
+    connected concepts of kb to path, kb is a KnowledgeBase that is only
+    used by the refresher
+    """
+    from src.knowledge_base.hierarchy import closure_hierarchy
+    from src.knowledge_base.module import KBEdgeDirection, KBEdgeType
+
+    kb.cache.clear()
+    kb.hierarchy.prefetch()
+    parents, children = closure_hierarchy(kb.hierarchy.direct_parents)
+
+    node_ids = [node.id for node in kb.get_hot_concepts(hot_concepts)]
+    for edge_type in KBEdgeType:
+        for direction in (KBEdgeDirection.OUT, KBEdgeDirection.IN):
+            kb.out_many(node_ids, edge_type, direction=direction)
+
+    write_shared_cache(path, version, parents, children, kb.cache.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publishes the shared KB cache for the agents of this host")
+    parser.add_argument("path")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between KB version checks")
+    parser.add_argument("--hot-concepts", type=int, default=1000)
+    parser.add_argument("--keep-changes", type=int, default=10000,
+                        help="changes left in the KB change log when it is pruned")
+    parser.add_argument("--prune-interval", type=float, default=600.0,
+                        help="seconds between prunings of the change log, 0 to not prune")
+    args = parser.parse_args()
+
+    from src.knowledge_base.module import KB_CHANGE_LOG_KEYS, KnowledgeBase
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+    # polls and prunings of the change log look changes up by seq
+    for label, key in kb.ensure_schema(KB_CHANGE_LOG_KEYS):
+        print(f"created constraint on {label}.{key}")
+
+    published = None
+    pruned_at = time.monotonic()
+    while True:
+        version = kb.get_version()
+        if version != published:
+            publish(kb, args.path, version, args.hot_concepts)
+            published = version
+            print(f"published KB version {version} to {args.path}")
+        if args.prune_interval and time.monotonic() - pruned_at >= args.prune_interval:
+            kb.prune_changes(args.keep_changes)
+            pruned_at = time.monotonic()
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
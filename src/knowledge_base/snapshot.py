@@ -0,0 +1,287 @@
+"""
+Snapshot mode of the KnowledgeBase.
+
+The whole Neo4j graph is pulled into a GraphIndex at startup with two
+bulk queries, after that all the reads are answered from memory.
+Writes still go to Neo4j and are applied to the local replica as well,
+so the replica stays in sync with what this process writes.
+Changes made by other processes are applied by poll_changes(): the nodes
+that a change of the log names are read again with all their edges. When
+the log was pruned past changes that weren't applied, the whole graph is
+loaded again with reload_snapshot().
+"""
+from typing import Any, Iterable, Optional
+
+from neomodel import db
+
+from src.knowledge_base.graph_index import GraphIndex
+from src.knowledge_base.module import (
+    BULK_UPSERT_KEYS,
+    BaseKnowledgeBase,
+    KBEdge,
+    KBEdgeDirection,
+    KBEdgeType,
+    KBNode,
+    KBNodeType,
+    KnowledgeBase,
+)
+from src.knowledge_base.unit_of_work import TempId
+
+
+# the change log and the version stamp are not part of the graph
+SNAPSHOT_NODES_QUERY = "MATCH (a) WHERE NOT a:KBChange AND NOT a:KBMeta RETURN a"
+SNAPSHOT_EDGES_QUERY = "MATCH ()-[r]->() RETURN r"
+SNAPSHOT_NODES_BY_ID_QUERY = (
+    "MATCH (a) WHERE id(a) IN $node_ids "
+    "OPTIONAL MATCH (a)-[r]-(b) RETURN a, collect([r, b])"
+)
+
+
+class SnapshotKnowledgeBase(KnowledgeBase):
+    def __init__(self, core, **kwargs):
+        self.index = GraphIndex()
+        super().__init__(core, **kwargs)
+        # the version was read by then, writes that come in while the graph
+        # is read are after it in the change log and are polled again
+        self.load_snapshot()
+        self.hierarchy.prefetch()
+
+    def load_snapshot(self):
+        index = GraphIndex()
+
+        nodes, _ = db.cypher_query(SNAPSHOT_NODES_QUERY)
+        for row in nodes:
+            index.add_node(KBNode.create(row[0]))
+
+        edges, _ = db.cypher_query(SNAPSHOT_EDGES_QUERY)
+        for row in edges:
+            edge = row[0]
+            index.add_edge(
+                edge.start_node.element_id,
+                edge.end_node.element_id,
+                edge.type,
+                dict(edge),
+            )
+
+        self.index = index
+
+    def reload_snapshot(self):
+        self.load_snapshot()
+        self.cache.clear()
+        self.hierarchy.prefetch()
+
+    def reload_nodes(self, node_ids: Iterable[str]):
+        """ Replaces the nodes and all their edges with what Neo4j has now """
+        node_ids = set(node_ids)
+        if not node_ids:
+            return
+        results, _ = db.cypher_query(SNAPSHOT_NODES_BY_ID_QUERY, {
+            "node_ids": [int(node_id) for node_id in node_ids],
+        })
+
+        for node_id in node_ids:
+            self.index.remove_node_edges(node_id)
+
+        # edges between two of the nodes are read twice
+        edges = {}
+        for raw_node, neighbours in results:
+            self.index.add_node(KBNode.create(raw_node))
+            for edge, other in neighbours:
+                if edge is None:
+                    continue
+                if other.element_id not in self.index:
+                    self.index.add_node(KBNode.create(other))
+                edges[edge.element_id] = edge
+
+        for edge in edges.values():
+            self.index.add_edge(
+                edge.start_node.element_id,
+                edge.end_node.element_id,
+                edge.type,
+                dict(edge),
+            )
+
+    def _apply_change(self, tags: Iterable[tuple[str, str]],
+                      added: Iterable[tuple[str, str]] = (),
+                      removed: Iterable[tuple[str, str]] = (),
+                      seq: Optional[int] = None, own: bool = True):
+        # own writes are mirrored into the index by the write methods, the
+        # index is updated first as the hierarchy is built from it
+        if not own:
+            self.reload_nodes(node_id for kind, node_id in tags if kind == 'node')
+        super()._apply_change(tags, added, removed, seq, own)
+
+    def _missed_changes(self):
+        self.reload_snapshot()
+
+    def out(self, node_id: int, edge_type: KBEdgeType,
+            edge_filters: tuple = None, node_filters: tuple = None,
+            direction: KBEdgeDirection = KBEdgeDirection.OUT,
+            direct=True) -> list[KBNode]:
+        return self.index.out(
+            str(node_id), edge_type.value,
+            edge_filters=edge_filters,
+            node_filters=node_filters,
+            direction=direction,
+        )
+
+    def out_many(self, node_ids: list[int], edge_type: KBEdgeType,
+                 edge_filters: tuple = None, node_filters: tuple = None,
+                 direction: KBEdgeDirection = KBEdgeDirection.OUT) -> dict[int, list[KBNode]]:
+        return {
+            node_id: self.out(node_id, edge_type, edge_filters, node_filters, direction)
+            for node_id in node_ids
+        }
+
+    def out_dict(self, node_id: int, edge_type: KBEdgeType,
+                 edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                 direct=True) -> dict[str, KBNode]:
+        return {
+            edge['name']: node
+            for edge, node in self.index.out_edges(str(node_id), edge_type.value, direction)
+        }
+
+    def out_dict2(self, node_id: int, edge_type: KBEdgeType,
+                  edge_filters: tuple = None, key: str = 'name', direction: KBEdgeDirection = KBEdgeDirection.OUT,
+                  direct=True) -> dict[str, KBNode]:
+        return {
+            node.data['name']: node
+            for node in self.index.out(str(node_id), edge_type.value, direction=direction)
+        }
+
+    def find_nodes(self, node_type: KBNodeType, filters: tuple) -> list[KBNode]:
+        return self.index.find_nodes(node_type.value, filters)
+
+    def find_concepts_many(self, cids: list[str]) -> dict[str, Optional[KBNode]]:
+        return BaseKnowledgeBase.find_concepts_many(self, cids)
+
+    def get_node(self, node_id: int) -> KBNode:
+        node = self.index.get_node(str(node_id))
+        if node is None:
+            node = super().get_node(node_id)
+            self.index.add_node(node)
+        return node
+
+    def get_outcomes(self, node_id):
+        return [
+            (concept, outcome)
+            for outcome in self.index.out(str(node_id), 'act', direction=KBEdgeDirection.IN)
+            if outcome.label == 'Outcome'
+            for concept in self.index.out(outcome.id, 'outcome', direction=KBEdgeDirection.IN)
+            if concept.label == KBNodeType.CONCEPT.value
+        ]
+
+    def get_word(self, word: str):
+        nodes = self.index.find_nodes('Word', (('value', word), ))
+        if not nodes:
+            return None
+        return nodes[0]
+
+    def get_fields(self, concept_id: str) -> dict[str, KBNode]:
+        fields = {}
+        for ancestor_id in self.index.iterate_up(str(concept_id), KBEdgeType.PARENT.value):
+            for field in self.index.out(ancestor_id, KBEdgeType.FIELD_NODE.value):
+                fields.setdefault(field.data['name'], field)
+        return fields
+
+    def get_field(self, concept_id: str, field_name: str) -> Optional[KBNode]:
+        """ Field of the concept or of the nearest parent that has it """
+        for ancestor_id in self.index.iterate_up(str(concept_id), KBEdgeType.PARENT.value):
+            fields = self.index.out(
+                ancestor_id, KBEdgeType.FIELD_NODE.value,
+                node_filters=(('name', field_name), ),
+            )
+            if fields:
+                return fields[0]
+        return None
+
+    def build_hierarchy(self):
+        return self.index.build_hierarchy(
+            KBEdgeType.PARENT.value, KBNodeType.CONCEPT.value)
+
+    def build_direct_hierarchy(self):
+        return self.index.build_hierarchy(
+            KBEdgeType.PARENT.value, KBNodeType.CONCEPT.value, direct=True)
+
+    def new_node(self, label: str, data: dict) -> KBNode:
+        node = super().new_node(label, data)
+        self.index.add_node(node)
+        return node
+
+    def new_edge(self, label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        edge = super().new_edge(label, start_node_id, end_node_id, data)
+        self.index.add_edge(str(start_node_id), str(end_node_id), label, data)
+        return edge
+
+    def upsert_edge(self, edge_label: str, start_node_id: int, end_node_id: int, data: dict) -> KBEdge:
+        edge = super().upsert_edge(edge_label, start_node_id, end_node_id, data)
+        if not self.index.has_edge(str(start_node_id), str(end_node_id), edge_label, data):
+            self.index.add_edge(str(start_node_id), str(end_node_id), edge_label, data)
+        return edge
+
+    def delete_edge(self, label: str, start_node_id: int, end_node_id: int) -> int:
+        removed = super().delete_edge(label, start_node_id, end_node_id)
+        self.index.remove_edge(str(start_node_id), str(end_node_id), label)
+        return removed
+
+    def update_node_data(self, node_id: int, data: dict):
+        node = super().update_node_data(node_id, data)
+        self.index.update_node(node)
+        return node
+
+    def bulk_upsert(self, nodes: Iterable[tuple[str, dict]] = (),
+                    edges: Iterable[tuple[str, Any, Any]] = (),
+                    **kwargs) -> dict[tuple[str, str], KBNode]:
+        edges = list(edges)
+        result = super().bulk_upsert(nodes, edges, **kwargs)
+
+        for node in result.values():
+            self.index.add_node(node)
+
+        def find(node):
+            label, key = ("Concept", node) if isinstance(node, str) else node
+            if (label, key) in result:
+                return result[(label, key)]
+            found = self.index.find_nodes(label, ((BULK_UPSERT_KEYS[label], key), ))
+            return found[0] if found else None
+
+        # same as the MERGE of the query, an edge is only added
+        # if the nodes have no edge of that type yet
+        for edge_label, start, end, *data in edges:
+            start_node, end_node = find(start), find(end)
+            if start_node is None or end_node is None:
+                continue
+            if any(
+                node.id == end_node.id
+                for _, node in self.index.out_edges(start_node.id, edge_label)
+            ):
+                continue
+            self.index.add_edge(start_node.id, end_node.id, edge_label, dict(data[0]) if data else {})
+
+        return result
+
+    def flush_unit_of_work(self, uow) -> dict:
+        resolved = super().flush_unit_of_work(uow)
+
+        def real_id(node_id):
+            return str(resolved[node_id].id if isinstance(node_id, TempId) else node_id)
+
+        for node in resolved.values():
+            self.index.add_node(node)
+
+        for node_id, data in uow.updates.items():
+            old_node = self.index.get_node(real_id(node_id))
+            if old_node is not None and not isinstance(node_id, TempId):
+                self.index.update_node(KBNode(
+                    id=old_node.id,
+                    label=old_node.label,
+                    data={**old_node.data, **data},
+                    metadata=old_node.metadata,
+                ))
+
+        for edge in uow.edges:
+            start_id, end_id = real_id(edge.start_id), real_id(edge.end_id)
+            if not edge.merge or not self.index.has_edge(start_id, end_id, edge.label, edge.data):
+                self.index.add_edge(start_id, end_id, edge.label, edge.data)
+
+        return resolved
@@ -0,0 +1,171 @@
+"""
+Unit of work for KB writes.
+
+Writes made through a UnitOfWork are only buffered until commit().
+Nodes created in it get temporary ids (TempId), which can be used as
+start and end of edges or in updates of the same unit, and are
+resolved to the real ids when the unit is flushed. KnowledgeBase writes
+the whole unit in one transaction with a few UNWIND queries, other
+knowledge bases replay it with their own write methods.
+
+    with kb.unit_of_work() as uow:
+        dog = uow.upsert_concept("Dog")
+        animal = uow.upsert_concept("Animal")
+        uow.upsert_edge("parent", dog.id, animal.id, {})
+    uow.resolve(dog.id)  # real id of the Dog node
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from src.knowledge_base.concept import Concept
+from src.knowledge_base.module import KBNode, KBNodeType
+
+
+@dataclass(frozen=True)
+class TempId:
+    number: int
+
+    def __str__(self):
+        return f"tmp:{self.number}"
+
+
+@dataclass
+class PendingNode:
+    temp_id: TempId
+    label: str
+    data: dict
+    # nodes with a merge key are matched by that property
+    # and only created when there is no such node yet
+    merge_key: Optional[str] = None
+
+
+@dataclass
+class PendingEdge:
+    label: str
+    start_id: Any
+    end_id: Any
+    data: dict = field(default_factory=dict)
+    merge: bool = False
+
+
+class UnitOfWorkError(Exception):
+    pass
+
+
+class UnitOfWork:
+    def __init__(self, kb):
+        self.kb = kb
+        self.nodes: list[PendingNode] = []
+        # node id (real or temporary) -> properties to set
+        self.updates: dict[Any, dict] = {}
+        self.edges: list[PendingEdge] = []
+        # temporary id -> node written to the KB, filled by commit()
+        self.resolved: dict[TempId, KBNode] = {}
+        self.closed = False
+        self._merged: dict[tuple[str, Any], PendingNode] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.closed:
+            return False
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def __len__(self):
+        return len(self.nodes) + len(self.updates) + len(self.edges)
+
+    def new_node(self, label: str, data: dict) -> KBNode:
+        self._check_open()
+        node = PendingNode(TempId(len(self.nodes)), label, dict(data))
+        self.nodes.append(node)
+        return self._node(node)
+
+    def merge_node(self, node_type: KBNodeType, key: str, data: dict) -> KBNode:
+        """ Node of the type with the same `key` property as in data,
+        it's created with the data if there is no such node
+        """
+        self._check_open()
+        try:
+            node = self._merged[(node_type.value, data[key])]
+        except KeyError:
+            node = PendingNode(TempId(len(self.nodes)), node_type.value, dict(data), merge_key=key)
+            self.nodes.append(node)
+            self._merged[(node_type.value, data[key])] = node
+        return self._node(node)
+
+    def new_concept(self, name: str, x: int = 100, y: int = 100) -> KBNode:
+        return self.new_node(KBNodeType.CONCEPT.value, self._concept_data(name, x, y))
+
+    def upsert_concept(self, cid: str, x: int = 100, y: int = 100) -> KBNode:
+        return self.merge_node(KBNodeType.CONCEPT, "name", self._concept_data(cid, x, y))
+
+    def update_node_data(self, node_id, data: dict):
+        self._check_open()
+        if isinstance(node_id, TempId):
+            node = self.nodes[node_id.number]
+            if node.merge_key is None:
+                node.data.update(data)
+                return
+        self.updates.setdefault(node_id, {}).update(data)
+
+    def new_edge(self, label: str, start_node_id, end_node_id, data: dict):
+        self._check_open()
+        self.edges.append(PendingEdge(label, start_node_id, end_node_id, dict(data or {})))
+
+    def upsert_edge(self, edge_label: str, start_node_id, end_node_id, data: dict):
+        self._check_open()
+        edge = PendingEdge(edge_label, start_node_id, end_node_id, dict(data or {}), merge=True)
+        if edge not in self.edges:
+            self.edges.append(edge)
+
+    def commit(self) -> dict[TempId, KBNode]:
+        """ Writes everything to the KB, returns {temporary id: node} """
+        self._check_open()
+        self.closed = True
+        if len(self):
+            self.resolved = self.kb.flush_unit_of_work(self)
+        return self.resolved
+
+    def rollback(self):
+        """ Drops all buffered writes """
+        self._check_open()
+        self.closed = True
+        self.nodes.clear()
+        self.updates.clear()
+        self.edges.clear()
+        self._merged.clear()
+
+    def resolve(self, node_id):
+        """ Real id of a node, temporary ids are known after commit() """
+        if not isinstance(node_id, TempId):
+            return node_id
+        try:
+            return self.resolved[node_id].id
+        except KeyError:
+            raise UnitOfWorkError(f"Node {node_id} is not written yet") from None
+
+    def _check_open(self):
+        if self.closed:
+            raise UnitOfWorkError("Unit of work is already committed or rolled back")
+
+    @staticmethod
+    def _node(node: PendingNode) -> KBNode:
+        data = dict(node.data)
+        metadata = data.pop('_meta', {})
+        return KBNode(id=node.temp_id, label=node.label, data=data, metadata=metadata)
+
+    @staticmethod
+    def _concept_data(cid: str, x: int, y: int) -> dict:
+        return {
+            "name": Concept.get_name(cid),
+            "_meta": json.dumps({
+                "x": x,
+                "y": y,
+            }),
+        }
@@ -161,7 +161,7 @@ class UWMNode(UNode):
 
         reverse_fields = self.graph.knowledge_base.out(
             kb_field.id, KBEdgeType.FIELD_REVERSE,
-            direction=KBEdgeDirection.ANY)
+            direction=KBEdgeDirection.IN)
         
         if len(reverse_fields) < 1:
             return None
@@ -0,0 +1,119 @@
+import asyncio
+
+from src.knowledge_base.async_kb import AsyncKnowledgeBase
+from src.knowledge_base.cache import encode_tag, label_tag
+from src.knowledge_base.module import KBNodeType
+
+
+class RawNode(dict):
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def values(self):
+        return self.rows
+
+
+class FakeDriver:
+    """ Keeps the change log, and the queries of each transaction """
+    def __init__(self):
+        self.log = []
+        self.transactions = []
+        self.concept_reads = 0
+
+    def session(self):
+        return FakeSession(self)
+
+    def answer(self, query, params):
+        if "CREATE (c:KBChange" in query:
+            seq = len(self.log) + 1
+            self.log.append([seq, params["tags"], params["added"], params["removed"]])
+            return [[seq]]
+        if "c.seq > $seq" in query:
+            return [row for row in self.log if row[0] > params["seq"]]
+        if "KBMeta" in query:
+            return [[len(self.log)]] if self.log else []
+        if query.startswith("MATCH (a:Concept"):
+            self.concept_reads += 1
+            return [[RawNode("1", "Concept", {"name": "Dog"})]]
+        if query.startswith("CREATE"):
+            return [[RawNode("9", "Concept", params["props"])]]
+        return []
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query, params):
+        return FakeResult(self.driver.answer(query, params))
+
+    async def execute_write(self, work):
+        queries = []
+        self.driver.transactions.append(queries)
+        return await work(FakeTransaction(self.driver, queries))
+
+
+class FakeTransaction:
+    def __init__(self, driver, queries):
+        self.driver = driver
+        self.queries = queries
+
+    async def run(self, query, params):
+        self.queries.append(query)
+        return FakeResult(self.driver.answer(query, params))
+
+
+def test_writes_are_logged_in_their_transaction():
+    async def run():
+        kb = AsyncKnowledgeBase()
+        kb.driver = FakeDriver()
+        await kb.poll_changes()
+
+        await kb.find_concept("Dog")
+        await kb.new_concept("Cat")
+        # the write and its change log entry went in one transaction
+        [queries] = kb.driver.transactions
+        assert queries[0].startswith("CREATE") and "KBChange" in queries[1]
+        await kb.find_concept("Dog")
+        assert kb.driver.concept_reads == 2
+
+        # own writes aren't applied again, the writes of others are
+        assert await kb.poll_changes() == 0
+        await kb.find_concept("Dog")
+        kb.driver.log.append([2, [encode_tag(label_tag(KBNodeType.CONCEPT.value))], [], []])
+        assert await kb.poll_changes() == 1
+        await kb.find_concept("Dog")
+        assert kb.driver.concept_reads == 3
+
+    asyncio.run(run())
+
+
+def test_writes_before_the_first_poll_are_not_kept():
+    async def run():
+        kb = AsyncKnowledgeBase()
+        kb.driver = FakeDriver()
+        await kb.new_concept("Cat")
+
+        # the version read by the first poll already has the write
+        await kb.poll_changes()
+        assert kb.applied_seq == 1
+        assert kb.changes.own_changes == set()
+
+        await kb.new_concept("Cow")
+        assert kb.applied_seq == 2
+        assert kb.changes.own_changes == set()
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import pytest
+
+from src.knowledge_base.bundle import ConceptBundle
+from src.knowledge_base.graph_index import GraphIndex
+from src.knowledge_base.module import KBEdgeType, KBNode, KBNotFoundError
+
+
+class FallbackKB:
+    """ Records the reads that the bundle couldn't answer """
+    def __init__(self):
+        self.reads = []
+
+    def out(self, node_id, edge_type, *args):
+        self.reads.append((node_id, edge_type))
+        return []
+
+    def out_many(self, node_ids, edge_type, *args):
+        return {node_id: self.out(node_id, edge_type) for node_id in node_ids}
+
+    def get_fields(self, concept_id):
+        self.reads.append((concept_id, 'get_fields'))
+        return {}
+
+
+def make_bundle(depth):
+    index = GraphIndex()
+    for node_id, label, data in [
+        ("dog", "Concept", {"name": "Dog"}),
+        ("animal", "Concept", {"name": "Animal"}),
+        ("boolean", "Concept", {"name": "Boolean"}),
+        ("alive", "Field", {"name": "alive"}),
+        ("dog_alive", "Field", {"name": "alive"}),
+        ("getter", "Getter", {}),
+        ("condition", "Condition", {}),
+    ]:
+        index.add_node(KBNode(node_id, label, data))
+
+    index.add_edge("dog", "animal", "parent")
+    index.add_edge("animal", "alive", "fields")
+    index.add_edge("dog", "dog_alive", "fields")
+    index.add_edge("alive", "boolean", "concept")
+    index.add_edge("alive", "getter", "getter")
+    index.add_edge("getter", "condition", "logic")
+
+    kb = FallbackKB()
+    return ConceptBundle(index.nodes["dog"], index, depth, kb), kb
+
+
+def test_reads_within_depth_stay_in_memory():
+    bundle, kb = make_bundle(depth=3)
+
+    assert [node.id for node in bundle.out("animal", KBEdgeType.FIELD_NODE)] == ["alive"]
+    assert [node.id for node in bundle.in_("alive", KBEdgeType.FIELD_NODE)] == ["animal"]
+    assert bundle.out_one("getter", KBEdgeType.GETTER_LOGIC).id == "condition"
+    assert bundle.out_one("alive", KBEdgeType.FIELD_CONCEPT).id == "boolean"
+    assert bundle.find_concept("Animal").id == "animal"
+    assert kb.reads == []
+
+
+def test_reads_past_the_bundle_go_to_the_kb():
+    bundle, kb = make_bundle(depth=2)
+
+    # the getter is `depth` hops away, its own edges weren't read
+    with pytest.raises(KBNotFoundError):
+        bundle.out_one("getter", KBEdgeType.GETTER_LOGIC)
+    # other concepts are only held as ends of edges
+    bundle.out("boolean", KBEdgeType.FIELD_NODE)
+    # incoming edges of the concepts aren't read
+    bundle.in_("dog", KBEdgeType.PARENT)
+
+    assert kb.reads == [
+        ("getter", KBEdgeType.GETTER_LOGIC),
+        ("boolean", KBEdgeType.FIELD_NODE),
+        ("dog", KBEdgeType.PARENT),
+    ]
+
+
+def test_inherited_fields():
+    bundle, kb = make_bundle(depth=3)
+
+    assert bundle.get_field("dog", "alive").id == "dog_alive"
+    assert bundle.get_field("animal", "alive").id == "alive"
+    assert kb.reads == []
+
+
+def test_out_many_reads_only_the_missing_nodes():
+    bundle, kb = make_bundle(depth=2)
+
+    result = bundle.out_many(["alive", "getter"], KBEdgeType.GETTER_LOGIC)
+    assert result == {"alive": [], "getter": []}
+    assert kb.reads == [("getter", KBEdgeType.GETTER_LOGIC)]
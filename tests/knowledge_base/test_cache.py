@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import pytest
+
+from src.knowledge_base.cache import KBCache, cached_read, label_tag, node_tag
+
+
+@dataclass
+class Node:
+    id: int
+    
+
+class FakeKB:
+    def __init__(self):
+        self.cache = KBCache(maxsize=3)
+        self.calls = 0
+        
+    @cached_read(lambda args, result: [node_tag(args['node_id'])])
+    def out(self, node_id, edge_type='parent'):
+        self.calls += 1
+        return [Node(node_id + 100)]
+    
+    @cached_read(lambda args, result: [label_tag(args['label'])])
+    def find(self, label, name):
+        self.calls += 1
+        return []
+    
+    @cached_read(lambda args, result: [node_tag(args['node_id'])])
+    async def out_async(self, node_id, edge_type='parent'):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return [Node(node_id + 100)]
+
+
+def test_cached_read_binds_arguments():
+    kb = FakeKB()
+    kb.out(1)
+    kb.out(node_id=1, edge_type='parent')
+    
+    assert kb.calls == 1
+    assert kb.cache.stats.hits == 1
+    assert kb.cache.stats.misses == 1
+    
+    
+def test_invalidate_by_source_and_result_node():
+    kb = FakeKB()
+    kb.out(1)
+    kb.out(2)
+    
+    assert kb.cache.invalidate(node_tag(101)) == 1
+    kb.out(1)
+    kb.out(2)
+    
+    assert kb.calls == 3
+    
+    
+def test_negative_results_are_cached():
+    kb = FakeKB()
+    kb.find("Concept", "Unknown")
+    kb.find("Concept", "Unknown")
+    assert kb.calls == 1
+    
+    kb.cache.invalidate(label_tag("Concept"))
+    kb.find("Concept", "Unknown")
+    assert kb.calls == 2
+
+
+def test_lru_eviction():
+    kb = FakeKB()
+    for node_id in range(3):
+        kb.out(node_id)
+    kb.out(0)
+    kb.out(3)
+    
+    assert kb.cache.stats.evictions == 1
+    assert len(kb.cache) == 3
+    
+    kb.out(0)
+    assert kb.calls == 4
+    kb.out(1)
+    assert kb.calls == 5
+    
+    
+def test_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("src.knowledge_base.cache.time.monotonic", lambda: now[0])
+    
+    cache = KBCache(ttl=10)
+    cache.set("key", 1)
+    assert cache.get("key") == (True, 1)
+    
+    now[0] += 11
+    assert cache.get("key") == (False, None)
+    assert cache.stats.expirations == 1
+
+
+def test_cached_read_async():
+    kb = FakeKB()
+    
+    async def read_twice():
+        first = await kb.out_async(1)
+        second = await kb.out_async(node_id=1)
+        return first, second
+    
+    first, second = asyncio.run(read_twice())
+    
+    assert first is second
+    assert kb.calls == 1
+    
+    kb.cache.invalidate(node_tag(101))
+    asyncio.run(read_twice())
+    assert kb.calls == 2
+
+
+class SlowKB:
+    def __init__(self):
+        self.cache = KBCache()
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = False
+
+    @cached_read(lambda args, result: [node_tag(args['node_id'])])
+    def out(self, node_id):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            self.fail = False
+            raise ConnectionError("database is down")
+        return [Node(node_id + 100)]
+
+    @cached_read(lambda args, result: [node_tag(args['node_id'])])
+    async def out_async(self, node_id):
+        self.calls += 1
+        self.started.set()
+        await asyncio.sleep(0.05)
+        return [Node(node_id + 100)]
+
+
+def test_concurrent_reads_run_once():
+    kb = SlowKB()
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(kb.out, 1) for _ in range(8)]
+        kb.started.wait(5)
+        kb.release.set()
+        results = [future.result() for future in futures]
+
+    assert kb.calls == 1
+    assert all(result is results[0] for result in results)
+    assert not kb.cache.flights
+
+
+def test_waiters_retry_when_the_leader_fails():
+    kb = SlowKB()
+    kb.fail = True
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(kb.out, 1)
+        kb.started.wait(5)
+        waiter = pool.submit(kb.out, 1)
+        kb.release.set()
+
+        with pytest.raises(ConnectionError):
+            leader.result()
+        assert waiter.result() == [Node(101)]
+
+
+def test_result_is_not_stored_after_invalidation():
+    kb = SlowKB()
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(kb.out, 1)
+        kb.started.wait(5)
+        kb.cache.invalidate(node_tag(1))
+        kb.release.set()
+        future.result()
+
+    assert ('out', 1) not in kb.cache
+
+
+def test_concurrent_async_reads_run_once_and_survive_cancellation():
+    kb = SlowKB()
+
+    async def read():
+        leader = asyncio.create_task(kb.out_async(1))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(kb.out_async(1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        waiters[0].cancel()
+        return await leader, await asyncio.gather(*waiters[1:])
+
+    first, others = asyncio.run(read())
+
+    assert kb.calls == 1
+    assert all(result is first for result in others)
@@ -0,0 +1,172 @@
+import contextlib
+
+import pytest
+
+from src.knowledge_base import cypher, module
+from src.knowledge_base.cache import decode_tag, edge_tag, encode_tag, label_tag, node_tag
+from src.knowledge_base.module import (
+    KBEdgeType,
+    KBIntegrityError,
+    KnowledgeBase,
+    decode_parent_edges,
+    encode_parent_edges,
+    recorded_seq,
+)
+
+
+class RawNode(dict):
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+class FakeDb:
+    """ Answers the queries of the change log and of a few reads, shared by all KBs of a test """
+    def __init__(self):
+        self.transaction = contextlib.nullcontext()
+        self.log = []
+        self.parents = [["Dog", "Animal"]]
+        self.queries = []
+        self.names = {"2": "Animal"}
+
+    def cypher_query(self, query, params=None):
+        self.queries.append(query)
+        if "CREATE (c:KBChange" in query:
+            seq = len(self.log) + 1 if not self.log else self.log[-1][0] + 1
+            self.log.append([seq, params["tags"], params["added"], params["removed"]])
+            return [[seq]], None
+        if "c.seq > $seq" in query:
+            return [row for row in self.log if row[0] > params["seq"]], None
+        if "DELETE c" in query:
+            self.log = [row for row in self.log if row[0] > params["seq"]]
+            return [], None
+        if "KBMeta" in query:
+            return ([[self.log[-1][0]]] if self.log else []), None
+        if "SET a += $props" in query:
+            self.names[str(params["node_id"])] = params["props"]["name"]
+            return [[RawNode(str(params["node_id"]), "Concept", params["props"])]], None
+        if query.startswith("MATCH (a)-[r:parent]->(b") and "RETURN b" in query:
+            node = RawNode("2", "Concept", {"name": self.names["2"]})
+            if any(node[key] != value for key, value in params["node_filters"].items()):
+                return [], None
+            return [[node]], None
+        if "RETURN a.name, b.name" in query:
+            return list(self.parents), None
+        if query.startswith("MATCH (a:Concept"):
+            return [[RawNode("1", "Concept", {"name": "Dog"})]], None
+        if query.startswith("CREATE"):
+            return [[RawNode("9", "Concept", params["props"])]], None
+        if query.startswith("UNWIND $rows") and "MERGE (a:Concept" in query:
+            return [
+                [row["key"], RawNode(str(20 + number), "Concept", row["props"])]
+                for number, row in enumerate(params["rows"])
+            ], None
+        if "CREATE (a)-[r:parent" in query:
+            self.parents.append(["Cat", "Animal"])
+            return [[
+                RawNode("e", "parent", {}),
+                RawNode("9", "Concept", {"name": "Cat"}),
+                RawNode("2", "Concept", {"name": "Animal"}),
+            ]], None
+        return [], None
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # KnowledgeBase is an AgentModule, which needs the agent's main module
+    pytest.importorskip("main")
+    db = FakeDb()
+    monkeypatch.setattr(module, "KB_ENSURE_SCHEMA", False)
+    monkeypatch.setattr(module, "db", db)
+    return db
+
+
+def new_kb():
+    return KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+
+
+def test_encoding():
+    tags = [node_tag(12), label_tag("Concept"), edge_tag("parent")]
+    assert [decode_tag(encode_tag(tag)) for tag in tags] == tags
+    assert decode_parent_edges(encode_parent_edges([("Dog", "Animal")])) == [("Dog", "Animal")]
+
+
+def test_changes_of_other_processes_are_applied(fake_db):
+    writer = new_kb()
+    reader = new_kb()
+    reader.find_concept("Dog")
+    assert any(label_tag("Concept") in tags for _, _, tags in reader.cache.items())
+
+    writer.new_concept("Cat")
+    # own writes are applied when they are made
+    assert writer.poll_changes() == 0
+    assert writer.applied_seq == 1
+
+    assert reader.poll_changes() == 1
+    assert reader.applied_seq == 1
+    assert all(label_tag("Concept") not in tags for _, _, tags in reader.cache.items())
+
+    writer.new_edge("parent", 9, 2, {})
+    assert not reader.hierarchy.is_subconcept("Cat", "Animal")
+    queries = len(fake_db.queries)
+    assert reader.poll_changes() == 1
+    assert reader.hierarchy.is_subconcept("Cat", "Animal")
+    # the edge came from the log, the hierarchy wasn't queried again
+    assert len(fake_db.queries) == queries + 1
+
+
+def test_pruned_log_clears_the_cache(fake_db):
+    writer = new_kb()
+    reader = new_kb()
+
+    writer.new_concept("Cat")
+    writer.new_concept("Mouse")
+    writer.prune_changes(keep=1)
+
+    reader.find_concept("Dog")
+    assert reader.poll_changes() == 1
+    assert reader.applied_seq == 2
+    assert all(label_tag("Concept") not in tags for _, _, tags in reader.cache.items())
+
+
+def test_bulk_upsert_logs_each_chunk(fake_db):
+    kb = new_kb()
+    kb.bulk_upsert([("Concept", {"name": name}) for name in ("Cat", "Cow", "Owl")], chunk_size=2)
+
+    # each chunk was committed with its entry in the log
+    assert [row[0] for row in fake_db.log] == [1, 2]
+    assert [len(row[1]) for row in fake_db.log] == [3, 2]
+    assert kb.applied_seq == 2
+
+
+def test_step_prunes_the_log(fake_db):
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None,
+                       prune_interval=60, keep_changes=1)
+    kb.new_concept("Cat")
+    kb.new_concept("Mouse")
+    kb.step()
+    assert len(fake_db.log) == 2
+
+    kb._pruned_at -= 60
+    kb.step()
+    assert [row[0] for row in fake_db.log] == [2]
+
+
+def test_writes_without_the_version_node_fail():
+    # the node is made when a KB starts, writes only match it
+    assert cypher.INIT_VERSION_QUERY.startswith("MERGE (m:KBMeta")
+    assert cypher.RECORD_CHANGE_QUERY.startswith("MATCH (m:KBMeta")
+    with pytest.raises(KBIntegrityError):
+        recorded_seq([])
+
+
+def test_renamed_neighbours_are_read_again(fake_db):
+    kb = new_kb()
+    assert [node.data["name"] for node in kb.out(1, KBEdgeType.PARENT)] == ["Animal"]
+
+    assert kb.out(1, KBEdgeType.PARENT, node_filters=(("name", "Creature"), )) == []
+
+    kb.update_node_data(2, {"name": "Creature"})
+    assert [node.data["name"] for node in kb.out(1, KBEdgeType.PARENT)] == ["Creature"]
+    assert [node.id for node in kb.out(1, KBEdgeType.PARENT, node_filters=(("name", "Creature"), ))] == ["2"]
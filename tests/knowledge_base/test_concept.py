@@ -0,0 +1,122 @@
+import pickle
+
+import pytest
+
+from src.knowledge_base import concept as concept_module
+from src.knowledge_base.concept import CidSyntaxError, Concept, iter_cids, parse_cid
+
+
+def test_equal_concepts_are_shared():
+    first = Concept("Dog", {"color": Concept("Red"), "size": Concept("Big")})
+    second = Concept("Dog", {"size": Concept("Big"), "color": Concept("Red")})
+
+    assert first is second
+    assert first.fields["color"] is Concept("Red")
+    assert hash(first) == hash(second)
+
+
+def test_values_of_different_types_are_different_concepts():
+    concepts = [Concept("Led", {"on": value}) for value in (1, True, 1.0)]
+
+    assert len({id(concept) for concept in concepts}) == 3
+    assert concepts[0] != concepts[1]
+    assert [concept.get_cid() for concept in concepts] == ["Led{on=1}", "Led{on=True}", "Led{on=1.0}"]
+
+
+def test_unused_concepts_are_dropped():
+    concept = Concept("Dog", {"color": Concept("Purple")})
+    key = concept._key
+    del concept
+
+    assert key not in Concept._interned
+
+
+def test_from_cid():
+    concept = Concept.from_cid("Dog{size=Big,color=Red{tone=Dark}}")
+
+    assert concept.get_cid() == "Dog{color=Red{tone=Dark},size=Big}"
+    assert Concept.from_cid("Dog{size=Big,color=Red{tone=Dark}}") is concept
+    assert Concept.from_cid(concept.get_cid()) is concept
+    assert concept.fields["color"].fields["tone"] is Concept("Dark")
+
+
+def test_concepts_are_immutable():
+    concept = Concept("Dog", {"color": Concept("Red")})
+
+    with pytest.raises(AttributeError):
+        concept.name = "Cat"
+    with pytest.raises(TypeError):
+        concept.fields["color"] = Concept("Blue")
+
+
+def test_pickle():
+    concept = Concept.from_cid("Dog{color=Red}")
+
+    assert pickle.loads(pickle.dumps(concept)) is concept
+
+
+def test_list_fields_are_not_interned():
+    concept = Concept("Pack", {"dogs": [Concept("Dog")]})
+
+    assert Concept("Pack", {"dogs": [Concept("Dog")]}) == concept
+    with pytest.raises(TypeError):
+        hash(concept)
+
+
+def test_parse_cid_skips_whitespace():
+    concept = parse_cid(" Dog { color = Red , size = Big , } ")
+
+    assert concept is Concept.from_cid("Dog{color=Red,size=Big}")
+    assert parse_cid("Dog{}") is Concept("Dog")
+
+
+@pytest.mark.parametrize("cid, position", [
+    ("Dog{color Red}", 10),
+    ("Dog{color=}", 10),
+    ("Dog{color=Red", 13),
+    ("Dog{color=Red;size=Big}", 13),
+    ("Dog{color=Red}}", 14),
+    ("{color=Red}", 0),
+])
+def test_parse_cid_error_position(cid, position):
+    with pytest.raises(CidSyntaxError) as error:
+        parse_cid(cid)
+
+    assert error.value.position == position
+    assert error.value.cid == cid
+
+
+def test_parse_deeply_nested_cid():
+    cid = "Box{inner=" * 5000 + "Dog" + "}" * 5000
+
+    concept = parse_cid(cid)
+    for _ in range(5000):
+        concept = concept.fields["inner"]
+    assert concept is Concept("Dog")
+
+
+def test_iter_cids():
+    buffer = "Dog{color=Red}, Cat\nBird{wings=Wing{size=Big}}"
+
+    assert [concept.name for concept in iter_cids(buffer)] == ["Dog", "Cat", "Bird"]
+
+
+def test_iter_cids_error_is_raised_when_reached():
+    concepts = iter_cids("Dog Cat{color=} Bird")
+
+    assert next(concepts) is Concept("Dog")
+    with pytest.raises(CidSyntaxError) as error:
+        next(concepts)
+    assert error.value.position == 14
+
+
+def test_iter_cids_across_chunks(monkeypatch):
+    monkeypatch.setattr(concept_module, "TOKEN_CHUNK_SIZE", 4)
+    buffer = "Dog{color=Red},   Elephant{size=Big}\n\n Cat{color=}"
+
+    concepts = iter_cids(buffer)
+    assert next(concepts) is Concept.from_cid("Dog{color=Red}")
+    assert next(concepts) is Concept.from_cid("Elephant{size=Big}")
+    with pytest.raises(CidSyntaxError) as error:
+        next(concepts)
+    assert error.value.position == buffer.index("}", buffer.index("Cat"))
@@ -0,0 +1,42 @@
+import pytest
+
+from src.knowledge_base import cypher
+
+
+def test_out_query_has_no_values():
+    query = cypher.out_query("fields", "OUT", (), ("name",))
+    
+    assert query == (
+        "MATCH (a)-[r:fields]->(b {name: $node_filters.name}) "
+        "WHERE id(a) = $node_id RETURN b"
+    )
+
+
+def test_out_query_directions():
+    assert "(a)<-[r:parent]-(b)" in cypher.out_query("parent", "IN")
+    assert "(a)-[r:parent]-(b)" in cypher.out_query("parent", "ANY")
+
+
+def test_templates_are_cached_per_shape():
+    first = cypher.out_query("parent", "OUT", (), cypher.filter_keys((("name", "A"),)))
+    second = cypher.out_query("parent", "OUT", (), cypher.filter_keys((("name", "B"),)))
+    
+    assert first is second
+
+
+def test_filter_keys_are_sorted():
+    assert cypher.filter_keys((("b", 1), ("a", 2))) == ("a", "b")
+    assert cypher.filter_keys(None) == ()
+    
+
+def test_invalid_identifier():
+    with pytest.raises(ValueError):
+        cypher.find_nodes_query("Concept {name: 'x'}) DETACH DELETE a //", ())
+
+
+def test_fields_of_the_concept_itself_skip_shortest_path():
+    # the concept is one of its own *0.. ancestors, shortestPath
+    # from a node to itself fails in Neo4j
+    assert "shortestPath((c)-[:parent*0..]" not in cypher.GET_FIELDS_QUERY
+    assert "CASE WHEN a = c THEN 0" in cypher.GET_FIELDS_QUERY
+    assert "shortestPath((c)-[:parent*1..]->(a))" in cypher.GET_FIELDS_QUERY
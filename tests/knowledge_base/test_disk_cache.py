@@ -0,0 +1,67 @@
+from src.knowledge_base.cache import KBCache, label_tag, node_tag
+from src.knowledge_base.disk_cache import KBDiskCache
+from src.knowledge_base.module import KBNode
+
+
+def test_entries_survive_restart(tmp_path):
+    path = str(tmp_path / "kb_cache.sqlite")
+    node = KBNode(id="4:x:1", label="Concept", data={"name": "Dog"}, metadata="{}")
+
+    cache = KBCache(store=KBDiskCache(path, version=3))
+    cache.set(("find_nodes", "Concept"), [node], [label_tag("Concept"), node_tag(node.id)])
+    cache.store.close()
+
+    restarted = KBCache(store=KBDiskCache(path, version=3))
+    assert restarted.get(("find_nodes", "Concept")) == (True, [node])
+    assert restarted.stats.store_hits == 1
+
+    # the second get is answered from memory
+    assert restarted.get(("find_nodes", "Concept")) == (True, [node])
+    assert restarted.stats.hits == 1
+
+
+def test_other_version_drops_entries(tmp_path):
+    path = str(tmp_path / "kb_cache.sqlite")
+
+    store = KBDiskCache(path, version=3)
+    store.set(("get_word", "dog"), None)
+    store.close()
+
+    store = KBDiskCache(path, version=4)
+    assert len(store) == 0
+    assert store.get(("get_word", "dog"))[0] is False
+
+
+def test_invalidate_by_tags(tmp_path):
+    cache = KBCache(store=KBDiskCache(str(tmp_path / "kb_cache.sqlite"), version=1))
+    cache.set("a", 1, [node_tag(1)])
+    cache.set("b", 2, [node_tag(1), node_tag(2)])
+    cache.set("c", 3, [node_tag(3)])
+
+    cache.invalidate(node_tag(1))
+
+    assert cache.store.get("a")[0] is False
+    assert cache.store.get("b")[0] is False
+    assert cache.store.get("c") == (True, 3, frozenset([node_tag(3)]))
+
+
+def test_advance(tmp_path):
+    store = KBDiskCache(str(tmp_path / "kb_cache.sqlite"), version=1)
+    store.set("a", 1)
+
+    # only this process wrote, the rest was invalidated by tags
+    store.advance(2)
+    assert store.version == 2
+    assert store.get("a")[0] is True
+
+    # somebody else wrote in between
+    store.advance(5)
+    assert store.version == 5
+    assert len(store) == 0
+
+
+def test_unpicklable_values_are_not_stored(tmp_path):
+    store = KBDiskCache(str(tmp_path / "kb_cache.sqlite"), version=1)
+    store.set("a", lambda: None)
+
+    assert len(store) == 0
@@ -0,0 +1,120 @@
+import pytest
+
+from src.knowledge_base.file_kb import FileKB
+from src.knowledge_base.module import (
+    KBEdgeDirection, 
+    KBEdgeType, 
+    KBNodeType, 
+    KBNotFoundError,
+)
+
+
+@pytest.fixture(scope="function")
+def path(tmp_path):
+    return str(tmp_path / "kb.akb")
+
+
+def fill(kb):
+    fruit = kb.new_concept("Fruit")
+    apple = kb.new_concept("Apple", 10, 20)
+    age = kb.new_node("Field", {"name": "age"})
+    kb.new_edge("parent", apple.id, fruit.id, {})
+    kb.new_edge("fields", fruit.id, age.id, {"order": 1})
+    return fruit, apple, age
+
+
+def test_unsaved_writes_are_readable(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    
+    assert kb.find_concept("Apple") == apple
+    assert kb.out(apple.id, KBEdgeType.PARENT) == [fruit]
+    assert kb.get_field(apple.id, "age") == age
+
+
+def test_save_and_reopen(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    kb.save()
+    kb.close()
+    
+    kb = FileKB(path)
+    assert kb.find_concept("Apple").id == apple.id
+    assert kb.find_concept("Apple").metadata == '{"x": 10, "y": 20}'
+    assert kb.find_concept("Pear", should_raise=False) is None
+    assert [node.id for node in kb.out(fruit.id, KBEdgeType.PARENT, direction=KBEdgeDirection.IN)] == [apple.id]
+    assert [node.id for node in kb.out(fruit.id, KBEdgeType.PARENT, direction=KBEdgeDirection.ANY)] == [apple.id]
+    assert kb.out(fruit.id, KBEdgeType.FIELD_NODE, edge_filters=(("order", 1),))[0].data == {"name": "age"}
+    assert kb.get_field(apple.id, "age").id == age.id
+    assert len(kb.find_nodes(KBNodeType.CONCEPT, ())) == 2
+    
+    pear = kb.new_concept("Pear")
+    assert pear.id == age.id + 1
+    
+
+def test_update_saved_node(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    kb.save()
+    
+    kb.update_node_data(apple.id, {"name": "GreenApple"})
+    
+    assert kb.find_concept("Apple", should_raise=False) is None
+    assert kb.find_concept("GreenApple").id == apple.id
+    
+    kb.save()
+    assert kb.find_concept("GreenApple").id == apple.id
+    assert kb.find_concept("Apple", should_raise=False) is None
+
+
+def test_upsert_edge(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    kb.save()
+    
+    kb.upsert_edge("parent", apple.id, fruit.id, {})
+    kb.upsert_edge("class", apple.id, fruit.id, {})
+    kb.upsert_edge("class", apple.id, fruit.id, {})
+    
+    assert len(kb.out(apple.id, KBEdgeType.PARENT)) == 1
+    assert len(kb.out(apple.id, KBEdgeType.CLASS)) == 1
+
+
+def test_missing_node(path):
+    kb = FileKB(path)
+    
+    with pytest.raises(KBNotFoundError):
+        kb.get_node(100)
+
+
+def test_delete_edge(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    kb.save()
+    pear = kb.new_concept("Pear")
+    kb.new_edge("parent", pear.id, fruit.id, {})
+
+    assert kb.delete_edge("parent", apple.id, fruit.id) == 1
+    assert kb.delete_edge("parent", pear.id, fruit.id) == 1
+    assert kb.delete_edge("parent", pear.id, fruit.id) == 0
+    assert kb.out(fruit.id, KBEdgeType.PARENT, direction=KBEdgeDirection.IN) == []
+
+    kb.save()
+    assert kb.out(apple.id, KBEdgeType.PARENT) == []
+    assert kb.get_field(fruit.id, "age").id == age.id
+
+
+def test_build_hierarchy(path):
+    kb = FileKB(path)
+    fruit, apple, age = fill(kb)
+    kb.save()
+    green = kb.new_concept("GreenApple")
+    kb.new_edge("parent", green.id, apple.id, {})
+
+    parents, children = kb.build_direct_hierarchy()
+    assert parents == {"Apple": ["Fruit"], "GreenApple": ["Apple"]}
+    assert children == {"Fruit": ["Apple"], "Apple": ["GreenApple"]}
+
+    parents, children = kb.build_hierarchy()
+    assert parents["GreenApple"] == ["Apple", "Fruit"]
+    assert children["Fruit"] == ["Apple", "GreenApple"]
@@ -0,0 +1,168 @@
+import pytest
+
+from src.knowledge_base.concept import Concept
+from src.knowledge_base.hierarchy import (
+    DictHierarchy,
+    PlainHierarchy,
+    StaticKBHierarchy,
+    SubsumptionChecker,
+    closure_hierarchy,
+    is_child,
+)
+from src.knowledge_base.in_memory_kb import InMemoryKB
+from src.knowledge_base.module import KBEdgeType
+
+
+@pytest.fixture(scope="function")
+def hierarchy():
+    kb = InMemoryKB(
+        nodes=[
+            {"id": 0, "label": "Concept", "data": {"name": "Entity"}},
+            {"id": 1, "label": "Concept", "data": {"name": "Animal"}},
+            {"id": 2, "label": "Concept", "data": {"name": "Dog"}},
+            {"id": 3, "label": "Concept", "data": {"name": "Puppy"}},
+        ],
+        edges=[
+            (1, 0, KBEdgeType.PARENT),
+            (3, 2, KBEdgeType.PARENT),
+        ],
+    )
+    hierarchy = StaticKBHierarchy(kb)
+    hierarchy.prefetch()
+    return hierarchy
+
+
+def test_prefetch(hierarchy):
+    assert hierarchy.get_parents("Puppy") == ("Dog", "Puppy")
+    assert hierarchy.get_parents("Unknown") == ("Unknown", )
+    assert hierarchy.get_children("Entity") == ("Animal", "Entity")
+
+
+def test_add_parent_updates_subtree(hierarchy):
+    version = hierarchy.version
+    hierarchy.add_parent("Dog", "Animal")
+
+    assert hierarchy.version > version
+    assert hierarchy.get_parents("Puppy") == ("Dog", "Animal", "Entity", "Puppy")
+    assert sorted(hierarchy.get_children("Entity")) == ["Animal", "Dog", "Entity", "Puppy"]
+    assert hierarchy.is_subconcept("Puppy", "Entity")
+    assert hierarchy.is_subconcept("Puppy", "Puppy")
+    assert not hierarchy.is_subconcept("Entity", "Puppy")
+
+
+def test_add_existing_parent_keeps_version(hierarchy):
+    version = hierarchy.version
+    hierarchy.add_parent("Puppy", "Dog")
+
+    assert hierarchy.version == version
+
+
+def test_remove_parent(hierarchy):
+    hierarchy.add_parent("Dog", "Animal")
+    hierarchy.remove_parent("Dog", "Animal")
+
+    assert hierarchy.get_parents("Puppy") == ("Dog", "Puppy")
+    assert hierarchy.get_parents("Dog") == ("Dog", )
+    assert hierarchy.get_children("Entity") == ("Animal", "Entity")
+    assert hierarchy.get_children("Animal") == ("Animal", )
+    assert not hierarchy.is_subconcept("Puppy", "Animal")
+
+
+def test_cycle(hierarchy):
+    hierarchy.add_parent("Dog", "Puppy")
+
+    assert hierarchy.get_parents("Dog") == ("Puppy", "Dog")
+    assert hierarchy.get_children("Dog") == ("Puppy", "Dog")
+
+
+def test_closure_of_a_diamond():
+    parents, children = closure_hierarchy({
+        "Puppy": ["Dog", "Pet"],
+        "Dog": ["Animal"],
+        "Pet": ["Animal"],
+        "Animal": ["Entity"],
+    })
+
+    assert parents["Puppy"] == ["Dog", "Animal", "Entity", "Pet"]
+    assert parents["Pet"] == ["Animal", "Entity"]
+    assert "Entity" not in parents
+    assert sorted(children["Animal"]) == ["Dog", "Pet", "Puppy"]
+
+
+def test_closure_with_cycles():
+    parents, children = closure_hierarchy({
+        "A": ["B"],
+        "B": ["C"],
+        "C": ["A", "D"],
+        "E": ["E"],
+    })
+
+    assert sorted(parents["A"]) == ["B", "C", "D"]
+    assert sorted(parents["C"]) == ["A", "B", "D"]
+    assert sorted(children["D"]) == ["A", "B", "C"]
+    assert "E" not in parents
+
+
+def test_closure_of_a_long_chain():
+    chain = {str(idx): [str(idx + 1)] for idx in range(2000)}
+    parents, _ = closure_hierarchy(chain)
+
+    assert len(parents["1998"]) == 2
+    assert len(parents["0"]) == 2000
+
+
+def test_dict_hierarchy_parents_are_memoized():
+    hierarchy = DictHierarchy(parents={
+        "Puppy": ["Dog", "Pet"],
+        "Dog": ["Animal"],
+        "Pet": ["Animal"],
+    })
+
+    parents = hierarchy.get_parents("Puppy")
+    assert parents == ("Animal", "Dog", "Pet", "Puppy")
+    assert hierarchy.get_parents("Puppy") is parents
+    assert hierarchy.get_parents("Puppy", include_self=False) == ("Animal", "Dog", "Pet")
+    assert hierarchy.get_parents("Stone") == ("Stone", )
+    assert hierarchy.get_parents_many(["Dog", "Stone"]) == {
+        "Dog": ("Animal", "Dog"),
+        "Stone": ("Stone", ),
+    }
+
+
+def test_dict_hierarchy_invalidation():
+    hierarchy = DictHierarchy(children={
+        "Animal": ["Dog"],
+    })
+    assert hierarchy.get_parents("Dog") == ("Animal", "Dog")
+
+    hierarchy.add_parent("Animal", "Entity")
+    assert hierarchy.get_parents("Dog") == ("Animal", "Dog", "Entity")
+    assert "Dog" in hierarchy.get_children("Animal")
+
+    hierarchy.remove_parent("Dog", "Animal")
+    assert hierarchy.get_parents("Dog") == ("Dog", )
+
+
+def test_subsumption_checker_matches_is_child():
+    hierarchy = PlainHierarchy()
+    checker = SubsumptionChecker(hierarchy)
+    pattern = Concept.from_cid("Dog{color=Red}")
+
+    for cid in ["Dog{color=Red,size=Big}", "Dog{color=Blue}", "Dog", "Cat{color=Red}"]:
+        concept = Concept.from_cid(cid)
+        assert checker.is_child(concept, pattern) == is_child(hierarchy, concept, pattern)
+
+    assert checker.is_child(Concept.from_cid("Dog{color=Red,size=Big}"), pattern)
+    assert checker.results.stats.hits == 1
+
+
+def test_subsumption_checker_follows_hierarchy_changes():
+    hierarchy = DictHierarchy(parents={
+        "Dog": ["Animal"],
+    })
+    checker = SubsumptionChecker(hierarchy)
+    dog = Concept("Dog")
+
+    assert not checker.is_child(dog, Concept("Entity"))
+    hierarchy.add_parent("Animal", "Entity")
+    assert checker.is_child(dog, Concept("Entity"))
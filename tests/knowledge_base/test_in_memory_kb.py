@@ -0,0 +1,133 @@
+import pytest
+
+from src.knowledge_base.in_memory_kb import InMemoryKB
+from src.knowledge_base.module import KBEdgeDirection, KBEdgeType, KBNodeType
+
+
+KB_NODES = [{
+    "id": 0,
+    "label": "Concept",
+    "data": {"name": "Fruit"},
+}, {
+    "id": 1,
+    "label": "Concept",
+    "data": {"name": "Apple"},
+}, {
+    "id": 2,
+    "label": "Concept",
+    "data": {"name": "Pear"},
+}, {
+    "id": 3,
+    "label": "Field",
+    "data": {"name": "age"},
+}, ]
+
+KB_EDGES = [
+    (1, 0, KBEdgeType.PARENT),
+    (2, 0, KBEdgeType.PARENT),
+    (0, 3, KBEdgeType.FIELD_NODE),
+]
+
+
+@pytest.fixture(scope="function")
+def kb():
+    return InMemoryKB(
+        nodes=KB_NODES,
+        edges=KB_EDGES,
+    )
+
+
+def test_out_many(kb):
+    result = kb.out_many([0, 1, 3], KBEdgeType.PARENT, direction=KBEdgeDirection.IN)
+    
+    assert sorted(node.id for node in result[0]) == [1, 2]
+    assert result[1] == []
+    assert result[3] == []
+
+
+def test_find_concepts_many(kb):
+    result = kb.find_concepts_many(["Apple", "Pear{color=Green}", "?????"])
+    
+    assert result["Apple"].id == 1
+    assert result["Pear{color=Green}"].id == 2
+    assert result["?????"] is None
+
+
+def test_find_nodes(kb):
+    assert [node.id for node in kb.find_nodes(KBNodeType.CONCEPT, (("name", "Pear"),))] == [2]
+    assert [node.id for node in kb.find_nodes(KBNodeType.FIELD, ())] == [3]
+    assert kb.find_nodes(KBNodeType.FIELD, (("name", "Pear"),)) == []
+
+
+def test_get_field_inherited(kb):
+    assert kb.get_field(1, "age").id == 3
+    assert kb.get_field(1, "color") is None
+    assert kb.get_fields(2) == {"age": kb.get_field(0, "age")}
+    
+    
+def test_get_field_nearest_wins():
+    kb = InMemoryKB(
+        nodes=KB_NODES + [{"id": 4, "label": "Field", "data": {"name": "age"}}],
+        edges=KB_EDGES + [(1, 4, KBEdgeType.FIELD_NODE)],
+    )
+    
+    assert kb.get_field(1, "age").id == 4
+    assert kb.get_field(2, "age").id == 3
+
+
+def test_writes(kb):
+    cherry = kb.upsert_concept("Cherry")
+    assert kb.upsert_concept("Cherry") == cherry
+    
+    kb.upsert_edge("parent", cherry.id, 0, {})
+    kb.upsert_edge("parent", cherry.id, 0, {})
+    
+    assert kb.get_node(cherry.id) == cherry
+    assert kb.out(cherry.id, KBEdgeType.PARENT) == [kb.get_node(0)]
+    assert kb.get_field(cherry.id, "age").id == 3
+    
+    kb.update_node_data(3, {"name": "weight"})
+    assert kb.get_field(cherry.id, "age") is None
+    assert kb.get_field(cherry.id, "weight").id == 3
+
+
+def test_delete_edge(kb):
+    assert kb.delete_edge("parent", 1, 0) == 1
+    assert kb.delete_edge("parent", 1, 0) == 0
+    
+    assert [node.id for node in kb.out(0, KBEdgeType.PARENT, direction=KBEdgeDirection.IN)] == [2]
+    assert kb.get_field(1, "age") is None
+
+
+def test_edges_without_edge_type(kb):
+    # e.g. the labels of the ActOnEntity reactions
+    edge = kb.new_edge("act", 1, 2, {})
+    assert edge.label == "act"
+    assert kb.upsert_edge("act", 1, 2, {}).id == edge.id
+    assert kb.delete_edge("act", 1, 2) == 1
+
+
+def test_concepts_are_written_by_name(kb):
+    cherry = kb.new_concept("Cherry{color: Red}")
+    assert cherry.data["name"] == "Cherry"
+    assert kb.upsert_concept("Cherry{color: Red}") == cherry
+
+
+def test_edge_types_are_written_by_label(kb):
+    cherry = kb.new_concept("Cherry")
+    kb.new_edge(KBEdgeType.PARENT, cherry.id, 0, {})
+    assert kb.upsert_edge(KBEdgeType.PARENT, cherry.id, 0, {}).id == len(kb.edges) - 1
+    assert kb.edges[-1][2] == "parent"
+    assert kb.delete_edge(KBEdgeType.PARENT, cherry.id, 0) == 1
+
+
+def test_update_keeps_meta_out_of_data(kb):
+    node = kb.update_node_data(1, {"_meta": '{"x": 1}'})
+    assert node.data == {"name": "Apple"}
+    assert node.metadata == '{"x": 1}'
+    assert kb.update_node_data(1, {"name": "GreenApple"}).metadata == '{"x": 1}'
+
+
+def test_get_fields_returns_a_copy(kb):
+    kb.get_fields(1)["color"] = kb.get_node(2)
+    assert kb.get_field(1, "color") is None
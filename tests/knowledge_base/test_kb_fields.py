@@ -0,0 +1,69 @@
+import contextlib
+
+import pytest
+
+from src.knowledge_base import module
+from src.knowledge_base.cache import node_tag
+from src.knowledge_base.module import KnowledgeBase
+
+
+class RawNode(dict):
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+class FakeDb:
+    def __init__(self):
+        self.transaction = contextlib.nullcontext()
+        self.fields_queries = 0
+        self.seq = 0
+
+    def cypher_query(self, query, params=None):
+        if "CREATE (c:KBChange" in query:
+            self.seq += 1
+            return [[self.seq]], None
+        if "[:fields]" in query:
+            self.fields_queries += 1
+            # nearest first, Dog overrides the sound of Animal
+            return [
+                ["sound", RawNode("11", "Field", {"name": "sound"})],
+                ["legs", RawNode("12", "Field", {"name": "legs"})],
+                ["sound", RawNode("21", "Field", {"name": "sound"})],
+            ], None
+        if "MATCH (a), (b)" in query:
+            return [[
+                RawNode("e", "fields", {}),
+                RawNode("1", "Concept", {"name": "Dog"}),
+                RawNode("13", "Field", {"name": "tail"}),
+            ]], None
+        return [], None
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # KnowledgeBase is an AgentModule, which needs the agent's main module
+    pytest.importorskip("main")
+    db = FakeDb()
+    monkeypatch.setattr(module, "KB_ENSURE_SCHEMA", False)
+    monkeypatch.setattr(module, "db", db)
+    return db
+
+
+def test_nearest_field_wins_and_is_cached(fake_db):
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+
+    assert kb.get_field("1", "sound").id == "11"
+    assert set(kb.get_fields("1")) == {"sound", "legs"}
+    assert kb.get_field("1", "tail") is None
+    assert fake_db.fields_queries == 1
+
+    # a new field of any concept can be inherited
+    kb.new_edge("fields", 1, 13, {})
+    kb.get_fields("1")
+    assert fake_db.fields_queries == 2
+
+    kb.cache.invalidate(node_tag("12"))
+    kb.get_fields("1")
+    assert fake_db.fields_queries == 3
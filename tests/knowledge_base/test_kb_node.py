@@ -0,0 +1,53 @@
+import gc
+import pickle
+
+from src.knowledge_base.module import KBIdentityMap, KBNode
+
+
+class RawNode(dict):
+    """ Same interface as a neo4j Node for KBNode.create """
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+def test_create_decodes_lazily():
+    raw = RawNode("4:x:1", "Concept", {"name": "Dog", "_meta": '{"x": 10, "y": 20}'})
+
+    node = KBNode.create(raw)
+    assert node._data is None
+
+    assert node.data == {"name": "Dog"}
+    assert node.metadata == '{"x": 10, "y": 20}'
+    assert node.meta == {"x": 10, "y": 20}
+    assert node == KBNode("4:x:1", "Concept", {"name": "Dog"}, '{"x": 10, "y": 20}')
+
+
+def test_node_without_meta():
+    node = KBNode.create(RawNode("4:x:1", "Word", {"value": "dog"}))
+
+    assert node.metadata == {}
+    assert node.meta == {}
+    assert KBNode(id="4:x:1", label="Word", data={"value": "dog"}) == node
+
+
+def test_identity_map_reuses_and_refreshes_nodes():
+    identity_map = KBIdentityMap()
+
+    node = KBNode.create(RawNode("4:x:1", "Concept", {"name": "Dog"}), identity_map)
+    assert node.data == {"name": "Dog"}
+
+    same = KBNode.create(RawNode("4:x:1", "Concept", {"name": "Dog", "age": 3}), identity_map)
+    assert same is node
+    assert node.data == {"name": "Dog", "age": 3}
+
+    del node, same
+    gc.collect()
+    assert len(identity_map) == 0
+
+
+def test_pickle():
+    node = KBNode.create(RawNode("4:x:1", "Concept", {"name": "Dog", "_meta": "{}"}))
+
+    assert pickle.loads(pickle.dumps(node)) == node
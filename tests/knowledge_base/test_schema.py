@@ -0,0 +1,63 @@
+import contextlib
+import sys
+
+import pytest
+from neo4j.exceptions import ClientError
+
+from src.knowledge_base import module, schema
+from src.knowledge_base.module import KB_CHANGE_LOG_KEYS, KBIntegrityError, check_schema, ensure_schema
+
+
+class FakeDb:
+    def __init__(self, constraints, duplicates=()):
+        self.transaction = contextlib.nullcontext()
+        self.constraints = constraints
+        self.duplicates = duplicates
+        self.created = []
+
+    def cypher_query(self, query, params=None):
+        if query.startswith("SHOW CONSTRAINTS"):
+            return [[[label], [key], "UNIQUENESS"] for label, key in self.constraints], None
+        if query.startswith("CREATE CONSTRAINT"):
+            label = query.split("(a:")[1].split(")")[0]
+            if label in self.duplicates:
+                raise ClientError(f"There are duplicate :{label} nodes")
+            self.created.append(label)
+        return [], None
+
+
+def test_creates_missing_constraints(monkeypatch):
+    db = FakeDb([("Concept", "name"), ("KBMeta", "key")])
+    monkeypatch.setattr(module, "db", db)
+
+    assert check_schema() == [("Word", "value"), ("KBChange", "seq")]
+    assert ensure_schema() == [("Word", "value"), ("KBChange", "seq")]
+    assert db.created == ["Word", "KBChange"]
+
+
+def test_raises_for_constraints_that_cant_be_created(monkeypatch):
+    db = FakeDb([], duplicates=["Concept"])
+    monkeypatch.setattr(module, "db", db)
+
+    with pytest.raises(KBIntegrityError, match="Concept.name"):
+        ensure_schema()
+    # the other constraints are still created
+    assert db.created == ["Word", "KBMeta", "KBChange"]
+
+
+def test_change_log_constraints_alone(monkeypatch):
+    # the shared cache refresher doesn't fail on duplicate concepts
+    db = FakeDb([("KBMeta", "key")], duplicates=["Concept"])
+    monkeypatch.setattr(module, "db", db)
+
+    assert ensure_schema(KB_CHANGE_LOG_KEYS) == [("KBChange", "seq")]
+    assert db.created == ["KBChange"]
+
+
+def test_cli_needs_no_knowledge_base(monkeypatch, capsys):
+    monkeypatch.setattr(module, "db", FakeDb([("KBMeta", "key")]))
+    monkeypatch.setattr(module, "KnowledgeBase", None)
+    monkeypatch.setattr(sys, "argv", ["schema"])
+
+    schema.main()
+    assert "created: Word.value" in capsys.readouterr().out
@@ -0,0 +1,137 @@
+from src.knowledge_base.cache import KBCache, label_tag, node_tag
+from src.knowledge_base.hierarchy import SharedKBHierarchy, closure_hierarchy
+from src.knowledge_base.module import KBNode
+from src.knowledge_base.shared_cache import SharedKBCache, write_shared_cache
+
+
+DIRECT_PARENTS = {
+    "Dog": ["Mammal"],
+    "Cat": ["Mammal"],
+    "Mammal": ["Animal"],
+}
+
+
+class FakeKB:
+    def __init__(self, direct_parents):
+        self.direct_parents = direct_parents
+        self.reads = []
+
+    def get_ancestor_names(self, name):
+        self.reads.append(name)
+        parents, _ = closure_hierarchy(self.direct_parents)
+        return tuple(parents.get(name, ()))
+
+    def get_descendant_names(self, name):
+        self.reads.append(name)
+        _, children = closure_hierarchy(self.direct_parents)
+        return tuple(children.get(name, ()))
+
+
+def publish(path, version, entries=(), direct_parents=DIRECT_PARENTS):
+    parents, children = closure_hierarchy(direct_parents)
+    write_shared_cache(path, version, parents, children, entries)
+
+
+def test_hierarchy_lookups(tmp_path):
+    path = str(tmp_path / "shared.kbcache")
+    publish(path, 1)
+    shared = SharedKBCache(path)
+
+    assert shared.version == 1
+    assert shared.ancestors("Dog") == ("Animal", "Mammal")
+    assert set(shared.descendants("Animal")) == {"Mammal", "Dog", "Cat"}
+    assert shared.ancestors("Unknown") == ()
+    assert shared.is_ancestor("Dog", "Animal")
+    assert not shared.is_ancestor("Animal", "Dog")
+    shared.close()
+
+
+def test_entries_and_hidden_tags(tmp_path):
+    path = str(tmp_path / "shared.kbcache")
+    node = KBNode(id="4:x:1", label="Concept", data={"name": "Dog"}, metadata="{}")
+    publish(path, 1, [
+        (("find_nodes", "Concept"), [node], frozenset([label_tag("Concept"), node_tag(node.id)])),
+        (("get_word", "dog"), None, frozenset([label_tag("Word")])),
+    ])
+
+    cache = KBCache(store=SharedKBCache(path))
+    assert cache.get(("find_nodes", "Concept")) == (True, [node])
+    assert cache.get(("get_word", "dog")) == (True, None)
+    assert cache.get(("get_word", "cat")) == (False, None)
+
+    # this process wrote a Concept, the file doesn't have it yet
+    cache.invalidate(label_tag("Concept"))
+    cache.store.advance(2)
+    assert cache.get(("find_nodes", "Concept")) == (False, None)
+    assert cache.get(("get_word", "dog")) == (True, None)
+
+    publish(path, 2, [
+        (("find_nodes", "Concept"), [], frozenset([label_tag("Concept")])),
+    ])
+    assert cache.store.refresh()
+    assert cache.get(("find_nodes", "Concept")) == (True, [])
+    cache.store.close()
+
+
+def test_changes_are_read_from_the_kb_until_published(tmp_path):
+    path = str(tmp_path / "shared.kbcache")
+    publish(path, 1)
+    direct_parents = {**DIRECT_PARENTS, "Puppy": ["Dog"]}
+    shared = SharedKBCache(path)
+    hierarchy = SharedKBHierarchy(shared, FakeKB(direct_parents))
+    hierarchy.prefetch()
+
+    assert hierarchy.get_parents("Dog") == ("Animal", "Mammal", "Dog")
+    assert not hierarchy.is_subconcept("Puppy", "Animal")
+    version = hierarchy.version
+
+    # the kb has no build_direct_hierarchy, the whole hierarchy isn't loaded
+    hierarchy.apply_change([("Puppy", "Dog")], seq=2)
+    assert hierarchy.is_subconcept("Puppy", "Animal")
+    assert hierarchy.version != version
+    assert "Puppy" in hierarchy.overridden
+
+    publish(path, 2, direct_parents=direct_parents)
+    shared.refresh()
+    assert hierarchy.is_subconcept("Puppy", "Animal")
+    assert hierarchy.overridden == {}
+
+
+def test_only_moved_concepts_are_read_from_the_kb(tmp_path):
+    path = str(tmp_path / "shared.kbcache")
+    publish(path, 1)
+    direct_parents = {**DIRECT_PARENTS, "Puppy": ["Dog"], "Animal": ["Entity"]}
+    shared = SharedKBCache(path)
+    kb = FakeKB(direct_parents)
+    hierarchy = SharedKBHierarchy(shared, kb)
+    hierarchy.prefetch()
+    version = hierarchy.version
+
+    hierarchy.apply_change([("Animal", "Entity")], seq=2)
+    assert hierarchy.version != version
+    # the moved concepts are read from the kb, which is ahead of the log
+    assert hierarchy.is_subconcept("Dog", "Entity")
+    assert set(hierarchy.get_children("Entity")) == {"Entity", "Animal", "Mammal", "Dog", "Cat", "Puppy"}
+    # the others from the file
+    reads = len(kb.reads)
+    assert hierarchy.get_parents("Snake") == ("Snake", )
+    assert len(kb.reads) == reads
+
+    hierarchy.apply_change([("Puppy", "Dog")], seq=3)
+    assert hierarchy.get_parents("Puppy") == ("Dog", "Mammal", "Animal", "Entity", "Puppy")
+
+    publish(path, 3, direct_parents=direct_parents)
+    shared.refresh()
+    reads = len(kb.reads)
+    assert hierarchy.is_subconcept("Puppy", "Entity")
+    assert hierarchy.overridden == {}
+    assert len(kb.reads) == reads
+
+
+def test_missing_file_reads_from_the_kb(tmp_path):
+    kb = FakeKB(DIRECT_PARENTS)
+    hierarchy = SharedKBHierarchy(SharedKBCache(str(tmp_path / "missing")), kb)
+    hierarchy.prefetch()
+
+    assert hierarchy.is_subconcept("Dog", "Animal")
+    assert kb.reads == ["Dog"]
@@ -0,0 +1,120 @@
+import contextlib
+
+import pytest
+
+from src.knowledge_base import module, snapshot
+from src.knowledge_base.cache import encode_tag, label_tag, node_tag
+from src.knowledge_base.module import KBEdgeDirection, KBEdgeType, encode_parent_edges
+
+
+class RawNode(dict):
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+class RawEdge(dict):
+    def __init__(self, element_id, edge_type, start_node, end_node):
+        super().__init__()
+        self.element_id = element_id
+        self.type = edge_type
+        self.start_node = start_node
+        self.end_node = end_node
+
+
+ANIMAL = RawNode("1", "Concept", {"name": "Animal"})
+CAT = RawNode("3", "Concept", {"name": "Cat"})
+
+
+class FakeDb:
+    """ Neo4j with a single Animal concept, answers the bulk merge queries
+    and has the changes of other processes in log
+    """
+    def __init__(self):
+        self.transaction = contextlib.nullcontext()
+        self.seq = 0
+        self.log = []
+        self.queries = []
+        # a change that another process logs while the graph is read
+        self.concurrent_change = None
+
+    def cypher_query(self, query, params=None):
+        self.queries.append(query)
+        if query == snapshot.SNAPSHOT_NODES_QUERY:
+            return [[ANIMAL]], None
+        if query == snapshot.SNAPSHOT_EDGES_QUERY:
+            if self.concurrent_change is not None:
+                self.log.append(self.concurrent_change)
+            return [], None
+        if "KBMeta" in query and "CREATE" not in query:
+            return ([[self.log[-1][0]]] if self.log else []), None
+        if query == snapshot.SNAPSHOT_NODES_BY_ID_QUERY:
+            assert params["node_ids"] == [3]
+            return [[CAT, [[RawEdge("e", "parent", CAT, ANIMAL), ANIMAL]]]], None
+        if "c.seq > $seq" in query:
+            return [row for row in self.log if row[0] > params["seq"]], None
+        if "CREATE (c:KBChange" in query:
+            self.seq += 1
+            return [[self.seq]], None
+        if "MERGE (a)-[r" in query:
+            return [[row["start"], row["end"], 2, 1] for row in params["rows"]], None
+        if "MERGE (a:Concept" in query:
+            return [[row["key"], RawNode("2", "Concept", row["props"])] for row in params["rows"]], None
+        return [], None
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # KnowledgeBase is an AgentModule, which needs the agent's main module
+    pytest.importorskip("main")
+    db = FakeDb()
+    monkeypatch.setattr(module, "KB_ENSURE_SCHEMA", False)
+    monkeypatch.setattr(module, "db", db)
+    monkeypatch.setattr(snapshot, "db", db)
+    return db
+
+
+@pytest.fixture
+def kb(fake_db):
+    return snapshot.SnapshotKnowledgeBase(None, cache_path=None, shared_cache_path=None)
+
+
+def cat_change(seq):
+    tags = [encode_tag(tag) for tag in (label_tag("Concept"), node_tag(3))]
+    return [seq, tags, encode_parent_edges([("Cat", "Animal")]), None]
+
+
+def test_bulk_upsert_is_mirrored(kb):
+    kb.bulk_upsert(
+        nodes=[("Concept", {"name": "Dog"})],
+        edges=[("parent", "Dog", "Animal"), ("parent", "Dog", "Animal")],
+    )
+
+    assert kb.find_concept("Dog").id == "2"
+    assert [node.id for node in kb.out(1, KBEdgeType.PARENT, direction=KBEdgeDirection.IN)] == ["2"]
+
+
+def test_changes_of_other_processes_are_applied_to_the_index(kb):
+    db = snapshot.db
+    db.log.append(cat_change(1))
+
+    assert kb.poll_changes() == 1
+    assert kb.find_concept("Cat").id == "3"
+    assert [node.id for node in kb.out(3, KBEdgeType.PARENT)] == ["1"]
+    assert kb.hierarchy.is_subconcept("Cat", "Animal")
+    assert db.queries.count(snapshot.SNAPSHOT_NODES_QUERY) == 1
+
+    # changes before 3 were pruned, the graph is loaded again
+    db.log = [cat_change(3)]
+    assert kb.poll_changes() == 1
+    assert db.queries.count(snapshot.SNAPSHOT_NODES_QUERY) == 2
+
+
+def test_writes_while_the_graph_is_read_are_polled(fake_db):
+    fake_db.concurrent_change = cat_change(1)
+    kb = snapshot.SnapshotKnowledgeBase(None, cache_path=None, shared_cache_path=None)
+    assert kb.find_concept("Cat", should_raise=False) is None
+
+    assert kb.poll_changes() == 1
+    assert kb.find_concept("Cat").id == "3"
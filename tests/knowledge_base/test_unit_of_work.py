@@ -0,0 +1,68 @@
+import pytest
+
+from src.knowledge_base.in_memory_kb import InMemoryKB
+from src.knowledge_base.module import KBEdgeType, KBNodeType
+from src.knowledge_base.unit_of_work import TempId, UnitOfWorkError
+
+
+@pytest.fixture(scope="function")
+def kb():
+    return InMemoryKB(
+        nodes=[{
+            "id": 0,
+            "label": "Concept",
+            "data": {"name": "Animal"},
+        }],
+        edges=[],
+    )
+
+
+def test_writes_are_buffered_until_commit(kb):
+    uow = kb.unit_of_work()
+    dog = uow.upsert_concept("Dog")
+    animal = uow.upsert_concept("Animal")
+    uow.upsert_edge("parent", dog.id, animal.id, {})
+
+    assert isinstance(dog.id, TempId)
+    assert kb.find_concept("Dog", should_raise=False) is None
+
+    uow.commit()
+
+    dog_id = uow.resolve(dog.id)
+    assert uow.resolve(animal.id) == 0
+    assert kb.find_concept("Dog").id == dog_id
+    assert [node.id for node in kb.out(dog_id, KBEdgeType.PARENT)] == [0]
+
+
+def test_merged_nodes_are_deduplicated(kb):
+    with kb.unit_of_work() as uow:
+        first = uow.upsert_concept("Cat")
+        second = uow.upsert_concept("Cat{color=Black}")
+        uow.upsert_edge("parent", first.id, 0, {})
+        uow.upsert_edge("parent", second.id, 0, {})
+
+    assert first.id == second.id
+    assert len(uow.edges) == 1
+    assert len(kb.find_nodes(KBNodeType.CONCEPT, (("name", "Cat"),))) == 1
+
+
+def test_updates_of_new_nodes_are_folded_into_create(kb):
+    uow = kb.unit_of_work()
+    node = uow.new_node("Concept", {"name": "Fish"})
+    uow.update_node_data(node.id, {"color": "Silver"})
+    uow.update_node_data(0, {"color": "Any"})
+    uow.commit()
+
+    assert kb.get_node(uow.resolve(node.id)).data == {"name": "Fish", "color": "Silver"}
+    assert kb.get_node(0).data["color"] == "Any"
+
+
+def test_rollback_on_error(kb):
+    with pytest.raises(RuntimeError):
+        with kb.unit_of_work() as uow:
+            uow.upsert_concept("Bird")
+            raise RuntimeError()
+
+    assert kb.find_concept("Bird", should_raise=False) is None
+    with pytest.raises(UnitOfWorkError):
+        uow.upsert_concept("Bird")
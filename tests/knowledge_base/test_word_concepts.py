@@ -0,0 +1,82 @@
+import contextlib
+
+import pytest
+
+from src.knowledge_base import module
+from src.knowledge_base.module import KnowledgeBase
+
+
+class RawNode(dict):
+    def __init__(self, element_id, label, properties):
+        super().__init__(properties)
+        self.element_id = element_id
+        self.labels = frozenset([label])
+
+
+class FakeDb:
+    words = {"led": ["LED"], "turn": ["TurnOn", "TurnOff"], "the": []}
+
+    def __init__(self):
+        self.transaction = contextlib.nullcontext()
+        self.word_queries = 0
+        self.seq = 0
+
+    def cypher_query(self, query, params=None):
+        if "CREATE (c:KBChange" in query:
+            self.seq += 1
+            return [[self.seq]], None
+        if "UNWIND $values" in query:
+            self.word_queries += 1
+            return [[word, self.words[word]] for word in params["values"] if word in self.words], None
+        if "MATCH (a:Word) OPTIONAL" in query:
+            self.word_queries += 1
+            return [[word, concepts] for word, concepts in self.words.items()], None
+        if "CREATE (a)-[r:associated" in query:
+            return [[
+                RawNode("e", "associated", {}),
+                RawNode("1", "Word", {"value": "led"}),
+                RawNode("2", "Concept", {"name": "Light"}),
+            ]], None
+        return [], None
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # KnowledgeBase is an AgentModule, which needs the agent's main module
+    pytest.importorskip("main")
+    db = FakeDb()
+    monkeypatch.setattr(module, "KB_ENSURE_SCHEMA", False)
+    monkeypatch.setattr(module, "db", db)
+    return db
+
+
+def test_sentence_in_one_query(fake_db):
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+
+    assert kb.get_word_concepts_many(["turn", "on", "the", "led", "led"]) == {
+        "turn": ["TurnOn", "TurnOff"],
+        "on": [],
+        "the": [],
+        "led": ["LED"],
+    }
+    assert fake_db.word_queries == 1
+
+    concepts = kb.get_word_concepts_many(["on", "off"])
+    concepts["on"].append("On")
+    assert concepts["off"] == []
+    concepts = kb.get_word_concepts_many(["led"])
+    concepts["led"].append("Light")
+    assert fake_db.words["led"] == ["LED"]
+
+
+def test_dictionary_is_loaded_again_after_writes(fake_db):
+    kb = KnowledgeBase(None, cache_path=None, shared_cache_path=None)
+    assert not kb.word_concepts_loaded()
+
+    assert kb.word_concepts()["led"] == ("LED", )
+    assert kb.word_concepts()["turn"] == ("TurnOn", "TurnOff")
+    assert kb.word_concepts_loaded()
+    assert fake_db.word_queries == 1
+
+    kb.new_edge("associated", 1, 2, {})
+    assert not kb.word_concepts_loaded()